@@ -0,0 +1,666 @@
+#############################################
+# Offline benchmark of ingestion and question
+# answering, without Cosmos DB and Azure OpenAI:
+#  - a synthetic C++ corpus of configurable size
+#    (namespaces, class hierarchies, templates,
+#    overloads) is generated with its compile_commands.json,
+#  - it is ingested into the embedded graph (memory_graph.py)
+#    behind a client which counts round trips and bytes
+#    (and optionally throttles like Cosmos DB, --ru-limit),
+#  - questions go through the asyncio QA service with a
+#    stubbed LLM which answers with canned queries
+#    (substring searches use the trigram index built
+#    during the ingestion, unless --no-trigram-index, and
+#    the question is searched in the vector index over the
+#    signatures and doc comments, unless --no-vector-index).
+# The report (cursors/s, vertices and edges per second,
+# submits per vertex, peak RSS, question latencies) is
+# saved as JSON and can be compared with a baseline.
+#
+# Usage:
+#   python benchmark.py [--namespaces 4] [--classes 16] ... [--output report.json] [--compare baseline.json]
+# LIBCLANG_PATH selects the libclang library (see process_cl_file_to_db.py).
+#############################################
+
+from memory_graph import MemoryGraph, MemoryResultSet, FailedResultSet
+from gremlin_writer import GremlinBulkWriter
+from graph_catalog import CatalogCollector
+from graph_metadata import publish_graph_metadata, GRAPH_METADATA_LABEL
+from document_index import DocumentIndexCollector
+from trigram_index import TrigramIndexBuilder
+from vector_index import VectorIndexBuilder, HashingEmbedder
+from compile_commands import load_compile_commands
+from metrics import metrics
+from query_cache import QueryCache
+from qa_prompts import code_advisor_system_message
+from concurrent.futures import Future
+from types import SimpleNamespace
+import process_cl_file_to_db as ingester
+import qa_service
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+#############################################
+### 0. Input
+#############################################
+
+# Size of the synthetic corpus (every translation unit includes every namespace header)
+corpus_namespaces = 4
+corpus_classes = 16 # per namespace
+corpus_methods = 4 # per class
+corpus_overloads = 3 # per method
+corpus_templates = 2 # per namespace
+corpus_inheritance_depth = 4
+corpus_translation_units = 8
+
+# Ingestion worker processes, 0 runs the sequential path
+ingest_workers = 0
+
+# Every question is asked qa_rounds times, qa_concurrency at a time;
+# the first round generates the queries, the later ones hit the query cache
+qa_rounds = 3
+qa_concurrency = 8
+# Simulated latency of one LLM request (seconds)
+llm_latency = 0.0
+
+# Provisioned RU/s simulated by the Gremlin stand-in (None: no throttling) and
+# the RU/s budget of the bulk writer (None: the ingester's gremlin_ru_budget)
+simulated_ru_limit = None
+writer_ru_budget = None
+
+# Relative change of a metric in the wrong direction reported as a regression by --compare
+regression_tolerance = 0.10
+
+report_path = "benchmark_report.json"
+
+#############################################
+### 1. Synthetic C++ corpus
+#############################################
+
+parameter_types = ['int', 'double', 'long', 'float', 'char']
+
+def get_class_name(namespace, number):
+    return f"Class{namespace}_{number}"
+
+# Classes form inheritance chains of inheritance_depth classes
+def get_base_class_number(number, inheritance_depth):
+    if inheritance_depth > 1 and number % inheritance_depth:
+        return number - 1
+    return None
+
+# Parameters of an overload: overload o of a method takes o + 1 parameters
+def get_overload_parameters(overload):
+    return [(parameter_types[(p + overload) % len(parameter_types)], f"a{p}") for p in range(overload + 1)]
+
+def format_parameters(parameters):
+    return ', '.join(f"{parameter_type} {parameter_name}" for parameter_type, parameter_name in parameters)
+
+def generate_header(namespace, classes, methods, overloads, templates, inheritance_depth):
+    lines = ["#pragma once", "", f"namespace bench_ns{namespace} {{", ""]
+
+    for t in range(templates):
+        lines += [
+            "template <typename T, int Size>",
+            f"class Box{namespace}_{t} {{",
+            "public:",
+            "    T get(int index) const { return values[index % Size]; }",
+            "    void set(int index, T value) { values[index % Size] = value; }",
+            "private:",
+            "    T values[Size];",
+            "};",
+            ""]
+
+    lines += [f"enum class Kind{namespace} {{ First, Second, Third }};", ""]
+
+    for c in range(classes):
+        name = get_class_name(namespace, c)
+        base = get_base_class_number(c, inheritance_depth)
+        lines.append(f"class {name}" + (f" : public {get_class_name(namespace, base)} {{" if base is not None else " {"))
+        lines += ["public:", f"    {name}();", f"    virtual ~{name}();"]
+        for m in range(methods):
+            for o in range(overloads):
+                lines.append(f"    int method{m}({format_parameters(get_overload_parameters(o))});")
+        lines += ["protected:", "    int field0;", "    double field1;", f"    Kind{namespace} kind;", "};", ""]
+
+    lines += [f"int compute{namespace}(int value);", f"double compute{namespace}(double value);", "", "}", ""]
+    return '\n'.join(lines)
+
+# Method definitions of every translation_units-th class, the bodies use the templates
+def generate_source(number, namespaces, classes, methods, overloads, templates, translation_units):
+    lines = [f'#include "ns{n}.hpp"' for n in range(namespaces)] + [""]
+
+    for n in range(namespaces):
+        lines += [f"namespace bench_ns{n} {{", ""]
+
+        for c in range(number, classes, translation_units):
+            name = get_class_name(n, c)
+            lines += [f"{name}::{name}() : field0(0), field1(0.0), kind(Kind{n}::First) {{}}", f"{name}::~{name}() {{}}", ""]
+            for m in range(methods):
+                for o in range(overloads):
+                    parameters = get_overload_parameters(o)
+                    lines.append(f"int {name}::method{m}({format_parameters(parameters)}) {{")
+                    lines.append("    int result = field0;")
+                    for _, parameter in parameters:
+                        lines.append(f"    result += static_cast<int>({parameter});")
+                    if templates:
+                        lines += [f"    Box{n}_{(m + o) % templates}<int, 4> box;", "    box.set(result, result);", "    result = box.get(result);"]
+                    lines += ["    return result;", "}", ""]
+
+        if n % translation_units == number:
+            lines += [f"int compute{n}(int value) {{ return value * 2; }}",
+                      f"double compute{n}(double value) {{ return value * 2.0; }}", ""]
+
+        lines += ["}", ""]
+
+    return '\n'.join(lines)
+
+# Writes the corpus into directory, returns the path of its compile_commands.json
+def generate_corpus(directory, namespaces, classes, methods, overloads, templates, inheritance_depth, translation_units):
+    include_directory = os.path.join(directory, "include")
+    source_directory = os.path.join(directory, "src")
+    os.makedirs(include_directory, exist_ok=True)
+    os.makedirs(source_directory, exist_ok=True)
+
+    for n in range(namespaces):
+        with open(os.path.join(include_directory, f"ns{n}.hpp"), 'w', encoding='utf-8') as f:
+            f.write(generate_header(n, classes, methods, overloads, templates, inheritance_depth))
+
+    entries = []
+    for number in range(translation_units):
+        file_name = f"src/tu{number}.cpp"
+        with open(os.path.join(directory, file_name), 'w', encoding='utf-8') as f:
+            f.write(generate_source(number, namespaces, classes, methods, overloads, templates, translation_units))
+        entries.append({"directory": directory, "file": file_name, "arguments": ["clang++", "-Iinclude", "-c", file_name]})
+
+    compile_commands_path = os.path.join(directory, "compile_commands.json")
+    with open(compile_commands_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=2)
+    return compile_commands_path
+
+#############################################
+### 2. Gremlin stand-in
+#############################################
+
+# gremlin_python Client compatible wrapper (of a MemoryGraph or a ThrottlingGremlinClient) which counts
+# round trips, the bytes of requests (query and bindings) and responses (results as JSON) and the time spent
+class CountingGremlinClient:
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.round_trips = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.seconds = 0.0
+
+    def submit(self, message, bindings=None, request_options=None):
+        start = time.perf_counter()
+        result_set = self.client.submit(message, bindings, request_options)
+        seconds = time.perf_counter() - start
+
+        request_bytes = len(message.encode('utf-8')) + len(json.dumps(bindings or {}, default=str).encode('utf-8'))
+        response_bytes = len(json.dumps(result_set.results, default=str).encode('utf-8'))
+        with self.lock:
+            self.round_trips += 1
+            self.request_bytes += request_bytes
+            self.response_bytes += response_bytes
+            self.seconds += seconds
+        return result_set
+
+    def submit_async(self, message, bindings=None, request_options=None):
+        future = Future()
+        future.set_result(self.submit(message, bindings, request_options))
+        return future
+
+    def close(self):
+        self.client.close()
+
+    def get_counts(self):
+        return {
+            "round_trips": self.round_trips,
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "graph_seconds": round(self.seconds, 4)
+        }
+
+# Error of a throttled request, with the status attributes Cosmos DB sends along with it
+class ThrottledRequestError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("RequestRateTooLarge: request rate is large, retry later")
+        self.status_code = 500
+        # Cosmos DB sends the retry-after time as a .NET TimeSpan
+        self.status_attributes = {
+            "x-ms-status-code": 429,
+            "x-ms-retry-after-ms": f"00:00:{retry_after:010.7f}",
+            "x-ms-request-charge": 0.0
+        }
+
+# Simulates the request unit budget of a Cosmos DB container in front of a MemoryGraph: every
+# mutation costs ru_per_mutation (reads ru_per_request), a request which does not fit into the
+# RU left in the current second fails with 429 and the time after which it would fit.
+# With apply_throttled a throttled mutation is still executed before it fails, like a
+# multi-mutation traversal which was stopped in the middle; retries then have to be idempotent.
+class ThrottlingGremlinClient:
+    def __init__(self, graph, ru_per_second, ru_per_mutation=10.0, ru_per_request=1.0, apply_throttled=True):
+        self.graph = graph
+        self.ru_per_second = float(ru_per_second)
+        self.ru_per_mutation = ru_per_mutation
+        self.ru_per_request = ru_per_request
+        self.apply_throttled = apply_throttled
+        self.tokens = self.ru_per_second
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.throttled = 0
+        self.request_charge = 0.0
+
+    def get_charge(self, message):
+        mutations = message.count("addV(") + message.count("addE(")
+        return self.ru_per_request + self.ru_per_mutation * mutations
+
+    def submit(self, message, bindings=None, request_options=None):
+        charge = self.get_charge(message)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.ru_per_second, self.tokens + (now - self.updated) * self.ru_per_second)
+            self.updated = now
+            throttled = self.tokens < min(charge, self.ru_per_second)
+            if throttled:
+                self.throttled += 1
+                retry_after = (min(charge, self.ru_per_second) - self.tokens) / self.ru_per_second
+            else:
+                self.tokens -= charge
+                self.request_charge += charge
+
+        if throttled:
+            if self.apply_throttled and charge > self.ru_per_request:
+                self.graph.submit(message, bindings, request_options)
+            return FailedResultSet(ThrottledRequestError(retry_after))
+
+        result_set = self.graph.submit(message, bindings, request_options)
+        if isinstance(result_set, MemoryResultSet) and not isinstance(result_set, FailedResultSet):
+            result_set.status_attributes = {"x-ms-request-charge": charge, "x-ms-total-request-charge": charge}
+        return result_set
+
+    def submit_async(self, message, bindings=None, request_options=None):
+        future = Future()
+        future.set_result(self.submit(message, bindings, request_options))
+        return future
+
+    def close(self):
+        self.graph.close()
+
+#############################################
+### 3. Ingestion benchmark
+#############################################
+
+# Runs the ingestion of process_cl_file_to_db.py over every translation unit, in workers processes (sequentially if 0).
+# Cursors and phase times come from the metrics of the ingester.
+# The trigram and the vector index of the ingested graph are written to trigram_index_path and vector_index_path (if given)
+def run_ingest_benchmark(compile_commands_path, gremlin_client, ru_budget=None, trigram_index_path=None, vector_index_path=None,
+                         workers=0):
+    translation_units = load_compile_commands(compile_commands_path)
+
+    writer = GremlinBulkWriter(gremlin_client,
+                               batch_size=ingester.gremlin_batch_size,
+                               max_in_flight=ingester.gremlin_max_in_flight_batches,
+                               ru_budget=ru_budget,
+                               max_retries=ingester.gremlin_max_retries)
+    catalog_collector = CatalogCollector(writer)
+    sink = catalog_collector
+    trigram_builder = None
+    if trigram_index_path:
+        trigram_builder = TrigramIndexBuilder()
+        sink = DocumentIndexCollector(catalog_collector, trigram_builder)
+    vector_builder = None
+    if vector_index_path:
+        vector_builder = VectorIndexBuilder(HashingEmbedder(ingester.vector_dimensions))
+        sink = DocumentIndexCollector(sink, vector_builder)
+
+    metrics.reset()
+    start = time.perf_counter()
+    if workers:
+        ingester.ingest_translation_units_in_parallel(translation_units, sink, workers)
+    else:
+        ingester.ingest_translation_units(translation_units, sink)
+    writer.close()
+    total_seconds = max(time.perf_counter() - start, 1e-9)
+
+    graph_version = publish_graph_metadata(gremlin_client, catalog_collector.catalog)
+    trigram_index_seconds = 0.0
+    if trigram_builder is not None:
+        start = time.perf_counter()
+        trigram_builder.save(trigram_index_path, graph_version)
+        trigram_index_seconds = time.perf_counter() - start
+    vector_index_seconds = 0.0
+    if vector_builder is not None:
+        start = time.perf_counter()
+        vector_builder.save(vector_index_path, graph_version)
+        vector_index_seconds = time.perf_counter() - start
+
+    counts = gremlin_client.get_counts()
+    cursors = metrics.get_counter("cursors")
+    # Summed over the workers when there are several
+    parse_seconds = metrics.get_seconds("parse")
+    extract_seconds = metrics.get_seconds("vertex_pass") + metrics.get_seconds("edge_pass")
+    if not workers:
+        # Writes to the stand-in happen inside the walk, they are not counted as extraction time
+        extract_seconds -= counts["graph_seconds"]
+    extract_seconds = max(extract_seconds, 1e-9)
+    vertices, edges = writer.vertices_written, writer.edges_written
+    return {
+        "translation_units": len(translation_units),
+        "workers": workers,
+        "cursors": cursors,
+        "vertices": vertices,
+        "edges": edges,
+        "failed_batches": writer.failed_batches,
+        "request_charge": round(writer.request_charge, 1),
+        "throttled_batches": writer.throttled_batches,
+        "retries": writer.retries,
+        "parse_seconds": round(parse_seconds, 4),
+        "extract_seconds": round(extract_seconds, 4),
+        "total_seconds": round(total_seconds, 4),
+        "trigram_index_seconds": round(trigram_index_seconds, 4),
+        "vector_index_seconds": round(vector_index_seconds, 4),
+        "cursors_per_second": round(cursors / extract_seconds, 1),
+        "vertices_per_second": round(vertices / total_seconds, 1),
+        "edges_per_second": round(edges / total_seconds, 1),
+        "submits_per_vertex": round(counts["round_trips"] / vertices, 4) if vertices else None,
+        "request_bytes_per_vertex": round(counts["request_bytes"] / vertices, 1) if vertices else None,
+        **counts
+    }
+
+#############################################
+### 4. Question answering benchmark
+#############################################
+
+# Questions about the synthetic corpus and the queries the stubbed LLM generates for them
+def get_benchmark_questions():
+    return {
+        "What namespaces exist in this codebase?":
+            "g.V().hasLabel('NAMESPACE').values('spelling')",
+        "What classes inherit (also recursively) from Class0_0?":
+            "g.V().has('spelling', 'Class0_0').in('inherits_transitive').values('qualified_name')",
+        "List the overloads of method0 with their parameters":
+            "g.V().hasLabel('CXX_METHOD').has('spelling', 'method0')"
+            ".project('id', 'parameters').by(id).by(out('contains_argument').values('spelling').fold())",
+        "Which functions have 'compute' in their name?":
+            "g.V().hasLabel('FUNCTION_DECL').has('spelling', TextP.containing('compute')).valueMap('spelling', 'file', 'line')",
+        "List the class templates":
+            "g.V().hasLabel('CLASS_TEMPLATE').values('spelling')",
+        "List all methods with their files":
+            "g.V().hasLabel('CXX_METHOD').valueMap('spelling', 'file')",
+    }
+
+# Stands in for openai.AsyncAzureOpenAI: query generation requests get the canned query
+# of the question, answer requests a fixed text. Requests take llm_latency seconds.
+class StubChatModel:
+    def __init__(self, queries, latency=0.0):
+        self.queries = queries
+        self.latency = latency
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, max_tokens, temperature):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+        system_message, user_message = messages[0]["content"], messages[-1]["content"]
+        if system_message == code_advisor_system_message:
+            content = f"Stub answer based on {len(user_message)} characters of query results."
+        else:
+            content = next((query for question, query in self.queries.items() if question in user_message), "g.V().limit(1)")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    async def close(self):
+        pass
+
+def get_latency_stats(latencies):
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+    return {
+        "count": len(latencies),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "max_ms": round(latencies[-1] * 1000, 3)
+    }
+
+async def run_qa_rounds(service, questions, rounds, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+    latencies = [[] for _ in range(rounds)]
+    errors = 0
+
+    async def ask(round_number, question):
+        nonlocal errors
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await service.answer(question)
+            except qa_service.QuestionError as e:
+                errors += 1
+                print(f"ERROR answering '{question}': {e}")
+                return
+            latencies[round_number].append(time.perf_counter() - start)
+
+    await service.refresh_schema()
+    start = time.perf_counter()
+    for round_number in range(rounds):
+        await asyncio.gather(*(ask(round_number, question) for question in questions))
+    return latencies, errors, time.perf_counter() - start
+
+# End-to-end question latency through QAService: query generation, execution, result shaping and answer
+def run_qa_benchmark(gremlin_client, questions, rounds, concurrency, latency):
+    gremlin_client.reset()
+    llm = StubChatModel(questions, latency)
+    # The service is used without its aiohttp app, with an in-memory query cache
+    service = qa_service.QAService(gremlin_client, llm, QueryCache(None))
+
+    latencies, errors, seconds = asyncio.run(run_qa_rounds(service, list(questions), rounds, concurrency))
+    asked = sum(len(round_latencies) for round_latencies in latencies) + errors
+    return {
+        "questions": len(questions),
+        "rounds": rounds,
+        "concurrency": concurrency,
+        "llm_latency_ms": latency * 1000,
+        "errors": errors,
+        "questions_per_second": round(asked / seconds, 1) if seconds else None,
+        "cold": get_latency_stats(latencies[0]),
+        "warm": get_latency_stats([value for round_latencies in latencies[1:] for value in round_latencies]),
+        "llm_requests": llm.requests,
+        **gremlin_client.get_counts()
+    }
+
+#############################################
+### 5. Report
+#############################################
+
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        resource = None
+
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return round(peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024, 1)
+
+    if os.name == 'nt':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return round(counters.PeakWorkingSetSize / (1 << 20), 1)
+
+    return None
+
+# Metrics compared with a baseline report: (path in the report, True if higher is better)
+compared_metrics = [
+    ("ingest.cursors_per_second", True),
+    ("ingest.vertices_per_second", True),
+    ("ingest.edges_per_second", True),
+    ("ingest.submits_per_vertex", False),
+    ("ingest.request_bytes_per_vertex", False),
+    ("qa.questions_per_second", True),
+    ("qa.cold.p50_ms", False),
+    ("qa.cold.p95_ms", False),
+    ("qa.warm.p50_ms", False),
+    ("qa.warm.p95_ms", False),
+    ("qa.round_trips", False),
+    ("peak_rss_mb", False),
+]
+
+def get_metric(report, path):
+    value = report
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+# Prints the change of every compared metric, returns the metrics which got worse by more than the tolerance
+def compare_reports(report, baseline, tolerance):
+    settings = ("corpus", "qa.rounds", "qa.concurrency", "qa.llm_latency_ms")
+    if any(get_metric(report, path) != get_metric(baseline, path) for path in settings):
+        print("WARNING the baseline was measured with a different corpus or question settings, the numbers are not comparable")
+
+    regressions = []
+    for path, higher_is_better in compared_metrics:
+        value, baseline_value = get_metric(report, path), get_metric(baseline, path)
+        if not isinstance(value, (int, float)) or not isinstance(baseline_value, (int, float)) or not baseline_value:
+            continue
+
+        change = (value - baseline_value) / baseline_value
+        regressed = -change > tolerance if higher_is_better else change > tolerance
+        print(f"{path}: {baseline_value} -> {value} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(path)
+    return regressions
+
+#############################################
+### 6. Main
+#############################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of ingestion and question answering")
+    parser.add_argument("--namespaces", type=int, default=corpus_namespaces)
+    parser.add_argument("--classes", type=int, default=corpus_classes, help="classes per namespace")
+    parser.add_argument("--methods", type=int, default=corpus_methods, help="methods per class")
+    parser.add_argument("--overloads", type=int, default=corpus_overloads, help="overloads per method")
+    parser.add_argument("--templates", type=int, default=corpus_templates, help="class templates per namespace")
+    parser.add_argument("--inheritance-depth", type=int, default=corpus_inheritance_depth)
+    parser.add_argument("--translation-units", type=int, default=corpus_translation_units)
+    parser.add_argument("--corpus", help="folder for the generated corpus (a temporary folder by default)")
+    parser.add_argument("--qa-rounds", type=int, default=qa_rounds)
+    parser.add_argument("--qa-concurrency", type=int, default=qa_concurrency)
+    parser.add_argument("--llm-latency", type=float, default=llm_latency, help="seconds per stubbed LLM request")
+    parser.add_argument("--ru-limit", type=float, default=simulated_ru_limit,
+                        help="provisioned RU/s simulated by the Gremlin stand-in, requests above it are throttled")
+    parser.add_argument("--ru-budget", type=float, default=writer_ru_budget or ingester.gremlin_ru_budget,
+                        help="RU/s budget of the bulk writer")
+    parser.add_argument("--workers", type=int, default=ingest_workers, help="ingestion worker processes (0: sequential)")
+    parser.add_argument("--no-trigram-index", action="store_true", help="answer substring searches without the trigram index")
+    parser.add_argument("--no-vector-index", action="store_true", help="generate queries without vector index candidates")
+    parser.add_argument("--output", default=report_path)
+    parser.add_argument("--compare", help="baseline report, exits with 1 if a metric regressed")
+    parser.add_argument("--tolerance", type=float, default=regression_tolerance)
+    args = parser.parse_args()
+
+    corpus = {
+        "namespaces": args.namespaces,
+        "classes": args.classes,
+        "methods": args.methods,
+        "overloads": args.overloads,
+        "templates": args.templates,
+        "inheritance_depth": args.inheritance_depth,
+        "translation_units": args.translation_units,
+        "workers": args.workers,
+        "ru_limit": args.ru_limit,
+        "ru_budget": args.ru_budget,
+        "trigram_index": not args.no_trigram_index,
+        "vector_index": not args.no_vector_index,
+        "extract_references": ingester.extract_references,
+        "deduplicate_headers": ingester.deduplicate_headers,
+        "parse_skip_function_bodies": ingester.parse_skip_function_bodies
+    }
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        corpus_directory = os.path.abspath(args.corpus or temporary_directory)
+        compile_commands_path = generate_corpus(corpus_directory, args.namespaces, args.classes, args.methods, args.overloads,
+                                                args.templates, args.inheritance_depth, args.translation_units)
+        print(f"Generated {args.translation_units} translation unit(s) in {corpus_directory}")
+
+        # The index lives next to the corpus, the QA service reads it from there
+        trigram_index_path = None if args.no_trigram_index else os.path.join(corpus_directory, "trigrams.idx")
+        qa_service.trigram_index_path = trigram_index_path
+        vector_index_path = None if args.no_vector_index else os.path.join(corpus_directory, "vectors.idx")
+        qa_service.vector_index_path = vector_index_path
+
+        graph = MemoryGraph()
+        gremlin_client = CountingGremlinClient(ThrottlingGremlinClient(graph, args.ru_limit) if args.ru_limit else graph)
+        ingest = run_ingest_benchmark(compile_commands_path, gremlin_client, args.ru_budget, trigram_index_path,
+                                      vector_index_path, args.workers)
+        print(f"Ingested {ingest['cursors']} cursors into {ingest['vertices']} vertices and {ingest['edges']} edges "
+              f"({ingest['cursors_per_second']} cursors/s, {ingest['submits_per_vertex']} submits per vertex, "
+              f"{ingest['request_charge']} RU, {ingest['throttled_batches']} throttled)")
+        stored_vertices = sum(1 for vertex in graph.vertices.values() if vertex.label != GRAPH_METADATA_LABEL)
+        stored_edges = len(graph.edges)
+        if (stored_vertices, stored_edges) != (ingest['vertices'], ingest['edges']) or ingest['failed_batches']:
+            print(f"ERROR the graph holds {stored_vertices} vertices and {stored_edges} edges, "
+                  f"{ingest['failed_batches']} batch(es) failed")
+
+        questions = get_benchmark_questions()
+        qa = run_qa_benchmark(gremlin_client, questions, args.qa_rounds, args.qa_concurrency, args.llm_latency)
+        print(f"Answered {qa['questions']} question(s) x {qa['rounds']} round(s): "
+              f"cold p50 {qa['cold'].get('p50_ms')} ms, warm p50 {qa['warm'].get('p50_ms')} ms")
+
+    report = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": corpus,
+        "ingest": ingest,
+        "qa": qa,
+        "peak_rss_mb": get_peak_rss_mb()
+    }
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        if regressions:
+            print(f"ERROR {len(regressions)} metric(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
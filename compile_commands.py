@@ -0,0 +1,78 @@
+#############################################
+# Reading of a clang compilation database
+# (compile_commands.json) into the list of
+# translation units and their clang arguments.
+#############################################
+
+import json
+import os
+import shlex
+
+# Flags that only matter for code generation and take the next argument with them
+skipped_flags_with_value = {'-o', '-MF', '-MT', '-MQ'}
+skipped_flags = {'-c', '-MD', '-MMD', '-M', '-MM'}
+
+# Flags which take a path, relative paths are resolved against the entry 'directory'
+path_flags = ('-I', '-isystem', '-iquote', '-include')
+
+def get_entry_arguments(entry):
+    if 'arguments' in entry:
+        return list(entry['arguments'])
+    return shlex.split(entry['command'], posix=(os.name != 'nt'))
+
+# Make path arguments absolute so that parsing does not depend on the current working directory
+def absolutize_argument(flag, value, directory):
+    if value and not os.path.isabs(value):
+        value = os.path.normpath(os.path.join(directory, value))
+    return flag, value
+
+def get_clang_args(entry, file_path):
+    directory = entry.get('directory', '')
+    # First argument is the compiler itself
+    arguments = get_entry_arguments(entry)[1:]
+    args = []
+
+    i = 0
+    while i < len(arguments):
+        arg = arguments[i]
+        i += 1
+
+        if arg in skipped_flags:
+            continue
+        if arg in skipped_flags_with_value:
+            i += 1
+            continue
+        if os.path.normpath(os.path.join(directory, arg)) == file_path:
+            continue
+
+        if arg in path_flags and i < len(arguments):
+            args.extend(absolutize_argument(arg, arguments[i], directory))
+            i += 1
+            continue
+
+        joined_flag = next((flag for flag in path_flags if arg.startswith(flag) and arg != flag), None)
+        if joined_flag:
+            flag, value = absolutize_argument(joined_flag, arg[len(joined_flag):], directory)
+            args.append(flag + value)
+            continue
+
+        args.append(arg)
+
+    return args
+
+# Returns list of (file path, clang arguments) for every entry of the compilation database
+def load_compile_commands(compile_commands_path):
+    with open(compile_commands_path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+
+    translation_units = []
+    seen_files = set()
+    for entry in entries:
+        file_path = os.path.normpath(os.path.join(entry.get('directory', ''), entry['file']))
+        # The same file can be listed several times (e.g. for different targets), parse it once
+        if file_path in seen_files:
+            continue
+        seen_files.add(file_path)
+        translation_units.append((file_path, get_clang_args(entry, file_path)))
+
+    return translation_units
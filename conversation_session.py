@@ -0,0 +1,447 @@
+#############################################
+# Conversation sessions of the chatbot. The
+# vertices and edges retrieved for the questions of
+# a conversation stay in a local working subgraph
+# (an in-memory graph bounded by its number of
+# vertices, the least recently used ones are evicted).
+#
+# Every answered question becomes a turn with a short
+# handle (turn1, turn2...) standing for the ids of its
+# result vertices, so a follow-up query starts from
+# them with g.V(turn1) and the prompts name the handle
+# instead of pasting the earlier results again.
+#
+# Queries starting from known vertices run against
+# the working subgraph. Only the vertices and the
+# neighbourhoods (edges of a vertex in one direction
+# with the given labels) it does not hold yet are
+# fetched from the graph, by id. Queries which need
+# the whole graph run remotely as before.
+#############################################
+
+from gremlin_parser import parse_gremlin, to_gremlin, quote, Traversal, Step, Identifier, Predicate, GremlinSyntaxError
+from gremlin_writer import submit_with_retries
+from memory_graph import MemoryGraph, Edge
+from metrics import metrics
+from collections import OrderedDict
+
+DEFAULT_MAX_VERTICES = 5000
+# Result vertices remembered per turn
+DEFAULT_MAX_TURN_IDS = 1000
+# Turns kept per session and turns shown to the query generator and the advisor
+DEFAULT_MAX_TURNS = 20
+DEFAULT_MAX_CONTEXT_TURNS = 5
+# Names of the result vertices shown for a turn
+SAMPLE_NAMES = 5
+# Ids per fetch query
+FETCH_CHUNK_SIZE = 100
+
+HANDLE_PREFIX = "turn"
+
+NAVIGATION_DIRECTIONS = {'out': ('out',), 'in': ('in',), 'both': ('out', 'in'),
+                         'outE': ('out',), 'inE': ('in',), 'bothE': ('out', 'in')}
+# Modulators belong to the step in front of them, their traversals see the input of that step
+MODULATORS = {'by', 'times', 'until', 'emit', 'from', 'to', 'option', 'with'}
+# Steps which need the whole graph, queries using them run remotely
+REMOTE_STEPS = {'V', 'E', 'repeat', 'match', 'addV', 'addE', 'property', 'drop'}
+# Steps reading the path or side effects, nested traversals using them can not be started on their own
+PATH_STEPS = {'select', 'path', 'sack', 'loops', 'cap', 'tree', 'simplePath', 'cyclicPath'}
+# Steps keeping vertices, the vertex part of a query ends in front of the first other step
+VERTEX_STEPS = {'V', 'has', 'hasLabel', 'hasId', 'hasNot', 'where', 'filter', 'not', 'and', 'or', 'dedup',
+                'limit', 'range', 'tail', 'sample', 'order', 'by', 'as', 'out', 'in', 'both', 'simplePath'}
+
+#############################################
+# Working subgraph
+#############################################
+
+class WorkingSubgraph(MemoryGraph):
+    def __init__(self, max_vertices=DEFAULT_MAX_VERTICES):
+        super().__init__()
+        self.max_vertices = max_vertices
+        # Vertex ids from the least to the most recently used
+        self.recent = OrderedDict()
+        # (vertex id, direction) -> edge labels whose edges are all held, None among them for all labels
+        self.neighbourhoods = {}
+
+    def touch(self, ids):
+        for id in ids:
+            if id in self.recent:
+                self.recent.move_to_end(id)
+
+    def put_vertex(self, id, label, properties):
+        if id in self.vertices:
+            self.touch([id])
+            return
+        self.create_vertex(label, properties, id)
+        self.recent[id] = None
+
+    # Edges keep their id of the graph, the same edge can be fetched from both of its ends
+    def put_edge(self, id, label, from_id, to_id, properties):
+        out_vertex = self.vertices.get(from_id)
+        in_vertex = self.vertices.get(to_id)
+        if id in self.edges or out_vertex is None or in_vertex is None:
+            return
+        edge = Edge(id, label, out_vertex, in_vertex, dict(properties))
+        self.edges[id] = edge
+        out_vertex.out_edges.setdefault(label, []).append(edge)
+        in_vertex.in_edges.setdefault(label, []).append(edge)
+
+    def get_missing_labels(self, id, direction, labels):
+        loaded = self.neighbourhoods.get((id, direction), ())
+        if None in loaded:
+            return ()
+        if not labels:
+            return (None,)
+        return tuple(label for label in labels if label not in loaded)
+
+    def add_neighbourhood(self, id, direction, labels):
+        self.neighbourhoods.setdefault((id, direction), set()).update(labels)
+
+    def evict(self):
+        while len(self.vertices) > self.max_vertices and self.recent:
+            id, _ = self.recent.popitem(last=False)
+            vertex = self.vertices.get(id)
+            if vertex is None:
+                continue
+            # Neighbourhoods holding one of its edges are not complete any more
+            for edges in vertex.out_edges.values():
+                for edge in edges:
+                    self.neighbourhoods.pop((edge.in_vertex.id, 'in'), None)
+            for edges in vertex.in_edges.values():
+                for edge in edges:
+                    self.neighbourhoods.pop((edge.out_vertex.id, 'out'), None)
+            self.neighbourhoods.pop((id, 'out'), None)
+            self.neighbourhoods.pop((id, 'in'), None)
+            self.remove_vertex(vertex)
+            metrics.increment("session_evicted_vertices")
+
+#############################################
+# Query analysis
+#############################################
+
+def unwrap(value):
+    if isinstance(value, list) and len(value) == 1:
+        return value[0]
+    return value
+
+def chunks(items, size=FETCH_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def format_ids(ids):
+    return ', '.join(quote(str(id)) for id in ids)
+
+def iterate_traversal_args(args):
+    for arg in args:
+        if isinstance(arg, Traversal):
+            yield arg
+        elif isinstance(arg, Predicate):
+            yield from iterate_traversal_args(arg.args)
+        elif isinstance(arg, list):
+            yield from iterate_traversal_args(arg)
+
+def has_navigation(steps):
+    return any(step.name in NAVIGATION_DIRECTIONS or
+               any(has_navigation(traversal.steps) for traversal in iterate_traversal_args(step.args))
+               for step in steps)
+
+def has_path_steps(steps):
+    return any(step.name in PATH_STEPS or
+               any(has_path_steps(traversal.steps) for traversal in iterate_traversal_args(step.args))
+               for step in steps)
+
+def uses_local_steps_only(steps):
+    for step in steps:
+        if step.name in REMOTE_STEPS:
+            return False
+        if not all(uses_local_steps_only(traversal.steps) for traversal in iterate_traversal_args(step.args)):
+            return False
+    return True
+
+# Ids of g.V(ids) when the rest of the query only needs those vertices and their neighbourhoods, else None
+def get_local_start_ids(traversal):
+    if traversal.source != 'g' or not traversal.steps or traversal.steps[0].name != 'V':
+        return None
+    ids = []
+    for arg in traversal.steps[0].args:
+        for id in arg if isinstance(arg, list) else [arg]:
+            if not isinstance(id, str):
+                return None
+            ids.append(id)
+    if not ids or not uses_local_steps_only(traversal.steps[1:]):
+        return None
+    return ids
+
+# Start step of a traversal over the given elements (GraphSON results), None for anything else
+def get_start_step(elements):
+    types = {element.get('type') if isinstance(element, dict) else None for element in elements}
+    if types == {'vertex'}:
+        return Step('V', [element['id'] for element in elements])
+    if types == {'edge'}:
+        return Step('E', [element['id'] for element in elements])
+    return None
+
+# The query up to the end of its vertex part, with id() (the vertices a turn stands for), None if it has none
+def get_vertex_id_query(query, limit):
+    try:
+        traversal = parse_gremlin(query)
+    except GremlinSyntaxError:
+        return None
+    if traversal.source != 'g' or not traversal.steps or traversal.steps[0].name != 'V':
+        return None
+    steps = []
+    for step in traversal.steps:
+        if step.name not in VERTEX_STEPS or (step.name == 'V' and steps):
+            break
+        steps.append(step)
+    return to_gremlin(Traversal('g', steps + [Step('id', []), Step('limit', [limit])]))
+
+# Name shown for a result vertex: a GraphSON vertex or a projection with its properties
+def get_name(item):
+    properties = item.get('properties') if item.get('type') == 'vertex' else item
+    if not isinstance(properties, dict):
+        return None
+    for key in ('qualified_name', 'spelling', 'name'):
+        value = unwrap(properties.get(key))
+        if isinstance(value, dict):
+            value = value.get('value')
+        if isinstance(value, str) and value:
+            return value
+    return None
+
+#############################################
+# Session
+#############################################
+
+class ConversationSession:
+    def __init__(self, gremlin_client, max_vertices=DEFAULT_MAX_VERTICES, max_turn_ids=DEFAULT_MAX_TURN_IDS,
+                 max_turns=DEFAULT_MAX_TURNS, max_context_turns=DEFAULT_MAX_CONTEXT_TURNS, max_retries=10):
+        self.gremlin_client = gremlin_client
+        self.max_turn_ids = max_turn_ids
+        self.max_turns = max_turns
+        self.max_context_turns = max_context_turns
+        self.max_retries = max_retries
+        self.graph = WorkingSubgraph(max_vertices)
+        self.graph_version = None
+        self.turns = []
+        self.turn_count = 0
+        # (query, {id: name}) of the result vertices of the last executed query
+        self.recorded = None
+
+    # The working subgraph belongs to one graph version, the handles (plain ids) stay valid
+    def set_graph_version(self, graph_version):
+        if graph_version != self.graph_version:
+            self.graph = WorkingSubgraph(self.graph.max_vertices)
+            self.graph_version = graph_version
+
+    def fetch(self, query):
+        with metrics.measure("gremlin_request", kind="session_fetch"):
+            return submit_with_retries(self.gremlin_client, query, None, self.max_retries)
+
+    def fetch_vertices(self, ids):
+        missing = [id for id in dict.fromkeys(ids) if id not in self.graph.vertices]
+        for chunk in chunks(missing):
+            rows = self.fetch(f"g.V({format_ids(chunk)}).project('id', 'label', 'properties')"
+                              ".by(id).by(label).by(valueMap())")
+            for row in rows:
+                properties = {key: unwrap(value) for key, value in row['properties'].items()}
+                self.graph.put_vertex(row['id'], row['label'], properties)
+            metrics.increment("session_fetched_vertices", len(rows))
+        self.graph.touch(ids)
+
+    # Edges (and their other ends) of the vertices which the working subgraph does not hold completely
+    def fetch_neighbourhoods(self, ids, directions, labels):
+        for direction in directions:
+            groups = {}
+            for id in dict.fromkeys(ids):
+                if id not in self.graph.vertices:
+                    continue
+                missing_labels = self.graph.get_missing_labels(id, direction, labels)
+                if missing_labels:
+                    groups.setdefault(missing_labels, []).append(id)
+
+            step = 'outE' if direction == 'out' else 'inE'
+            other_end = 'inV' if direction == 'out' else 'outV'
+            for missing_labels, group in groups.items():
+                label_args = ', '.join(quote(label) for label in missing_labels if label is not None)
+                for chunk in chunks(group):
+                    rows = self.fetch(f"g.V({format_ids(chunk)}).{step}({label_args})"
+                                      ".project('id', 'label', 'outV', 'inV', 'properties')"
+                                      ".by(id).by(label).by(outV().id()).by(inV().id()).by(valueMap())")
+                    self.fetch_vertices([row[other_end] for row in rows])
+                    for row in rows:
+                        properties = {key: unwrap(value) for key, value in row['properties'].items()}
+                        self.graph.put_edge(row['id'], row['label'], row['outV'], row['inV'], properties)
+                    for id in chunk:
+                        self.graph.add_neighbourhood(id, direction, missing_labels)
+                    metrics.increment("session_fetched_edges", len(rows))
+
+    # Fetches what the steps need when they run on the results of start_steps, False if that can not be known
+    def prepare(self, start_steps, steps):
+        current = list(start_steps)
+        step_input = current
+        for step in steps:
+            if step.name not in MODULATORS:
+                step_input = list(current)
+            nested = [traversal for traversal in iterate_traversal_args(step.args) if has_navigation(traversal.steps)]
+            if step.name in NAVIGATION_DIRECTIONS or nested:
+                elements = self.graph.execute(to_gremlin(Traversal('g', step_input)))
+                if step.name in NAVIGATION_DIRECTIONS:
+                    if any(not isinstance(element, dict) or element.get('type') != 'vertex' for element in elements):
+                        return False
+                    if not all(isinstance(label, str) for label in step.args):
+                        return False
+                    self.fetch_neighbourhoods([element['id'] for element in elements],
+                                              NAVIGATION_DIRECTIONS[step.name], step.args)
+                for traversal in nested:
+                    if not elements:
+                        continue
+                    start_step = get_start_step(elements)
+                    if start_step is None or has_path_steps(traversal.steps):
+                        return False
+                    if not self.prepare([start_step], traversal.steps):
+                        return False
+            current.append(step)
+        return True
+
+    # Results of the query from the working subgraph, None if it has to run on the graph
+    def run_locally(self, query):
+        results = self.run_on_working_subgraph(query)
+        metrics.increment("session_queries", source="graph" if results is None else "working_subgraph")
+        return results
+
+    def run_on_working_subgraph(self, query):
+        try:
+            traversal = parse_gremlin(query)
+        except GremlinSyntaxError:
+            return None
+        ids = get_local_start_ids(traversal)
+        if ids is None:
+            return None
+        try:
+            with metrics.time("session_fetch"):
+                self.fetch_vertices(ids)
+                if not self.prepare(traversal.steps[:1], traversal.steps[1:]):
+                    return None
+            return self.graph.execute(query)
+        except Exception as e:
+            # Steps the in-memory graph does not know, the graph answers them
+            print(f"ERROR running the query on the working subgraph: {e}")
+            return None
+
+    # Passes the result chunks through and remembers the result vertices of the query for its turn
+    def record_results(self, query, result_chunks):
+        found = OrderedDict()
+        self.recorded = (query, found)
+        for chunk in result_chunks:
+            self.collect_vertices(chunk, found)
+            yield chunk
+
+    def collect_vertices(self, items, found):
+        for item in items:
+            if len(found) >= self.max_turn_ids:
+                return
+            if isinstance(item, list):
+                self.collect_vertices(item, found)
+            elif isinstance(item, dict) and item.get('type') != 'edge':
+                id = unwrap(item.get('id'))
+                if isinstance(id, str):
+                    found.setdefault(id, get_name(item))
+
+    #############################################
+    # Turns
+    #############################################
+
+    def get_turn(self, handle):
+        for turn in self.turns:
+            if turn["handle"] == handle:
+                return turn
+        return None
+
+    # Result vertices of a turn. A result without ids (e.g. only names) is traced back
+    # to its vertices with the vertex part of its query, once when it is first used.
+    def get_turn_ids(self, turn):
+        if turn["ids"] is None:
+            query = get_vertex_id_query(turn["query"], self.max_turn_ids)
+            try:
+                turn["ids"] = [id for id in self.fetch(query) if isinstance(id, str)] if query else []
+            except Exception as e:
+                print(f"ERROR reading the result vertices of {turn['handle']}: {e}")
+                return []
+        return turn["ids"]
+
+    # Handles of earlier turns in the query are replaced by the ids of their result vertices
+    def resolve_handles(self, query):
+        if not self.turns:
+            return query
+        try:
+            traversal = parse_gremlin(query)
+        except GremlinSyntaxError:
+            # Rejected by the query guard with the reason
+            return query
+        if not self.replace_handles(traversal):
+            return query
+        return to_gremlin(traversal)
+
+    def replace_handles(self, traversal):
+        replaced = False
+        for step in traversal.steps:
+            args, changed = self.replace_handle_args(step.args)
+            if changed:
+                step.args = args
+                replaced = True
+        return replaced
+
+    def replace_handle_args(self, args):
+        result = []
+        changed = False
+        for arg in args:
+            turn = self.get_turn(arg.name) if isinstance(arg, Identifier) else None
+            if turn is not None:
+                ids = self.get_turn_ids(turn)
+                # An empty handle stays as it is, g.V() without ids would be every vertex
+                if ids:
+                    result.extend(ids)
+                    changed = True
+                    continue
+            elif isinstance(arg, Traversal):
+                changed = self.replace_handles(arg) or changed
+            elif isinstance(arg, Predicate):
+                arg.args, predicate_changed = self.replace_handle_args(arg.args)
+                changed = changed or predicate_changed
+            elif isinstance(arg, list):
+                arg, list_changed = self.replace_handle_args(arg)
+                changed = changed or list_changed
+            result.append(arg)
+        return result, changed
+
+    # Records the answered question, the working subgraph is trimmed to its size at the end of every turn
+    def add_turn(self, question, query, answer):
+        ids, names = None, []
+        # A result without vertex ids is traced back to its vertices when the handle is used
+        if self.recorded is not None and self.recorded[0] == query and self.recorded[1]:
+            ids = list(self.recorded[1])
+            names = [name for name in self.recorded[1].values() if name][:SAMPLE_NAMES]
+        self.recorded = None
+
+        self.turn_count += 1
+        self.turns.append({
+            "handle": f"{HANDLE_PREFIX}{self.turn_count}",
+            "question": question,
+            "query": query,
+            "answer": answer,
+            "ids": ids,
+            "names": names
+        })
+        del self.turns[:-self.max_turns]
+        self.graph.evict()
+
+    # Earlier turns as the prompts show them: handle, question, answer and a few result names
+    def get_conversation(self):
+        return [{
+            "handle": turn["handle"],
+            "question": turn["question"],
+            "answer": turn["answer"],
+            "vertex_count": None if turn["ids"] is None else len(turn["ids"]),
+            "names": turn["names"]
+        } for turn in self.turns[-self.max_context_turns:]]
@@ -0,0 +1,136 @@
+#############################################
+# Memoized identity of cursors during extraction.
+# Vertex ids (USR based strings) are interned into
+# an IdTable and referenced by their number while
+# records are collected; the strings are only put
+# back when the records are written. Per translation
+# unit, the id number of every cursor and the file id
+# of every file name are computed once, and the table
+# is cleared for the next unit.
+#############################################
+
+from clang.cindex import CursorKind
+
+class IdTable:
+    def __init__(self):
+        self.strings = []
+        self.numbers = {}
+
+    def intern(self, string):
+        number = self.numbers.get(string)
+        if number is None:
+            number = len(self.strings)
+            self.strings.append(string)
+            self.numbers[string] = number
+        return number
+
+    def clear(self):
+        self.strings = []
+        self.numbers = {}
+
+    def get_string(self, number):
+        return self.strings[number]
+
+    # Vertex and edge records with id numbers turned into the id strings
+    def materialize_vertex(self, properties):
+        properties["id"] = self.strings[properties["id"]]
+        return properties
+
+    def materialize_records(self, vertices, edges):
+        strings = self.strings
+        vertices = [(label, self.materialize_vertex(properties)) for label, properties in vertices]
+        edges = [(strings[from_id], edge_label, strings[to_id], properties) for from_id, edge_label, to_id, properties in edges]
+        return vertices, edges
+
+# Passes records with id numbers to a writer which expects id strings
+class InternedIdWriter:
+    def __init__(self, writer, id_table):
+        self.writer = writer
+        self.id_table = id_table
+
+    def add_vertex(self, label, properties):
+        self.writer.add_vertex(label, self.id_table.materialize_vertex(properties))
+
+    def add_edge(self, from_id, edge_label, to_id, properties=None):
+        strings = self.id_table.strings
+        self.writer.add_edge(strings[from_id], edge_label, strings[to_id], properties)
+
+declaration_kinds = {}
+
+def is_declaration_kind(kind_id):
+    is_declaration = declaration_kinds.get(kind_id)
+    if is_declaration is None:
+        is_declaration = CursorKind.from_id(kind_id).is_declaration()
+        declaration_kinds[kind_id] = is_declaration
+    return is_declaration
+
+# Plain tuple which is equal for cursors clang_equalCursors considers equal: kind, xdata and
+# data pointers of the CXCursor, without the "first in declaration group" pointer of declarations.
+# No libclang call is needed and no cursor object is kept alive by the cache. These are the
+# private ctypes fields of clang.cindex.Cursor, get_cursor_key falls back to CursorKey without them.
+def get_cursor_fields_key(cursor):
+    kind_id = cursor._kind_id
+    data = cursor.data
+    if is_declaration_kind(kind_id):
+        return (kind_id, cursor.xdata, data[0], data[2])
+    return (kind_id, cursor.xdata, data[0], data[1], data[2])
+
+# Key through the public API: hashed by clang_hashCursor, compared by clang_equalCursors (keeps the cursor alive)
+class CursorKey:
+    __slots__ = ('cursor', 'hash')
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.hash = cursor.hash
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return self.hash == other.hash and self.cursor == other.cursor
+
+# Whether the bindings have the fields get_cursor_fields_key reads, decided on the first cursor
+has_cursor_fields = None
+
+# Hashable key of a cursor, equal for cursors clang_equalCursors considers equal
+def get_cursor_key(cursor):
+    global has_cursor_fields
+    if has_cursor_fields:
+        return get_cursor_fields_key(cursor)
+    if has_cursor_fields is None:
+        try:
+            key = get_cursor_fields_key(cursor)
+            has_cursor_fields = True
+            return key
+        except (AttributeError, TypeError, IndexError, ValueError):
+            has_cursor_fields = False
+    return CursorKey(cursor)
+
+class CursorIdentity:
+    # compute_id(cursor) returns the id string of a cursor (empty if it has none),
+    # compute_file_id(file_name) the file id of a file
+    def __init__(self, id_table, compute_id, compute_file_id):
+        self.id_table = id_table
+        self.compute_id = compute_id
+        self.compute_file_id = compute_file_id
+        self.cursor_ids = {}
+        self.file_ids = {}
+
+    # Id number of the cursor, None if it has no id. The keys are only valid
+    # while the translation unit is alive, the identity is created per unit.
+    def get_id_number(self, cursor):
+        key = get_cursor_key(cursor)
+        if key in self.cursor_ids:
+            return self.cursor_ids[key]
+
+        id = self.compute_id(cursor)
+        number = self.id_table.intern(id) if id else None
+        self.cursor_ids[key] = number
+        return number
+
+    def get_file_id(self, file_name):
+        file_id = self.file_ids.get(file_name)
+        if file_id is None:
+            file_id = self.compute_file_id(file_name)
+            self.file_ids[file_name] = file_id
+        return file_id
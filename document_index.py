@@ -0,0 +1,171 @@
+#############################################
+# Memory-mapped file of the local indexes (trigram
+# and vector index): one document per vertex, made
+# of its id and a fixed list of string fields.
+#
+# Layout (little endian): magic, version, header
+# length, JSON header, then the sections listed in
+# the header, each aligned to 64 bytes. Every file
+# starts with the string table of the documents:
+# string offsets (uint64, id and fields of every
+# document in id order) and the strings, the index
+# adds sections of its own after it.
+#
+# An index belongs to the graph version it was
+# written for and is not used with any other one.
+#############################################
+
+import array
+import json
+import mmap
+import os
+import struct
+
+SECTION_ALIGNMENT = 64
+
+# sections are [(name, length, chunks)] with the byte chunks making up the section
+def write_index_file(path, magic, version, header, sections):
+    header = dict(header, sections={})
+    # The header holds the section offsets, its length is fixed by writing it twice
+    header_length = 0
+    while True:
+        position = len(magic) + 8 + header_length
+        for name, length, _ in sections:
+            position += -position % SECTION_ALIGNMENT
+            header["sections"][name] = [position, length]
+            position += length
+        header_bytes = json.dumps(header).encode('utf-8')
+        if len(header_bytes) <= header_length:
+            header_bytes = header_bytes.ljust(header_length)
+            break
+        header_length = len(header_bytes) + 64
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'wb') as f:
+        f.write(magic + struct.pack('<II', version, header_length) + header_bytes)
+        for name, _, chunks in sections:
+            f.write(b"\0" * (header["sections"][name][0] - f.tell()))
+            for chunk in chunks:
+                f.write(chunk)
+    os.replace(temporary_path, path)
+
+class DocumentIndexBuilder:
+    # Names of the document fields, and the one holding the file id of the vertex
+    fields = ()
+    file_field = None
+
+    def __init__(self):
+        # id -> tuple of the field values
+        self.documents = {}
+
+    # Vertices of dropped files leave the index (file ids as stored in the 'file' property)
+    def remove_files(self, file_ids):
+        file_field = self.fields.index(self.file_field)
+        self.documents = {id: values for id, values in self.documents.items() if values[file_field] not in file_ids}
+
+    def load_index(self, index):
+        for id, values in index.iterate_documents():
+            self.documents[id] = values
+
+    # Writes the documents of the ids (in this order) followed by the sections of the index
+    def write(self, path, magic, version, ids, header, sections):
+        strings = bytearray()
+        string_offsets = array.array('Q', [0])
+        for id in ids:
+            for text in (id,) + self.documents[id]:
+                strings += text.encode('utf-8')
+                string_offsets.append(len(strings))
+
+        header = dict(header, documents=len(ids), fields=list(self.fields))
+        sections = [("string_offsets", len(string_offsets) * 8, [string_offsets.tobytes()]),
+                    ("strings", len(strings), [bytes(strings)])] + sections
+        write_index_file(path, magic, version, header, sections)
+
+# Wraps a writer and records every written vertex in the index builder (same interface as GremlinBulkWriter)
+class DocumentIndexCollector:
+    def __init__(self, writer, builder):
+        self.writer = writer
+        self.builder = builder
+
+    def add_vertex(self, label, properties):
+        self.builder.add_vertex(properties)
+        self.writer.add_vertex(label, properties)
+
+    def add_edge(self, from_id, edge_label, to_id, properties=None):
+        self.writer.add_edge(from_id, edge_label, to_id, properties)
+
+class DocumentIndex:
+    magic = None
+    version = None
+    # Name of the index in error messages
+    kind = "index"
+
+    def __init__(self, path):
+        self.views = []
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            self.file.close()
+            raise
+        if self.data[:len(self.magic)] != self.magic:
+            self.close()
+            raise ValueError(f"{path} is not a {self.kind}")
+        version, header_length = struct.unpack_from('<II', self.data, len(self.magic))
+        if version != self.version:
+            self.close()
+            raise ValueError(f"{path} has index version {version}, expected {self.version}")
+
+        position = len(self.magic) + 8
+        self.header = json.loads(self.data[position:position + header_length])
+        self.graph_version = self.header["graph_version"]
+        self.document_count = self.header["documents"]
+        self.fields = self.header["fields"]
+
+        self.string_offsets = self.section("string_offsets", 'Q')
+        self.strings = self.section("strings")
+
+    # View of a section, cast to the array format if one is given
+    def section(self, name, format=None):
+        offset, length = self.header["sections"][name]
+        view = memoryview(self.data)[offset:offset + length]
+        if format:
+            view = view.cast(format)
+        self.views.append(view)
+        return view
+
+    def close(self):
+        # Views into the map have to be released before it can be closed
+        for view in self.views:
+            view.release()
+        self.views = []
+        self.data.close()
+        self.file.close()
+
+    def get_string(self, number):
+        return str(self.strings[self.string_offsets[number]:self.string_offsets[number + 1]], 'utf-8')
+
+    # Id (i = 0) or field value (i = 1 + field) of a document
+    def get_document_string(self, document, i):
+        return self.get_string(document * (1 + len(self.fields)) + i)
+
+    def iterate_documents(self):
+        for document in range(self.document_count):
+            yield self.get_document_string(document, 0), tuple(self.get_document_string(document, 1 + field)
+                                                               for field in range(len(self.fields)))
+
+# Index of the graph version, None if there is none (or it was written for another version)
+def load_document_index(index_class, path, graph_version):
+    if not path or graph_version is None or not os.path.exists(path):
+        return None
+    try:
+        index = index_class(path)
+    except (OSError, ValueError) as e:
+        print(f"ERROR reading {index_class.kind} {path}: {e}")
+        return None
+    if index.graph_version != graph_version:
+        index.close()
+        return None
+    return index
@@ -0,0 +1,57 @@
+#############################################
+# Selects the graph database the scripts talk to.
+# GRAPH_BACKEND environment variable:
+#   cosmos (default)        Azure Cosmos DB Gremlin API
+#   memory:<snapshot path>  embedded in-memory graph (memory_graph.py),
+#                           loaded from / saved to the snapshot file
+#   memory                  embedded in-memory graph without persistence
+# Both return an object with the gremlin_python Client interface
+# (submit, submit_async, close).
+#############################################
+
+import asyncio
+import os
+
+# In-memory graphs opened in this process, so every client of a snapshot sees the same graph
+memory_graphs = {}
+
+def get_graph_backend():
+    return os.getenv("GRAPH_BACKEND", "cosmos")
+
+# pool_size is the number of pooled connections of the Cosmos client
+def create_gremlin_client(url, username, pool_size=None):
+    backend = get_graph_backend()
+
+    if backend == "memory" or backend.startswith("memory:"):
+        from memory_graph import MemoryGraph
+
+        snapshot_path = backend[len("memory:"):] or None
+        graph = memory_graphs.get(snapshot_path)
+        if graph is None:
+            graph = MemoryGraph(snapshot_path)
+            memory_graphs[snapshot_path] = graph
+        return graph
+
+    if backend != "cosmos":
+        raise ValueError(f"Unknown GRAPH_BACKEND '{backend}'")
+
+    from gremlin_python.driver import client, serializer
+
+    return client.Client(url, 'g',
+                         pool_size=pool_size,
+                         username=username,
+                         password=os.getenv("COSMOS_DB_PRIMARY_KEY"),
+                         message_serializer=serializer.GraphSONSerializersV2d0())
+
+# Awaitable result set for asyncio code. Client.submit_async is not asynchronous all the way: it waits
+# for a free pooled connection with a blocking get, so it is called from a worker thread instead of the
+# event loop. Callers should still keep at most pool_size requests in flight (see qa_service.py).
+async def submit_result_set_async(gremlin_client, query, bindings=None):
+    loop = asyncio.get_running_loop()
+    future = await loop.run_in_executor(None, gremlin_client.submit_async, query, bindings)
+    return await asyncio.wrap_future(future)
+
+# Awaitable query results for asyncio code
+async def submit_query_async(gremlin_client, query, bindings=None):
+    result_set = await submit_result_set_async(gremlin_client, query, bindings)
+    return await asyncio.wrap_future(result_set.all())
@@ -0,0 +1,102 @@
+#############################################
+# Schema catalog of the graph, maintained by the
+# ingester: vertex labels with their counts,
+# outgoing edge labels and property keys, and
+# edge labels with their counts. It is stored on
+# the graph metadata vertex, so the chatbot gets
+# the whole schema with a single point lookup.
+#############################################
+
+import json
+
+class GraphCatalog:
+    def __init__(self):
+        self.vertex_labels = {}
+        self.edge_labels = {}
+
+    def _label_entry(self, label):
+        entry = self.vertex_labels.get(label)
+        if entry is None:
+            entry = {"count": 0, "edges": set(), "properties": set()}
+            self.vertex_labels[label] = entry
+        return entry
+
+    def record_vertex(self, label, property_keys):
+        entry = self._label_entry(label)
+        entry["count"] += 1
+        entry["properties"].update(property_keys)
+
+    # from_label is None when the outgoing vertex was not written in this run
+    def record_edge(self, from_label, edge_label):
+        self.edge_labels[edge_label] = self.edge_labels.get(edge_label, 0) + 1
+        if from_label is not None:
+            self._label_entry(from_label)["edges"].add(edge_label)
+
+    def merge(self, other):
+        for label, other_entry in other.vertex_labels.items():
+            entry = self._label_entry(label)
+            entry["count"] += other_entry["count"]
+            entry["edges"].update(other_entry["edges"])
+            entry["properties"].update(other_entry["properties"])
+        for edge_label, count in other.edge_labels.items():
+            self.edge_labels[edge_label] = self.edge_labels.get(edge_label, 0) + count
+
+    # Takes removed vertices/edges ({label: count}) into account, labels without vertices are forgotten
+    def subtract(self, vertex_counts, edge_counts):
+        for label, count in vertex_counts.items():
+            entry = self.vertex_labels.get(label)
+            if entry is None:
+                continue
+            entry["count"] -= count
+            if entry["count"] <= 0:
+                del self.vertex_labels[label]
+        for edge_label, count in edge_counts.items():
+            if edge_label in self.edge_labels:
+                self.edge_labels[edge_label] -= count
+                if self.edge_labels[edge_label] <= 0:
+                    del self.edge_labels[edge_label]
+
+    def get_relationship_map(self):
+        return {label: sorted(entry["edges"]) for label, entry in self.vertex_labels.items()}
+
+    def get_property_map(self):
+        return {label: sorted(entry["properties"]) for label, entry in self.vertex_labels.items()}
+
+    def get_vertex_counts(self):
+        return {label: entry["count"] for label, entry in self.vertex_labels.items()}
+
+    def to_json(self):
+        return json.dumps({
+            "vertex_labels": {label: {"count": entry["count"],
+                                      "edges": sorted(entry["edges"]),
+                                      "properties": sorted(entry["properties"])}
+                              for label, entry in sorted(self.vertex_labels.items())},
+            "edge_labels": dict(sorted(self.edge_labels.items()))
+        }, separators=(',', ':'))
+
+    @staticmethod
+    def from_json(text):
+        data = json.loads(text)
+        catalog = GraphCatalog()
+        for label, entry in data["vertex_labels"].items():
+            catalog.vertex_labels[label] = {"count": entry["count"],
+                                            "edges": set(entry["edges"]),
+                                            "properties": set(entry["properties"])}
+        catalog.edge_labels = dict(data["edge_labels"])
+        return catalog
+
+# Records everything passed to the writer into a catalog (same interface as GremlinBulkWriter)
+class CatalogCollector:
+    def __init__(self, writer):
+        self.writer = writer
+        self.catalog = GraphCatalog()
+        self.vertex_labels = {}
+
+    def add_vertex(self, label, properties):
+        self.vertex_labels[properties["id"]] = label
+        self.catalog.record_vertex(label, properties.keys())
+        self.writer.add_vertex(label, properties)
+
+    def add_edge(self, from_id, edge_label, to_id, properties=None):
+        self.catalog.record_edge(self.vertex_labels.get(from_id), edge_label)
+        self.writer.add_edge(from_id, edge_label, to_id, properties)
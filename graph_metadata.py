@@ -0,0 +1,78 @@
+#############################################
+# Graph metadata vertex shared by the ingester
+# and the chatbot. The ingester publishes a new
+# version stamp after every successful run, so
+# anything cached about the graph can be keyed
+# by (and invalidated with) that stamp. The
+# vertex also carries the schema catalog.
+#############################################
+
+from graph_catalog import GraphCatalog
+from graph_backend import submit_query_async
+from gremlin_writer import submit_with_retries
+import time
+import uuid
+
+GRAPH_METADATA_ID = "cpprag_graph_metadata"
+GRAPH_METADATA_LABEL = "GRAPH_METADATA"
+
+def new_graph_version():
+    return f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+
+# Creates the metadata vertex if needed and stores a fresh version stamp (and the catalog) in it
+def publish_graph_metadata(gremlin_client, catalog=None):
+    version = new_graph_version()
+    query = ("g.V(metadata_id).fold()"
+             ".coalesce(unfold(), addV(metadata_label).property('id', metadata_id))"
+             ".property('version', version)")
+    bindings = {
+        "metadata_id": GRAPH_METADATA_ID,
+        "metadata_label": GRAPH_METADATA_LABEL,
+        "version": version
+    }
+
+    if catalog is not None:
+        query += ".property('catalog', catalog)"
+        bindings["catalog"] = catalog.to_json()
+
+    # The query is an upsert, it can be repeated when Cosmos DB throttles it
+    submit_with_retries(gremlin_client, query, bindings)
+    return version
+
+GRAPH_METADATA_QUERY = "g.V(metadata_id).valueMap('version', 'catalog')"
+GRAPH_VERSION_QUERY = "g.V(metadata_id).values('version')"
+
+# {'version': ..., 'catalog': ...} from the result of GRAPH_METADATA_QUERY
+def read_graph_metadata(result):
+    values = result[0] if result else {}
+
+    # Property values come as lists from valueMap
+    def first(value):
+        return value[0] if isinstance(value, list) and value else value
+
+    catalog = first(values.get('catalog'))
+    return {
+        "version": first(values.get('version')),
+        "catalog": GraphCatalog.from_json(catalog) if catalog else None
+    }
+
+# Version stamp and catalog in one point lookup: {'version': ..., 'catalog': ...} (values may be None)
+def get_graph_metadata(gremlin_client):
+    result = submit_with_retries(gremlin_client, GRAPH_METADATA_QUERY, {"metadata_id": GRAPH_METADATA_ID})
+    return read_graph_metadata(result)
+
+# Current version stamp, None if the graph was never published by the ingester
+def get_graph_version(gremlin_client):
+    result = gremlin_client.submit(GRAPH_VERSION_QUERY, {"metadata_id": GRAPH_METADATA_ID}).all().result()
+    return result[0] if result else None
+
+def get_graph_catalog(gremlin_client):
+    return get_graph_metadata(gremlin_client)["catalog"]
+
+async def get_graph_metadata_async(gremlin_client):
+    result = await submit_query_async(gremlin_client, GRAPH_METADATA_QUERY, {"metadata_id": GRAPH_METADATA_ID})
+    return read_graph_metadata(result)
+
+async def get_graph_version_async(gremlin_client):
+    result = await submit_query_async(gremlin_client, GRAPH_VERSION_QUERY, {"metadata_id": GRAPH_METADATA_ID})
+    return result[0] if result else None
@@ -0,0 +1,94 @@
+#############################################
+# Plain vertex/edge records used to move the
+# extracted graph between processes, and the
+# merger feeding them into a single writer.
+#############################################
+
+# Collects graph mutations in memory instead of writing them (same interface as GremlinBulkWriter)
+class GraphRecordCollector:
+    def __init__(self):
+        self.vertices = []
+        self.edges = []
+
+    def add_vertex(self, label, properties):
+        self.vertices.append((label, properties))
+
+    def add_edge(self, from_id, edge_label, to_id, properties=None):
+        self.edges.append((from_id, edge_label, to_id, properties or {}))
+
+# Merges records coming from many translation units into one writer.
+# Duplicated vertices and edges are dropped, an edge is held back until
+# both of its endpoints have been written (or until the merger is closed).
+class GraphRecordMerger:
+    def __init__(self, writer):
+        self.writer = writer
+        self.vertex_ids = set()
+        self.edge_keys = set()
+        self.pending_edges = {}
+
+    def add_vertex(self, label, properties):
+        id = properties["id"]
+        if id in self.vertex_ids:
+            return
+        self.vertex_ids.add(id)
+        self.writer.add_vertex(label, properties)
+
+        for edge in self.pending_edges.pop(id, []):
+            self._route_edge(edge)
+
+    def add_edge(self, from_id, edge_label, to_id, properties=None):
+        key = (from_id, edge_label, to_id)
+        if key in self.edge_keys:
+            return
+        self.edge_keys.add(key)
+        self._route_edge((from_id, edge_label, to_id, properties or {}))
+
+    def add_records(self, vertices, edges):
+        for label, properties in vertices:
+            self.add_vertex(label, properties)
+        for edge in edges:
+            self.add_edge(*edge)
+
+    # Edges whose endpoints never showed up are still sent, the graph decides whether they resolve
+    def close(self):
+        pending_edges, self.pending_edges = self.pending_edges, {}
+        for edges in pending_edges.values():
+            for edge in edges:
+                self.writer.add_edge(*edge)
+
+    def _route_edge(self, edge):
+        for endpoint in (edge[0], edge[2]):
+            if endpoint not in self.vertex_ids:
+                self.pending_edges.setdefault(endpoint, []).append(edge)
+                return
+        self.writer.add_edge(*edge)
+
+# Holds back edges of a single extraction pass until both of their endpoint vertices
+# were emitted (known_ids is updated by the extraction), close() sends the rest.
+# Most edges point to vertices met earlier in the walk, so few edges wait here.
+class PendingEdgeTable:
+    def __init__(self, writer, known_ids):
+        self.writer = writer
+        self.known_ids = known_ids
+        self.pending_edges = {}
+
+    def add_vertex(self, label, properties):
+        id = properties["id"]
+        self.writer.add_vertex(label, properties)
+
+        for edge in self.pending_edges.pop(id, ()):
+            self.add_edge(*edge)
+
+    def add_edge(self, from_id, edge_label, to_id, properties=None):
+        if from_id not in self.known_ids:
+            self.pending_edges.setdefault(from_id, []).append((from_id, edge_label, to_id, properties))
+        elif to_id not in self.known_ids:
+            self.pending_edges.setdefault(to_id, []).append((from_id, edge_label, to_id, properties))
+        else:
+            self.writer.add_edge(from_id, edge_label, to_id, properties)
+
+    def close(self):
+        for edges in self.pending_edges.values():
+            for edge in edges:
+                self.writer.add_edge(*edge)
+        self.pending_edges = {}
@@ -0,0 +1,198 @@
+#############################################
+# Offline graph snapshot: the extracted graph is
+# streamed into a compact local file which can be
+# loaded into Gremlin (or any other writer) later,
+# independently of the parsing.
+#
+# Format: gzip-compressed JSON lines
+#   ["CPPRAG-SNAPSHOT", version]          header
+#   ["S", "string"]                       next entry of the string table
+#   ["V", label, key, value, ...]         vertex
+#   ["E", from_id, label, to_id, key, value, ...] edge
+# Labels, ids and property keys are string table indexes, property values
+# are string table indexes for strings, [number] for numbers, true/false/null.
+#
+# Usage:
+#   python graph_snapshot.py load graph.snapshot.gz [--batch-size N] [--max-in-flight N]
+#   python graph_snapshot.py diff old.snapshot.gz new.snapshot.gz
+#############################################
+
+import argparse
+import gzip
+import json
+from graph_records import GraphRecordMerger
+
+SNAPSHOT_MAGIC = "CPPRAG-SNAPSHOT"
+SNAPSHOT_VERSION = 1
+
+# Streams vertices and edges into a snapshot file (same interface as GremlinBulkWriter)
+class SnapshotWriter:
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.strings = {}
+        self.vertices_written = 0
+        self.edges_written = 0
+        self._write([SNAPSHOT_MAGIC, SNAPSHOT_VERSION])
+
+    def add_vertex(self, label, properties):
+        record = ["V", self._intern(label)]
+        self._add_properties(record, properties)
+        self._write(record)
+        self.vertices_written += 1
+
+    def add_edge(self, from_id, edge_label, to_id, properties=None):
+        record = ["E", self._intern(from_id), self._intern(edge_label), self._intern(to_id)]
+        self._add_properties(record, properties or {})
+        self._write(record)
+        self.edges_written += 1
+
+    def close(self):
+        self.file.close()
+
+    def _intern(self, string):
+        index = self.strings.get(string)
+        if index is None:
+            index = len(self.strings)
+            self.strings[string] = index
+            self._write(["S", string])
+        return index
+
+    def _add_properties(self, record, properties):
+        for key, value in properties.items():
+            if key == "label":
+                continue
+            record.append(self._intern(key))
+            record.append(self._encode_value(value))
+
+    def _encode_value(self, value):
+        if value is None or isinstance(value, bool):
+            return value
+        if isinstance(value, str):
+            return self._intern(value)
+        return [value]
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')))
+        self.file.write('\n')
+
+def decode_value(value, strings):
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, list):
+        return value[0]
+    return strings[value]
+
+def decode_properties(record, start, strings):
+    return {strings[record[i]]: decode_value(record[i + 1], strings) for i in range(start, len(record), 2)}
+
+# Yields ("vertex", label, properties) and ("edge", from_id, edge_label, to_id, properties) in file order
+def read_snapshot(path):
+    strings = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header != [SNAPSHOT_MAGIC, SNAPSHOT_VERSION]:
+            raise ValueError(f"{path} is not a graph snapshot of version {SNAPSHOT_VERSION}")
+
+        for line in f:
+            record = json.loads(line)
+            kind = record[0]
+            if kind == "S":
+                strings.append(record[1])
+            elif kind == "V":
+                properties = decode_properties(record, 2, strings)
+                properties["label"] = strings[record[1]]
+                yield ("vertex", strings[record[1]], properties)
+            elif kind == "E":
+                yield ("edge", strings[record[1]], strings[record[2]], strings[record[3]],
+                       decode_properties(record, 4, strings))
+            else:
+                raise ValueError(f"Unknown snapshot record '{kind}' in {path}")
+
+# Replays a snapshot into a writer, edges are held back until their endpoints are written
+def load_snapshot(path, writer):
+    merger = GraphRecordMerger(writer)
+    for record in read_snapshot(path):
+        if record[0] == "vertex":
+            merger.add_vertex(record[1], record[2])
+        else:
+            merger.add_edge(*record[1:])
+    merger.close()
+
+# Whole snapshot as {vertex id: properties} and {(from id, label, to id): properties}
+def read_snapshot_graph(path):
+    vertices = {}
+    edges = {}
+    for record in read_snapshot(path):
+        if record[0] == "vertex":
+            vertices[record[2]["id"]] = record[2]
+        else:
+            edges[(record[1], record[2], record[3])] = record[4]
+    return vertices, edges
+
+def diff_snapshots(old_path, new_path):
+    old_vertices, old_edges = read_snapshot_graph(old_path)
+    new_vertices, new_edges = read_snapshot_graph(new_path)
+
+    for id in sorted(old_vertices.keys() - new_vertices.keys()):
+        print(f"- vertex {id}")
+    for id in sorted(new_vertices.keys() - old_vertices.keys()):
+        print(f"+ vertex {id}")
+    for id in sorted(old_vertices.keys() & new_vertices.keys()):
+        if old_vertices[id] != new_vertices[id]:
+            changed_keys = {key for key in old_vertices[id].keys() | new_vertices[id].keys()
+                            if old_vertices[id].get(key) != new_vertices[id].get(key)}
+            print(f"~ vertex {id}: {', '.join(sorted(changed_keys))}")
+    for key in sorted(old_edges.keys() - new_edges.keys()):
+        print(f"- edge {key[0]} -{key[1]}-> {key[2]}")
+    for key in sorted(new_edges.keys() - old_edges.keys()):
+        print(f"+ edge {key[0]} -{key[1]}-> {key[2]}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load or compare graph snapshots written by process_cl_file_to_db.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load_parser = commands.add_parser("load", help="bulk-load a snapshot into the Gremlin database")
+    load_parser.add_argument("snapshot")
+    load_parser.add_argument("--url", default='wss://cpp-codebase-playground.gremlin.cosmos.azure.com:443/')
+    load_parser.add_argument("--username", default="/dbs/codebase/colls/codebase-graph")
+    load_parser.add_argument("--batch-size", type=int, default=50)
+    load_parser.add_argument("--max-in-flight", type=int, default=8)
+    load_parser.add_argument("--ru-budget", type=float, help="request units per second the load should stay under")
+
+    diff_parser = commands.add_parser("diff", help="print vertices and edges added, removed or changed between two snapshots")
+    diff_parser.add_argument("old_snapshot")
+    diff_parser.add_argument("new_snapshot")
+
+    args = parser.parse_args()
+
+    if args.command == "diff":
+        diff_snapshots(args.old_snapshot, args.new_snapshot)
+        return
+
+    from graph_backend import create_gremlin_client
+    from dotenv import load_dotenv
+    from gremlin_writer import GremlinBulkWriter
+    from graph_metadata import publish_graph_metadata, get_graph_catalog
+    from graph_catalog import GraphCatalog, CatalogCollector
+
+    load_dotenv()
+    gremlin_client = create_gremlin_client(args.url, args.username)
+    bulk_writer = GremlinBulkWriter(gremlin_client, batch_size=args.batch_size, max_in_flight=args.max_in_flight,
+                                    ru_budget=args.ru_budget)
+
+    catalog_collector = CatalogCollector(bulk_writer)
+
+    load_snapshot(args.snapshot, catalog_collector)
+    bulk_writer.close()
+    print(f"Loaded {bulk_writer.vertices_written} vertices and {bulk_writer.edges_written} edges ({bulk_writer.request_charge:.1f} RU)")
+
+    # Only what was stored goes into the catalog
+    catalog = get_graph_catalog(gremlin_client) or GraphCatalog()
+    catalog_collector.catalog.subtract(bulk_writer.failed_vertex_counts, bulk_writer.failed_edge_counts)
+    catalog.merge(catalog_collector.catalog)
+    print(f"Published graph version {publish_graph_metadata(gremlin_client, catalog)}")
+
+    gremlin_client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#############################################
+# Parser for the Gremlin (Groovy) query strings
+# used in this project: method chains such as
+#   g.V().hasLabel('CLASS_DECL').has('spelling', TextP.containing('x')).project('id').by(id)
+# The result is a small syntax tree which can be
+# executed by the in-memory graph or turned back
+# into a query string (to_gremlin).
+#############################################
+
+import re
+
+class GremlinSyntaxError(ValueError):
+    pass
+
+class Traversal:
+    __slots__ = ('source', 'steps')
+
+    # source is 'g' for the graph traversal, '__' or None for anonymous ones
+    def __init__(self, source, steps):
+        self.source = source
+        self.steps = steps
+
+class Step:
+    __slots__ = ('name', 'args')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+# Binding name or token such as id, label, T.id, desc, Order.desc, local, values
+class Identifier:
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    # Token without its enum prefix (T.id -> id)
+    @property
+    def token(self):
+        return self.name.rsplit('.', 1)[-1]
+
+class Predicate:
+    __slots__ = ('name', 'args', 'prefix')
+
+    def __init__(self, name, args, prefix=None):
+        self.name = name
+        self.args = args
+        self.prefix = prefix
+
+PREDICATES = {
+    'eq', 'neq', 'lt', 'lte', 'gt', 'gte', 'inside', 'outside', 'between', 'within', 'without',
+    'containing', 'notContaining', 'startingWith', 'notStartingWith', 'endingWith', 'notEndingWith', 'regex',
+}
+
+# Enum-like classes, Class.member is a token (or a predicate for P/TextP)
+QUALIFIERS = {'T', 'P', 'TextP', 'Order', 'Scope', 'Column', 'Cardinality', 'Pop', 'Operator', 'Direction'}
+
+token_pattern = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<string>'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?[LlDdFf]?)
+  | (?P<name>[A-Za-z_$][A-Za-z0-9_$]*)
+  | (?P<punct>[.(),\[\];])
+""", re.VERBOSE)
+
+escapes = {'n': '\n', 't': '\t', 'r': '\r', '\\': '\\', "'": "'", '"': '"', '$': '$'}
+
+def unescape(text):
+    return re.sub(r"\\(.)", lambda m: escapes.get(m.group(1), m.group(1)), text)
+
+def tokenize(query):
+    tokens = []
+    position = 0
+    while position < len(query):
+        match = token_pattern.match(query, position)
+        if not match:
+            raise GremlinSyntaxError(f"Unexpected character '{query[position]}' at position {position}")
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+
+        if kind == 'space':
+            continue
+        if kind == 'string':
+            tokens.append(('string', unescape(text[1:-1])))
+        elif kind == 'number':
+            number = text.rstrip('LlDdFf')
+            tokens.append(('number', float(number) if ('.' in number or 'e' in number.lower() or text[-1] in 'DdFf') else int(number)))
+        else:
+            tokens.append((kind, text))
+    return tokens
+
+class Parser:
+    def __init__(self, query):
+        self.tokens = tokenize(query)
+        self.position = 0
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise GremlinSyntaxError("Unexpected end of query")
+        self.position += 1
+        return token
+
+    def expect(self, text):
+        kind, value = self.next()
+        if value != text or kind not in ('punct', 'name'):
+            raise GremlinSyntaxError(f"Expected '{text}' but got '{value}'")
+
+    def at(self, text):
+        kind, value = self.peek()
+        return kind == 'punct' and value == text
+
+    def parse_query(self):
+        traversal = self.parse_expression()
+        while self.at(';'):
+            self.next()
+        if self.peek()[0] is not None:
+            raise GremlinSyntaxError(f"Unexpected '{self.peek()[1]}' after the end of the traversal")
+        if not isinstance(traversal, Traversal):
+            raise GremlinSyntaxError("Query is not a traversal")
+        return traversal
+
+    def parse_arguments(self):
+        self.expect('(')
+        args = []
+        while not self.at(')'):
+            args.append(self.parse_expression())
+            if not self.at(')'):
+                self.expect(',')
+        self.expect(')')
+        return args
+
+    def parse_steps(self, steps):
+        while self.at('.'):
+            self.next()
+            kind, name = self.next()
+            if kind != 'name':
+                raise GremlinSyntaxError(f"Expected step name but got '{name}'")
+            steps.append(Step(name, self.parse_arguments()))
+        return steps
+
+    def parse_expression(self):
+        kind, value = self.next()
+
+        if kind in ('string', 'number'):
+            return value
+        if kind == 'punct' and value == '[':
+            items = []
+            while not self.at(']'):
+                items.append(self.parse_expression())
+                if not self.at(']'):
+                    self.expect(',')
+            self.expect(']')
+            return items
+        if kind != 'name':
+            raise GremlinSyntaxError(f"Unexpected '{value}'")
+
+        if value in ('true', 'false'):
+            return value == 'true'
+        if value == 'null':
+            return None
+
+        if value in ('g', '__') and self.at('.'):
+            return Traversal(value, self.parse_steps([]))
+
+        if value in QUALIFIERS and self.at('.'):
+            self.next()
+            _, member = self.next()
+            if self.at('('):
+                return Predicate(member, self.parse_arguments(), value)
+            return Identifier(f"{value}.{member}")
+
+        if self.at('('):
+            if value in PREDICATES:
+                return Predicate(value, self.parse_arguments())
+            # Anonymous traversal without the __ prefix, e.g. out('inherits').count()
+            return Traversal(None, self.parse_steps([Step(value, self.parse_arguments())]))
+
+        return Identifier(value)
+
+def parse_gremlin(query):
+    return Parser(query).parse_query()
+
+def quote(text):
+    return "'" + text.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+# Turns a syntax tree (or an argument) back into a query string
+def to_gremlin(node):
+    if isinstance(node, Traversal):
+        steps = [f"{step.name}({', '.join(to_gremlin(arg) for arg in step.args)})" for step in node.steps]
+        if node.source is None:
+            return '.'.join(steps)
+        return '.'.join([node.source] + steps)
+    if isinstance(node, Identifier):
+        return node.name
+    if isinstance(node, Predicate):
+        prefix = f"{node.prefix}." if node.prefix else ""
+        return f"{prefix}{node.name}({', '.join(to_gremlin(arg) for arg in node.args)})"
+    if isinstance(node, str):
+        return quote(node)
+    if isinstance(node, bool):
+        return 'true' if node else 'false'
+    if node is None:
+        return 'null'
+    if isinstance(node, list):
+        return f"[{', '.join(to_gremlin(item) for item in node)}]"
+    return repr(node)
@@ -0,0 +1,381 @@
+#############################################
+# Buffered bulk writer for the Gremlin graph.
+# Vertex and edge mutations are collected and
+# sent as multi-mutation traversals, a bounded
+# number of batches is kept in flight and every
+# submitted batch is waited on and checked.
+#
+# Cosmos DB throttling: the request charge (RU) of
+# every response is recorded, the number of batches
+# in flight adapts AIMD style (grows by one per round
+# of successful batches, halves when a batch is
+# throttled) and submits are paced to stay under an
+# optional RU/s budget. Throttled batches are retried
+# after the retry-after time the server asks for, as
+# upserts, so a partly applied batch is not duplicated.
+# A batch failing for another reason (e.g. one bad
+# vertex) is split in halves, sent again as upserts,
+# until only the failing mutations are left; those
+# are reported and counted per label (with the edges
+# of vertices which failed, which are not sent, and
+# the edges whose endpoint was not found).
+#############################################
+
+from metrics import metrics
+from collections import deque
+import re
+import time
+
+VERTEX_BATCH = "vertex"
+EDGE_BATCH = "edge"
+
+# Status attributes of Cosmos DB Gremlin responses
+STATUS_CODE_ATTRIBUTE = "x-ms-status-code"
+RETRY_AFTER_ATTRIBUTE = "x-ms-retry-after-ms"
+REQUEST_CHARGE_ATTRIBUTES = ("x-ms-total-request-charge", "x-ms-request-charge")
+THROTTLED_STATUS_CODE = 429
+
+# Assumed RU charge of one mutation until the first responses are measured
+DEFAULT_CHARGE_PER_ITEM = 10.0
+
+class GremlinBulkWriter:
+    # ru_budget: RU/s the writes should stay under (None: no pacing, only the reaction to throttling)
+    # max_retries: attempts of a throttled batch before it is counted as failed (other failures split the batch)
+    def __init__(self, gremlin_client, batch_size=50, max_in_flight=8, ru_budget=None, max_retries=10):
+        self.gremlin_client = gremlin_client
+        self.batch_size = max(1, batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max(0, max_retries)
+
+        self.vertex_buffer = []
+        self.edge_buffer = []
+        self.in_flight = deque()
+
+        # Batches allowed in flight, between 1 and max_in_flight
+        self.in_flight_limit = float(self.max_in_flight)
+        self.last_decrease = 0.0
+        self.ru_budget = RequestUnitBudget(ru_budget) if ru_budget else None
+        self.charge_per_item = {}
+
+        self.vertices_written = 0
+        self.edges_written = 0
+        # Batches (single mutations, see _split) which could not be written, and their mutations per label
+        self.failed_batches = 0
+        self.failed_vertex_counts = {}
+        self.failed_edge_counts = {}
+        # Edges to these vertices are not sent, they count as failed as well
+        self.failed_vertex_ids = set()
+        self.request_charge = 0.0
+        self.retries = 0
+        self.throttled_batches = 0
+
+    # Buffer a vertex, properties must contain the vertex 'id'
+    def add_vertex(self, label, properties):
+        self.vertex_buffer.append((label, properties))
+        if len(self.vertex_buffer) >= self.batch_size:
+            self.flush_vertices()
+
+    # Buffer an edge, it is sent only after all buffered vertices are stored
+    def add_edge(self, from_id, edge_label, to_id, properties=None):
+        self.edge_buffer.append((from_id, edge_label, to_id, properties or {}))
+        if len(self.edge_buffer) >= self.batch_size:
+            self.flush_edges()
+
+    def flush_vertices(self):
+        if not self.vertex_buffer:
+            return
+        batch, self.vertex_buffer = self.vertex_buffer, []
+        self._submit(VERTEX_BATCH, batch)
+
+    def flush_edges(self):
+        if not self.edge_buffer:
+            return
+
+        # Endpoints have to exist before the edges referencing them are added
+        self.flush_vertices()
+        self._drain(VERTEX_BATCH)
+
+        batch, self.edge_buffer = self.edge_buffer, []
+        if self.failed_vertex_ids:
+            failed_ids = self.failed_vertex_ids
+            failed = [edge for edge in batch if edge[0] in failed_ids or edge[2] in failed_ids]
+            if failed:
+                self._record_failure(EDGE_BATCH, failed, "endpoint vertex was not written")
+                batch = [edge for edge in batch if not (edge[0] in failed_ids or edge[2] in failed_ids)]
+        if batch:
+            self._submit(EDGE_BATCH, batch)
+
+    # Send everything buffered and wait for all the batches in flight
+    def flush(self):
+        self.flush_vertices()
+        self.flush_edges()
+        self._drain()
+
+    def close(self):
+        self.flush()
+        if self.failed_batches:
+            print(f"ERROR {sum(self.failed_vertex_counts.values())} vertices and "
+                  f"{sum(self.failed_edge_counts.values())} edges failed to be written to the graph")
+
+    def _submit(self, kind, batch):
+        while len(self.in_flight) >= int(self.in_flight_limit):
+            self._wait(self.in_flight.popleft())
+
+        self.in_flight.append((kind, batch, 0) + self._send(kind, batch, 0))
+
+    # Sends one attempt of a batch, returns (future, submit time, reserved charge).
+    # Retries are sent as upserts, the first attempt may have been applied in part.
+    def _send(self, kind, batch, attempt):
+        if kind == VERTEX_BATCH:
+            query, bindings = build_vertices_query(batch, upsert=attempt > 0)
+        else:
+            query, bindings = build_edges_query(batch, upsert=attempt > 0)
+
+        expected_charge = self.charge_per_item.get(kind, DEFAULT_CHARGE_PER_ITEM) * len(batch)
+        if self.ru_budget:
+            self.ru_budget.reserve(expected_charge)
+
+        metrics.increment("submits", kind=kind)
+        submitted = time.perf_counter()
+        return self.gremlin_client.submit_async(query, bindings), submitted, expected_charge
+
+    # Wait for batches in flight, if kind is given only until none of that kind is left
+    def _drain(self, kind=None):
+        while self.in_flight:
+            if kind is not None and not any(entry[0] == kind for entry in self.in_flight):
+                return
+            self._wait(self.in_flight.popleft())
+
+    # Waits for a batch and retries it while it is throttled
+    def _wait(self, entry):
+        kind, batch, attempt, future, submitted, expected_charge = entry
+        while True:
+            try:
+                result_set = future.result()
+                results = result_set.all().result()
+            except Exception as e:
+                # Measured until the batch is waited on, a batch which completed earlier counts a bit longer
+                metrics.observe("gremlin_request", time.perf_counter() - submitted, kind=kind)
+                self._record_charge(kind, len(batch), expected_charge, get_request_charge(e))
+
+                if is_throttled(e) and attempt < self.max_retries:
+                    self._decrease_in_flight_limit(submitted)
+                    time.sleep(get_retry_after(e, attempt))
+                    attempt += 1
+                    self.retries += 1
+                    metrics.increment("retries", kind=kind)
+                    future, submitted, expected_charge = self._send(kind, batch, attempt)
+                    continue
+
+                if len(batch) > 1 and not is_throttled(e):
+                    self._split(kind, batch)
+                    return
+
+                self._record_failure(kind, batch, e)
+                return
+
+            metrics.observe("gremlin_request", time.perf_counter() - submitted, kind=kind)
+            self._record_charge(kind, len(batch), expected_charge, get_request_charge(result_set))
+            self._increase_in_flight_limit()
+            break
+
+        if kind == VERTEX_BATCH:
+            self.vertices_written += len(batch)
+            return
+
+        # An edge branch whose endpoint can not be found adds nothing and returns nothing
+        added = set(results or ())
+        missing = [edge for e, edge in enumerate(batch) if e not in added]
+        if missing:
+            self._record_failure(kind, missing, "endpoint vertex not found")
+        self.edges_written += len(batch) - len(missing)
+
+    # Only the offending mutations of a failed batch should be lost: its halves are sent again (as upserts,
+    # the batch may have been applied in part) and split further while they fail
+    def _split(self, kind, batch):
+        metrics.increment("split_batches", kind=kind)
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            self.in_flight.append((kind, half, 1) + self._send(kind, half, 1))
+
+    def _record_failure(self, kind, batch, exception):
+        self.failed_batches += 1
+        metrics.count_error("gremlin_batch")
+        for item in batch:
+            if kind == VERTEX_BATCH:
+                label = item[0]
+                self.failed_vertex_counts[label] = self.failed_vertex_counts.get(label, 0) + 1
+                self.failed_vertex_ids.add(item[1]["id"])
+            else:
+                label = item[1]
+                self.failed_edge_counts[label] = self.failed_edge_counts.get(label, 0) + 1
+
+        if len(batch) > 1:
+            print(f"ERROR writing batch of {len(batch)} {kind}(s): {exception}")
+        elif kind == VERTEX_BATCH:
+            label, properties = batch[0]
+            print(f"ERROR writing vertex {properties.get('id')} ({label}): {exception}")
+        else:
+            from_id, edge_label, to_id, _ = batch[0]
+            print(f"ERROR writing edge {from_id} -{edge_label}-> {to_id}: {exception}")
+
+    def _record_charge(self, kind, count, expected_charge, charge):
+        if charge is None:
+            return
+        self.request_charge += charge
+        metrics.increment("request_charge", charge, kind=kind)
+        if self.ru_budget:
+            self.ru_budget.settle(expected_charge, charge)
+        if count and charge:
+            # Moving average, the charge depends on the number of properties and the size of the graph
+            per_item = charge / count
+            previous = self.charge_per_item.get(kind)
+            self.charge_per_item[kind] = per_item if previous is None else 0.8 * previous + 0.2 * per_item
+
+    # Additive increase: about one more batch in flight per round of successful batches
+    def _increase_in_flight_limit(self):
+        self.in_flight_limit = min(float(self.max_in_flight), self.in_flight_limit + 1.0 / self.in_flight_limit)
+
+    # Multiplicative decrease, once per throttling episode: batches sent before the
+    # last decrease were sent at the old rate and do not decrease the limit again
+    def _decrease_in_flight_limit(self, submitted):
+        self.throttled_batches += 1
+        metrics.increment("throttled_batches")
+        if submitted > self.last_decrease:
+            self.in_flight_limit = max(1.0, self.in_flight_limit / 2)
+            self.last_decrease = time.perf_counter()
+
+# Token bucket of request units: refills at the budget rate, holds at most one second worth of RU.
+# Submits reserve their expected charge and wait while the bucket does not hold it.
+class RequestUnitBudget:
+    def __init__(self, ru_per_second):
+        self.rate = float(ru_per_second)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, charge):
+        # A batch charged more than the whole budget waits for a full bucket
+        charge = min(charge, self.rate)
+        self.refill()
+        if self.tokens < charge:
+            time.sleep((charge - self.tokens) / self.rate)
+            self.refill()
+        self.tokens -= charge
+
+    # Corrects the reservation with the charge the server reported
+    def settle(self, reserved_charge, charge):
+        self.tokens -= charge - min(reserved_charge, self.rate)
+
+# Status attributes of a ResultSet or of a GremlinServerError, {} if there are none
+def get_status_attributes(response):
+    attributes = getattr(response, "status_attributes", None)
+    return attributes if isinstance(attributes, dict) else {}
+
+# RU charged for a request, None if the server did not report it
+def get_request_charge(response):
+    attributes = get_status_attributes(response)
+    for key in REQUEST_CHARGE_ATTRIBUTES:
+        if key in attributes:
+            try:
+                return float(attributes[key])
+            except (TypeError, ValueError):
+                pass
+    return None
+
+def is_throttled(exception):
+    status_code = get_status_attributes(exception).get(STATUS_CODE_ATTRIBUTE, getattr(exception, "status_code", None))
+    try:
+        if int(status_code) == THROTTLED_STATUS_CODE:
+            return True
+    except (TypeError, ValueError):
+        pass
+    return "RequestRateTooLarge" in str(exception)
+
+# Seconds to wait before the retry: the retry-after the server asked for (milliseconds,
+# or a .NET TimeSpan "hh:mm:ss.fffffff" as Cosmos DB sends it), exponential backoff otherwise
+def get_retry_after(exception, attempt):
+    value = get_status_attributes(exception).get(RETRY_AFTER_ATTRIBUTE)
+    if isinstance(value, (int, float)):
+        return value / 1000
+    if isinstance(value, str):
+        match = re.fullmatch(r"(\d+):(\d+):(\d+(?:\.\d+)?)", value.strip())
+        if match:
+            hours, minutes, seconds = match.groups()
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    return min(0.1 * 2 ** attempt, 5.0)
+
+# Runs a single idempotent request to the end and returns its result, a throttled request is retried
+def submit_with_retries(gremlin_client, query, bindings=None, max_retries=10):
+    attempt = 0
+    while True:
+        try:
+            return gremlin_client.submit(query, bindings).all().result()
+        except Exception as e:
+            if not is_throttled(e) or attempt >= max_retries:
+                raise
+            metrics.increment("retries", kind="request")
+            time.sleep(get_retry_after(e, attempt))
+            attempt += 1
+
+# One traversal adding all the vertices of the batch. As an upsert every vertex is
+# looked up by its id first and only added if missing, its properties are set again.
+def build_vertices_query(batch, upsert=False):
+    bindings = {}
+    branches = []
+
+    for v, (label, properties) in enumerate(batch):
+        bindings[f"v{v}_label"] = label
+        if upsert:
+            bindings[f"v{v}_id"] = properties["id"]
+            branch = f"V(v{v}_id).fold().coalesce(unfold(), addV(v{v}_label).property('id', v{v}_id))"
+        else:
+            branch = f"addV(v{v}_label)"
+
+        for p, (key, value) in enumerate(properties.items()):
+            if key == "label" or (upsert and key == "id"):
+                continue
+            branch += f".property('{key}', v{v}_p{p})"
+            bindings[f"v{v}_p{p}"] = value
+
+        branches.append(branch)
+
+    if upsert:
+        return f"g.inject(0).union({', '.join(branches)})", bindings
+    return "g." + ".".join(branches), bindings
+
+# One traversal adding all the edges of the batch. Every edge is a separate union
+# branch, so an endpoint that cannot be found does not stop the rest of the batch.
+# A branch returns the number of its edge, the missing numbers are the edges not added.
+# As an upsert an edge is only added if the same edge does not exist yet.
+def build_edges_query(batch, upsert=False):
+    branches = []
+    bindings = {}
+
+    for e, (from_id, edge_label, to_id, properties) in enumerate(batch):
+        if upsert:
+            branch = (f"V(e{e}_from).as('e{e}').V(e{e}_to)"
+                      f".coalesce(inE(e{e}_label).where(outV().hasId(e{e}_from)), addE(e{e}_label).from('e{e}'))")
+        else:
+            branch = f"V(e{e}_from).as('e{e}').V(e{e}_to).addE(e{e}_label).from('e{e}')"
+        bindings[f"e{e}_from"] = from_id
+        bindings[f"e{e}_to"] = to_id
+        bindings[f"e{e}_label"] = edge_label
+
+        for p, (key, value) in enumerate(properties.items()):
+            branch += f".property(e{e}_k{p}, e{e}_p{p})"
+            bindings[f"e{e}_k{p}"] = key
+            bindings[f"e{e}_p{p}"] = value
+
+        branches.append(branch + f".constant({e})")
+
+    query = f"g.inject(0).union({', '.join(branches)})"
+    return query, bindings
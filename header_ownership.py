@@ -0,0 +1,51 @@
+#############################################
+# Ownership of the headers shared by translation
+# units: the first translation unit which includes a
+# header under a preprocessor context claims it and
+# extracts its declarations, later ones (in the same
+# or a later incremental run) skip the cursors
+# located in it. The context is a hash of the
+# arguments changing what the preprocessor makes of
+# a header (macros, language standard, forced
+# includes, target), a header included under another
+# context is claimed and walked once more.
+#
+# Claims go through a UsrRegistry (a plain one in the
+# sequential path, the shared manager one for the
+# worker processes), with one key per header and context.
+#############################################
+
+import hashlib
+import json
+
+# Arguments taking their value as the next argument
+SEPARATE_VALUE_ARGUMENTS = ('-D', '-U', '-include', '-imacros', '-target', '--target', '-x')
+# Arguments (with their value attached) belonging to the preprocessor context
+CONTEXT_ARGUMENT_PREFIXES = ('-D', '-U', '-std=', '--std=', '-include', '-imacros', '--target=', '-x', '-f', '-m')
+
+def get_preprocessor_context_hash(clang_args):
+    context = []
+    arguments = iter(clang_args)
+    for argument in arguments:
+        if argument in SEPARATE_VALUE_ARGUMENTS:
+            context.append(argument + next(arguments, ''))
+        elif argument.startswith(CONTEXT_ARGUMENT_PREFIXES):
+            context.append(argument)
+    return hashlib.sha1(json.dumps(context).encode('utf-8')).hexdigest()[:16]
+
+def get_header_key(file_path, context_hash):
+    return f"{context_hash}:{file_path}"
+
+# Registry keys of recorded owners ({file path: {context hash: translation unit path}})
+def get_header_keys(header_owners):
+    return [get_header_key(file_path, context_hash)
+            for file_path, contexts in header_owners.items() for context_hash in contexts]
+
+# Headers of the translation unit which it extracts itself, claimed in the registry, as {file path: {context hash: tu path}},
+# and the set of headers whose declarations another translation unit extracts
+def claim_headers(registry, tu_path, header_paths, context_hash):
+    keys = {get_header_key(file_path, context_hash): file_path for file_path in header_paths if file_path != tu_path}
+    claimed = set(registry.claim(list(keys)))
+    claims = {file_path: {context_hash: tu_path} for key, file_path in keys.items() if key in claimed}
+    owned_elsewhere = {file_path for key, file_path in keys.items() if key not in claimed}
+    return claims, owned_elsewhere
@@ -0,0 +1,190 @@
+#############################################
+# Local manifest used for incremental ingestion.
+# It stores content hashes of every file that was
+# ingested, the compile flags and the list of files
+# of every translation unit, the vertex ids
+# emitted from every file and the files the derived
+# data (qualified names, inheritance closure) of
+# every file depends on, and the translation unit
+# owning every shared header per preprocessor context.
+#############################################
+
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+def hash_file_content(file_path):
+    hasher = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def hash_flags(clang_args):
+    return hashlib.sha1(json.dumps(clang_args).encode('utf-8')).hexdigest()
+
+class IngestManifest:
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.tus = {}
+        self.file_vertices = {}
+        self.file_dependencies = {}
+        # {header path: {preprocessor context hash: path of the translation unit which extracted it}}
+        self.header_owners = {}
+        self.current_hashes = {}
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.files = data["files"]
+                self.tus = data["tus"]
+                self.file_vertices = {file_id: set(ids) for file_id, ids in data["file_vertices"].items()}
+                # Missing in manifests written before the derived data was materialized
+                self.file_dependencies = {file_path: set(paths) for file_path, paths in data.get("file_dependencies", {}).items()}
+                # Missing in manifests written before headers were deduplicated, every header is then walked once more
+                self.header_owners = data.get("header_owners", {})
+
+    # Content hash of the file as it is now (None if it does not exist anymore).
+    # Content is only re-read when size or modification time differ from the stored ones.
+    def get_current_hash(self, file_path):
+        if file_path in self.current_hashes:
+            return self.current_hashes[file_path]
+
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self.current_hashes[file_path] = None
+            return None
+
+        stored = self.files.get(file_path)
+        if stored and stored["size"] == stat.st_size and stored["mtime"] == stat.st_mtime:
+            current_hash = stored["hash"]
+        else:
+            current_hash = hash_file_content(file_path)
+
+        self.current_hashes[file_path] = current_hash
+        return current_hash
+
+    def is_file_changed(self, file_path):
+        stored = self.files.get(file_path)
+        return stored is None or stored["hash"] != self.get_current_hash(file_path)
+
+    # True if the translation unit was ingested with the same flags and none of its files changed since
+    def is_tu_unchanged(self, tu_path, clang_args):
+        stored = self.tus.get(tu_path)
+        if stored is None or stored["flags"] != hash_flags(clang_args):
+            return False
+        return not any(self.is_file_changed(file_path) for file_path in stored["files"])
+
+    # Files whose graph data is outdated: changed or removed files, all files of the given translation
+    # units that are going to be parsed with different flags, and the files depending on any of them
+    def get_dirty_files(self, translation_units):
+        dirty_files = {file_path for file_path in self.files if self.is_file_changed(file_path)}
+
+        for tu_path, clang_args in translation_units:
+            stored = self.tus.get(tu_path)
+            if stored is not None and stored["flags"] != hash_flags(clang_args):
+                dirty_files.update(stored["files"])
+
+        # A derived class stays in the graph with the closure of its old bases unless its file is rewritten too.
+        # Every translation unit of a dependent file includes its dependencies, so the file is walked again.
+        changed = True
+        while changed:
+            changed = False
+            for file_path, dependency_paths in self.file_dependencies.items():
+                if file_path not in dirty_files and not dirty_files.isdisjoint(dependency_paths):
+                    dirty_files.add(file_path)
+                    changed = True
+
+        return dirty_files
+
+    def record_tu(self, tu_path, clang_args, file_paths):
+        self.tus[tu_path] = {"flags": hash_flags(clang_args), "files": sorted(file_paths)}
+
+        for file_path in file_paths:
+            current_hash = self.get_current_hash(file_path)
+            if current_hash is None:
+                continue
+            stat = os.stat(file_path)
+            self.files[file_path] = {"hash": current_hash, "size": stat.st_size, "mtime": stat.st_mtime}
+
+    # Ids of the vertices which stay in the graph when the given files are dropped
+    def get_kept_vertex_ids(self, dropped_file_ids):
+        return {id for file_id, ids in self.file_vertices.items() if file_id not in dropped_file_ids for id in ids}
+
+    # Vertices of rewritten files replace the stored ones, other files only get new vertices added
+    def record_file_vertices(self, file_vertices, rewritten_file_ids):
+        for file_id in rewritten_file_ids:
+            self.file_vertices.pop(file_id, None)
+        for file_id, ids in file_vertices.items():
+            self.file_vertices.setdefault(file_id, set()).update(ids)
+
+    # Dependencies of rewritten files replace the stored ones, other files only get new dependencies added
+    def record_file_dependencies(self, file_dependencies, rewritten_files):
+        for file_path in rewritten_files:
+            self.file_dependencies.pop(file_path, None)
+        for file_path, dependency_paths in file_dependencies.items():
+            self.file_dependencies.setdefault(file_path, set()).update(dependency_paths)
+
+    # Owners of the headers whose data stays in the graph: the header is not rewritten and its owner was ingested
+    def get_header_owners(self, dirty_files):
+        return {file_path: {context_hash: tu_path for context_hash, tu_path in contexts.items() if tu_path in self.tus}
+                for file_path, contexts in self.header_owners.items() if file_path not in dirty_files}
+
+    # Owners of rewritten headers are replaced by the ones which extracted them in this run
+    def record_header_owners(self, header_owners, rewritten_files):
+        for file_path in rewritten_files:
+            self.header_owners.pop(file_path, None)
+        for file_path, contexts in header_owners.items():
+            self.header_owners.setdefault(file_path, {}).update(contexts)
+
+    def save(self):
+        data = {
+            "version": MANIFEST_VERSION,
+            "files": self.files,
+            "tus": self.tus,
+            "file_vertices": {file_id: sorted(ids) for file_id, ids in self.file_vertices.items()},
+            "file_dependencies": {file_path: sorted(paths) for file_path, paths in self.file_dependencies.items()},
+            "header_owners": self.header_owners,
+        }
+
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temporary_path, self.path)
+
+# Sits in front of the graph writer during an incremental run and lets through only
+# vertices missing from the graph after the dirty files were dropped, and the edges touching them.
+# A vertex can be recorded under another file than the one it is emitted from now
+# (e.g. a namespace first seen in another translation unit), so the check is by id.
+class IncrementalFilter:
+    def __init__(self, writer, manifest, dirty_file_ids):
+        self.writer = writer
+        self.manifest = manifest
+        self.dirty_file_ids = dirty_file_ids
+        self.kept_vertex_ids = manifest.get_kept_vertex_ids(dirty_file_ids)
+        self.written_vertex_ids = set()
+        self.written_file_vertices = {}
+
+    def add_vertex(self, label, properties):
+        id = properties["id"]
+        if id in self.kept_vertex_ids or id in self.written_vertex_ids:
+            return
+
+        self.written_vertex_ids.add(id)
+        self.written_file_vertices.setdefault(properties["file"], set()).add(id)
+        self.writer.add_vertex(label, properties)
+
+    def add_edge(self, from_id, edge_label, to_id, properties=None):
+        if self.is_rewritten(from_id) or self.is_rewritten(to_id):
+            self.writer.add_edge(from_id, edge_label, to_id, properties)
+
+    def is_rewritten(self, id):
+        return id in self.written_vertex_ids
+
+    def close(self):
+        self.manifest.record_file_vertices(self.written_file_vertices, self.dirty_file_ids)
@@ -0,0 +1,1294 @@
+#############################################
+# Embedded in-process graph store.
+# Vertices and edges are kept in adjacency lists
+# with hash indexes on id, label and the indexed
+# properties (spelling, usr, file). It executes
+# the Gremlin step subset used by this project and
+# mimics gremlin_python's Client (submit/submit_async),
+# so it can be used anywhere the Cosmos client is.
+#############################################
+
+from concurrent.futures import Future
+from gremlin_parser import parse_gremlin, Traversal, Identifier, Predicate
+from graph_snapshot import SnapshotWriter, load_snapshot
+import itertools
+import os
+import random
+import re
+import threading
+import uuid
+
+INDEXED_PROPERTIES = ('spelling', 'usr', 'file')
+
+# Traversals over cyclic graphs without simplePath()/times() are stopped after this many loops
+MAX_REPEAT_LOOPS = 100
+
+class GremlinQueryError(Exception):
+    pass
+
+class Vertex:
+    __slots__ = ('id', 'label', 'properties', 'out_edges', 'in_edges')
+
+    def __init__(self, id, label, properties):
+        self.id = id
+        self.label = label
+        self.properties = properties
+        self.out_edges = {}
+        self.in_edges = {}
+
+class Edge:
+    __slots__ = ('id', 'label', 'out_vertex', 'in_vertex', 'properties')
+
+    def __init__(self, id, label, out_vertex, in_vertex, properties):
+        self.id = id
+        self.label = label
+        self.out_vertex = out_vertex
+        self.in_vertex = in_vertex
+        self.properties = properties
+
+class VertexProperty:
+    __slots__ = ('element', 'key', 'value')
+
+    def __init__(self, element, key, value):
+        self.element = element
+        self.key = key
+        self.value = value
+
+class Traverser:
+    __slots__ = ('obj', 'path', 'labels', 'loops')
+
+    def __init__(self, obj, path, labels, loops=0):
+        self.obj = obj
+        self.path = path
+        self.labels = labels
+        self.loops = loops
+
+    # New traverser moved to obj, the object is appended to the path
+    def split(self, obj):
+        return Traverser(obj, self.path + [obj], self.labels.copy(), self.loops)
+
+    def copy(self):
+        return Traverser(self.obj, self.path, self.labels.copy(), self.loops)
+
+#############################################
+# Result set compatible with gremlin_python
+#############################################
+
+class MemoryResultSet:
+    def __init__(self, results, chunk_size=64):
+        self.results = results
+        self.chunk_size = chunk_size
+        self.position = 0
+        self.status_attributes = {}
+
+    def all(self):
+        future = Future()
+        future.set_result(self.results[self.position:])
+        self.position = len(self.results)
+        return future
+
+    # Next chunk of results, empty list when everything was read
+    def one(self):
+        chunk = self.results[self.position:self.position + self.chunk_size]
+        self.position += len(chunk)
+        return chunk
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = self.one()
+        if not chunk:
+            raise StopIteration
+        return chunk
+
+def failed_future(exception):
+    future = Future()
+    future.set_exception(exception)
+    return future
+
+class FailedResultSet(MemoryResultSet):
+    def __init__(self, exception):
+        super().__init__([])
+        self.exception = exception
+
+    def all(self):
+        return failed_future(self.exception)
+
+    def one(self):
+        raise self.exception
+
+#############################################
+# Graph store
+#############################################
+
+class MemoryGraph:
+    def __init__(self, snapshot_path=None):
+        self.vertices = {}
+        self.edges = {}
+        self.label_index = {}
+        self.property_index = {key: {} for key in INDEXED_PROPERTIES}
+        self.edge_ids = itertools.count(1)
+        self.lock = threading.RLock()
+        self.snapshot_path = snapshot_path
+        self.modified = False
+        self.parsed_queries = {}
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            load_snapshot(snapshot_path, self)
+            self.modified = False
+
+    @staticmethod
+    def from_snapshot(path):
+        return MemoryGraph(path)
+
+    # Same interface as GremlinBulkWriter, so the graph can be filled directly
+    def add_vertex(self, label, properties):
+        id = properties.get('id')
+        properties = {key: value for key, value in properties.items() if key not in ('id', 'label')}
+        return self.create_vertex(label, properties, id)
+
+    def create_vertex(self, label, properties, id=None):
+        with self.lock:
+            if id is None:
+                raise GremlinQueryError("Vertex id is required")
+            if id in self.vertices:
+                raise GremlinQueryError(f"Vertex with id '{id}' already exists")
+            vertex = Vertex(id, label, {})
+            self.vertices[id] = vertex
+            self.label_index.setdefault(label, {})[id] = vertex
+            for key, value in properties.items():
+                self.set_property(vertex, key, value)
+            self.modified = True
+            return vertex
+
+    def add_edge(self, from_id, edge_label, to_id, properties=None):
+        with self.lock:
+            out_vertex = self.vertices.get(from_id)
+            in_vertex = self.vertices.get(to_id)
+            if out_vertex is None or in_vertex is None:
+                return None
+            return self.create_edge(edge_label, out_vertex, in_vertex, properties or {})
+
+    def create_edge(self, label, out_vertex, in_vertex, properties):
+        edge = Edge(f"e{next(self.edge_ids)}", label, out_vertex, in_vertex, dict(properties))
+        self.edges[edge.id] = edge
+        out_vertex.out_edges.setdefault(label, []).append(edge)
+        in_vertex.in_edges.setdefault(label, []).append(edge)
+        self.modified = True
+        return edge
+
+    def set_property(self, element, key, value):
+        if isinstance(element, Vertex):
+            if key == 'id':
+                self.rename_vertex(element, value)
+                return
+            if key in self.property_index:
+                old_value = element.properties.get(key)
+                if key in element.properties:
+                    self.property_index[key].get(old_value, {}).pop(element.id, None)
+                self.property_index[key].setdefault(value, {})[element.id] = element
+        element.properties[key] = value
+        self.modified = True
+
+    # Vertices created by addV() get their id from a following property('id', ...)
+    def rename_vertex(self, vertex, id):
+        if id == vertex.id:
+            return
+        if id in self.vertices:
+            # Like a Cosmos DB conflict, the vertex is not created at all
+            self.remove_vertex(vertex)
+            raise GremlinQueryError(f"Vertex with id '{id}' already exists")
+        del self.vertices[vertex.id]
+        del self.label_index[vertex.label][vertex.id]
+        for key in self.property_index:
+            if key in vertex.properties:
+                self.property_index[key][vertex.properties[key]].pop(vertex.id, None)
+        vertex.id = id
+        self.vertices[id] = vertex
+        self.label_index[vertex.label][id] = vertex
+        for key in self.property_index:
+            if key in vertex.properties:
+                self.property_index[key].setdefault(vertex.properties[key], {})[id] = vertex
+
+    def remove_edge(self, edge):
+        if self.edges.pop(edge.id, None) is None:
+            return
+        edge.out_vertex.out_edges[edge.label].remove(edge)
+        edge.in_vertex.in_edges[edge.label].remove(edge)
+        self.modified = True
+
+    def remove_vertex(self, vertex):
+        if self.vertices.pop(vertex.id, None) is None:
+            return
+        for edges in list(vertex.out_edges.values()) + list(vertex.in_edges.values()):
+            for edge in list(edges):
+                self.remove_edge(edge)
+        del self.label_index[vertex.label][vertex.id]
+        for key in self.property_index:
+            if key in vertex.properties:
+                self.property_index[key][vertex.properties[key]].pop(vertex.id, None)
+        self.modified = True
+
+    def save_snapshot(self, path):
+        writer = SnapshotWriter(path)
+        with self.lock:
+            for vertex in self.vertices.values():
+                writer.add_vertex(vertex.label, dict(vertex.properties, id=vertex.id))
+            for edge in self.edges.values():
+                writer.add_edge(edge.out_vertex.id, edge.label, edge.in_vertex.id, edge.properties)
+        writer.close()
+
+    #############################################
+    # gremlin_python Client compatible interface
+    #############################################
+
+    def execute(self, query, bindings=None):
+        traversal = self.parsed_queries.get(query)
+        if traversal is None:
+            traversal = parse_gremlin(query)
+            if len(self.parsed_queries) < 1024:
+                self.parsed_queries[query] = traversal
+
+        with self.lock:
+            engine = TraversalEngine(self, bindings or {})
+            return [to_result(traverser.obj) for traverser in engine.run_source(traversal)]
+
+    def submit(self, message, bindings=None, request_options=None):
+        try:
+            return MemoryResultSet(self.execute(message, bindings))
+        except Exception as e:
+            return FailedResultSet(e)
+
+    def submit_async(self, message, bindings=None, request_options=None):
+        future = Future()
+        future.set_result(self.submit(message, bindings, request_options))
+        return future
+
+    # Changes are persisted into the snapshot the graph was loaded from
+    def close(self):
+        if self.snapshot_path and self.modified:
+            self.save_snapshot(self.snapshot_path)
+            self.modified = False
+
+#############################################
+# Conversion of results to the GraphSON-like structures Cosmos returns
+#############################################
+
+def to_result(obj):
+    if isinstance(obj, Vertex):
+        return {
+            'id': obj.id,
+            'label': obj.label,
+            'type': 'vertex',
+            'properties': {key: [{'id': f"{obj.id}|{key}", 'value': value}] for key, value in obj.properties.items()}
+        }
+    if isinstance(obj, Edge):
+        return {
+            'id': obj.id,
+            'label': obj.label,
+            'type': 'edge',
+            'inVLabel': obj.in_vertex.label,
+            'outVLabel': obj.out_vertex.label,
+            'inV': obj.in_vertex.id,
+            'outV': obj.out_vertex.id,
+            'properties': dict(obj.properties)
+        }
+    if isinstance(obj, VertexProperty):
+        return {'id': f"{obj.element.id}|{obj.key}", 'value': obj.value, 'label': obj.key}
+    if isinstance(obj, dict):
+        return {to_result_key(key): to_result(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_result(item) for item in obj]
+    return obj
+
+def to_result_key(key):
+    if isinstance(key, (Vertex, Edge)):
+        return key.id
+    if isinstance(key, (list, tuple, dict, VertexProperty)):
+        return str(to_result(key))
+    return key
+
+# Hashable stand-in for dedup/group of any traversal object
+def hashable(obj):
+    if isinstance(obj, dict):
+        return ('dict', tuple(sorted((repr(hashable(k)), hashable(v)) for k, v in obj.items())))
+    if isinstance(obj, (list, tuple)):
+        return ('list', tuple(hashable(item) for item in obj))
+    if isinstance(obj, VertexProperty):
+        return ('property', obj.element.id, obj.key)
+    return obj
+
+def sort_key(value):
+    if value is None:
+        return (2, 0, '')
+    if isinstance(value, (Vertex, Edge)):
+        return (1, 0, str(value.id))
+    if isinstance(value, bool) or isinstance(value, (int, float)):
+        return (0, 0, float(value))
+    return (1, 1, str(value))
+
+#############################################
+# Predicates (P and TextP)
+#############################################
+
+def as_list(value):
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
+
+def flatten_args(args):
+    values = []
+    for arg in args:
+        values.extend(as_list(arg))
+    return values
+
+def compare(test):
+    def predicate(value):
+        try:
+            return value is not None and test(value)
+        except TypeError:
+            return False
+    return predicate
+
+def text(test):
+    return lambda value: isinstance(value, str) and test(value)
+
+def make_predicate(name, args):
+    if name == 'eq':
+        return lambda value: value == args[0]
+    if name == 'neq':
+        return lambda value: value != args[0]
+    if name == 'lt':
+        return compare(lambda value: value < args[0])
+    if name == 'lte':
+        return compare(lambda value: value <= args[0])
+    if name == 'gt':
+        return compare(lambda value: value > args[0])
+    if name == 'gte':
+        return compare(lambda value: value >= args[0])
+    if name == 'inside':
+        return compare(lambda value: args[0] < value < args[1])
+    if name == 'outside':
+        return compare(lambda value: value < args[0] or value > args[1])
+    if name == 'between':
+        return compare(lambda value: args[0] <= value < args[1])
+    if name == 'within':
+        values = flatten_args(args)
+        return lambda value: value in values
+    if name == 'without':
+        values = flatten_args(args)
+        return lambda value: value not in values
+    if name == 'containing':
+        return text(lambda value: args[0] in value)
+    if name == 'notContaining':
+        return text(lambda value: args[0] not in value)
+    if name == 'startingWith':
+        return text(lambda value: value.startswith(args[0]))
+    if name == 'notStartingWith':
+        return text(lambda value: not value.startswith(args[0]))
+    if name == 'endingWith':
+        return text(lambda value: value.endswith(args[0]))
+    if name == 'notEndingWith':
+        return text(lambda value: not value.endswith(args[0]))
+    if name == 'regex':
+        pattern = re.compile(args[0])
+        return text(lambda value: pattern.search(value) is not None)
+    if name == 'not':
+        return lambda value: not args[0](value)
+    raise GremlinQueryError(f"Unsupported predicate {name}")
+
+#############################################
+# Traversal execution
+#############################################
+
+# Modulators are attached to the step they follow (until/emit may also precede repeat)
+MODULATORS = {'by', 'times', 'until', 'emit', 'from', 'to', 'option'}
+
+# Steps which reduce all their input into one result
+REDUCING_STEPS = {'count', 'fold', 'sum', 'max', 'min', 'mean', 'group', 'groupCount', 'tree', 'cap'}
+
+class CompiledStep:
+    __slots__ = ('name', 'args', 'modulators')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.modulators = []
+
+    def modulator_args(self, name):
+        return [args for modulator, args in self.modulators if modulator == name]
+
+def compile_steps(steps):
+    compiled = []
+    pending = []
+    for step in steps:
+        if step.name in ('until', 'emit') and (not compiled or compiled[-1].name != 'repeat'):
+            # until()/emit() in front of repeat() are kept for the following repeat
+            pending.append((step.name + '_before', step.args))
+            continue
+        if step.name in MODULATORS and compiled:
+            compiled[-1].modulators.append((step.name, step.args))
+            continue
+        current = CompiledStep(step.name, step.args)
+        if step.name == 'repeat':
+            current.modulators.extend(pending)
+            pending = []
+        compiled.append(current)
+    return compiled
+
+class TraversalEngine:
+    def __init__(self, graph, bindings):
+        self.graph = graph
+        self.bindings = bindings
+        self.side_effects = {}
+        self.compiled = {}
+
+    def steps_of(self, traversal):
+        compiled = self.compiled.get(id(traversal))
+        if compiled is None:
+            compiled = compile_steps(traversal.steps)
+            self.compiled[id(traversal)] = compiled
+        return compiled
+
+    # Values of step arguments: bindings resolved, predicates built, traversals kept as they are
+    def value(self, arg):
+        if isinstance(arg, Identifier):
+            if arg.name in self.bindings:
+                return self.bindings[arg.name]
+            return arg
+        if isinstance(arg, Predicate):
+            return make_predicate(arg.name, [self.value(a) for a in arg.args])
+        if isinstance(arg, list):
+            return [self.value(a) for a in arg]
+        return arg
+
+    def values(self, args):
+        return [self.value(arg) for arg in args]
+
+    def run_source(self, traversal):
+        if traversal.source not in ('g', None, '__'):
+            raise GremlinQueryError(f"Unknown traversal source {traversal.source}")
+        steps = self.steps_of(traversal)
+        if not steps:
+            return []
+        return self.run_steps(steps, [Traverser(None, [], {})], from_source=True)
+
+    # Runs an anonymous traversal for a single traverser
+    def run_child(self, traversal, traverser):
+        return self.run_steps(self.steps_of(traversal), [traverser.copy()])
+
+    def run_child_many(self, traversal, traversers):
+        return self.run_steps(self.steps_of(traversal), [t.copy() for t in traversers])
+
+    def test(self, traversal, traverser):
+        return len(self.run_child(traversal, traverser)) > 0
+
+    def run_steps(self, steps, traversers, from_source=False):
+        for index, step in enumerate(steps):
+            handler = getattr(self, f"step_{step.name}", None)
+            if handler is None:
+                raise GremlinQueryError(f"Unsupported Gremlin step {step.name}()")
+            if from_source and index == 0 and step.name == 'V':
+                traversers = self.start_vertices(step, steps[1:], traversers[0])
+            else:
+                traversers = handler(step, traversers)
+            if not traversers and step.name not in REDUCING_STEPS and not step.name.startswith('add'):
+                # Nothing left, only reducing steps (count, fold...) can still produce a result
+                if not any(s.name in REDUCING_STEPS or s.name == 'inject' for s in steps[index + 1:]):
+                    return []
+        return traversers
+
+    #############################################
+    # Index based start of g.V()
+    #############################################
+
+    def vertices_by_ids(self, ids):
+        return [self.graph.vertices[id] for id in ids if not isinstance(id, (list, dict)) and id in self.graph.vertices]
+
+    # Candidate vertices for g.V() using the id/label/property indexes for the filters right after it
+    def start_vertices(self, step, following_steps, traverser):
+        ids = flatten_args(self.values(step.args))
+        if ids:
+            candidates = self.vertices_by_ids(ids)
+        else:
+            candidates = None
+            for next_step in following_steps:
+                indexed = self.indexed_candidates(next_step)
+                if indexed is None:
+                    if next_step.name in ('has', 'hasLabel', 'hasId'):
+                        continue
+                    break
+                if candidates is None or len(indexed) < len(candidates):
+                    candidates = indexed
+            if candidates is None:
+                candidates = list(self.graph.vertices.values())
+        return [traverser.split(vertex) for vertex in candidates]
+
+    def indexed_candidates(self, step):
+        args = self.values(step.args)
+        if step.name == 'hasId' and args and not callable(args[0]):
+            return self.vertices_by_ids(flatten_args(args))
+        if step.name == 'hasLabel' and args and not callable(args[0]):
+            return [vertex for label in flatten_args(args) for vertex in self.graph.label_index.get(label, {}).values()]
+        if step.name == 'has' and len(args) in (2, 3):
+            key, value = args[-2], args[-1]
+            key = key.token if isinstance(key, Identifier) else key
+            # Exact values and eq()/within() predicates can be looked up
+            predicate = step.args[-1]
+            if isinstance(predicate, Predicate) and predicate.name in ('eq', 'within'):
+                values = flatten_args(self.values(predicate.args))
+            elif callable(value) or isinstance(value, (Identifier, Traversal)):
+                return None
+            else:
+                values = [value]
+            values = [value for value in values if not isinstance(value, (list, dict))]
+            candidates = None
+            if key == 'id':
+                candidates = self.vertices_by_ids(values)
+            elif key == 'label':
+                candidates = [vertex for value in values for vertex in self.graph.label_index.get(value, {}).values()]
+            elif key in self.graph.property_index:
+                candidates = [vertex for value in values for vertex in self.graph.property_index[key].get(value, {}).values()]
+            if candidates is not None and len(args) == 3:
+                candidates = [vertex for vertex in candidates if vertex.label == args[0]]
+            return candidates
+        return None
+
+    #############################################
+    # Helpers
+    #############################################
+
+    def property_value(self, obj, key):
+        if isinstance(key, Identifier):
+            key = key.token
+        if isinstance(obj, (Vertex, Edge)):
+            if key == 'id':
+                return obj.id
+            if key == 'label':
+                return obj.label
+            return obj.properties.get(key)
+        if isinstance(obj, dict):
+            return obj.get(key)
+        if isinstance(obj, VertexProperty):
+            return obj.value if key == 'value' else obj.key if key == 'key' else None
+        return None
+
+    def has_property(self, obj, key):
+        if isinstance(obj, (Vertex, Edge)):
+            return key in ('id', 'label') or key in obj.properties
+        if isinstance(obj, dict):
+            return key in obj
+        return False
+
+    # Applies a by() modulator (no argument, property key, token or traversal) to a traverser
+    def apply_by(self, by_args, traverser):
+        if not by_args:
+            return traverser.obj
+        modulator = self.value(by_args[0])
+        if isinstance(modulator, Traversal):
+            results = self.run_child(modulator, traverser)
+            return results[0].obj if results else None
+        if isinstance(modulator, Identifier):
+            token = modulator.token
+            if token in ('id', 'label'):
+                return self.property_value(traverser.obj, token)
+            if token == 'keys':
+                return list(traverser.obj.keys()) if isinstance(traverser.obj, dict) else None
+            if token == 'values':
+                return list(traverser.obj.values()) if isinstance(traverser.obj, dict) else None
+            return self.property_value(traverser.obj, token)
+        if callable(modulator):
+            return modulator(traverser.obj)
+        return self.property_value(traverser.obj, modulator)
+
+    def by_modulators(self, step):
+        return step.modulator_args('by')
+
+    def elements(self, obj):
+        if not isinstance(obj, (Vertex, Edge)):
+            raise GremlinQueryError(f"Step expects a vertex or an edge, got {type(obj).__name__}")
+        return obj
+
+    #############################################
+    # Source and mutation steps
+    #############################################
+
+    def step_V(self, step, traversers):
+        ids = flatten_args(self.values(step.args))
+        vertices = self.vertices_by_ids(ids) if ids else list(self.graph.vertices.values())
+        return [t.split(vertex) for t in traversers for vertex in vertices]
+
+    def step_E(self, step, traversers):
+        ids = flatten_args(self.values(step.args))
+        edges = [self.graph.edges[id] for id in ids if id in self.graph.edges] if ids else list(self.graph.edges.values())
+        return [t.split(edge) for t in traversers for edge in edges]
+
+    def step_inject(self, step, traversers):
+        values = self.values(step.args)
+        injected = [t.split(value) for t in traversers[:1] for value in values]
+        if traversers and traversers[0].obj is None and not traversers[0].path:
+            return injected
+        return traversers + injected
+
+    def step_addV(self, step, traversers):
+        args = self.values(step.args)
+        label = args[0] if args and isinstance(args[0], str) else 'vertex'
+        results = []
+        for t in traversers:
+            # Generated id like Cosmos DB does, usually replaced by a following property('id', ...)
+            vertex = self.graph.create_vertex(label, {}, id=str(uuid.uuid4()))
+            results.append(t.split(vertex))
+        return results
+
+    def step_addE(self, step, traversers):
+        label = self.value(step.args[0])
+        from_args = step.modulator_args('from')
+        to_args = step.modulator_args('to')
+        results = []
+        for t in traversers:
+            out_vertex = self.resolve_endpoint(from_args, t)
+            in_vertex = self.resolve_endpoint(to_args, t)
+            if not isinstance(out_vertex, Vertex) or not isinstance(in_vertex, Vertex):
+                raise GremlinQueryError("addE() endpoints have to be vertices")
+            results.append(t.split(self.graph.create_edge(label, out_vertex, in_vertex, {})))
+        return results
+
+    def resolve_endpoint(self, modulator_args, traverser):
+        if not modulator_args:
+            return traverser.obj
+        target = self.value(modulator_args[-1][0])
+        if isinstance(target, Traversal):
+            results = self.run_child(target, traverser)
+            return results[0].obj if results else None
+        if isinstance(target, (Vertex, Edge)):
+            return target
+        label = target.name if isinstance(target, Identifier) else target
+        return traverser.labels.get(label)
+
+    def step_property(self, step, traversers):
+        args = self.values(step.args)
+        # Optional cardinality (single, list, set) in front of the key
+        if len(args) >= 3 and isinstance(args[0], Identifier):
+            args = args[1:]
+        key, value = args[0], args[1]
+        key = key.token if isinstance(key, Identifier) else key
+        for t in traversers:
+            self.graph.set_property(self.elements(t.obj), key, value)
+        return traversers
+
+    def step_drop(self, step, traversers):
+        for t in traversers:
+            if isinstance(t.obj, Vertex):
+                self.graph.remove_vertex(t.obj)
+            elif isinstance(t.obj, Edge):
+                self.graph.remove_edge(t.obj)
+            elif isinstance(t.obj, VertexProperty):
+                t.obj.element.properties.pop(t.obj.key, None)
+        return []
+
+    #############################################
+    # Navigation steps
+    #############################################
+
+    def adjacent_edges(self, vertex, direction, labels):
+        edge_map = vertex.out_edges if direction == 'out' else vertex.in_edges
+        if labels:
+            return [edge for label in labels for edge in edge_map.get(label, ())]
+        return [edge for edges in edge_map.values() for edge in edges]
+
+    def navigate(self, step, traversers, directions, to_vertex):
+        labels = flatten_args(self.values(step.args))
+        results = []
+        for t in traversers:
+            vertex = t.obj
+            if not isinstance(vertex, Vertex):
+                continue
+            for direction in directions:
+                for edge in self.adjacent_edges(vertex, direction, labels):
+                    if to_vertex:
+                        results.append(t.split(edge.in_vertex if direction == 'out' else edge.out_vertex))
+                    else:
+                        results.append(t.split(edge))
+        return results
+
+    def step_out(self, step, traversers):
+        return self.navigate(step, traversers, ('out',), True)
+
+    def step_in(self, step, traversers):
+        return self.navigate(step, traversers, ('in',), True)
+
+    def step_both(self, step, traversers):
+        return self.navigate(step, traversers, ('out', 'in'), True)
+
+    def step_outE(self, step, traversers):
+        return self.navigate(step, traversers, ('out',), False)
+
+    def step_inE(self, step, traversers):
+        return self.navigate(step, traversers, ('in',), False)
+
+    def step_bothE(self, step, traversers):
+        return self.navigate(step, traversers, ('out', 'in'), False)
+
+    def step_outV(self, step, traversers):
+        return [t.split(t.obj.out_vertex) for t in traversers if isinstance(t.obj, Edge)]
+
+    def step_inV(self, step, traversers):
+        return [t.split(t.obj.in_vertex) for t in traversers if isinstance(t.obj, Edge)]
+
+    def step_bothV(self, step, traversers):
+        return [t.split(vertex) for t in traversers if isinstance(t.obj, Edge)
+                for vertex in (t.obj.out_vertex, t.obj.in_vertex)]
+
+    def step_otherV(self, step, traversers):
+        results = []
+        for t in traversers:
+            if not isinstance(t.obj, Edge):
+                continue
+            previous = t.path[-2] if len(t.path) >= 2 else None
+            results.append(t.split(t.obj.in_vertex if previous is t.obj.out_vertex else t.obj.out_vertex))
+        return results
+
+    #############################################
+    # Filter steps
+    #############################################
+
+    def step_has(self, step, traversers):
+        args = self.values(step.args)
+        if len(args) == 3:
+            label_test = args[0] if callable(args[0]) else (lambda label, expected=args[0]: label == expected)
+            traversers = [t for t in traversers if isinstance(t.obj, (Vertex, Edge)) and label_test(t.obj.label)]
+            args = args[1:]
+
+        key = args[0].token if isinstance(args[0], Identifier) else args[0]
+        if len(args) == 1:
+            return [t for t in traversers if self.has_property(t.obj, key)]
+
+        expected = args[1]
+        if isinstance(expected, Traversal):
+            return [t for t in traversers if self.has_property(t.obj, key) and
+                    self.run_steps(self.steps_of(expected), [t.split(self.property_value(t.obj, key))])]
+        test = expected if callable(expected) else (lambda value: value == expected)
+        return [t for t in traversers if self.has_property(t.obj, key) and test(self.property_value(t.obj, key))]
+
+    def step_hasLabel(self, step, traversers):
+        args = self.values(step.args)
+        if args and callable(args[0]):
+            test = args[0]
+        else:
+            labels = set(flatten_args(args))
+            test = lambda label: label in labels
+        return [t for t in traversers if isinstance(t.obj, (Vertex, Edge)) and test(t.obj.label)]
+
+    def step_hasId(self, step, traversers):
+        args = self.values(step.args)
+        if args and callable(args[0]):
+            test = args[0]
+        else:
+            ids = set(flatten_args(args))
+            test = lambda id: id in ids
+        return [t for t in traversers if isinstance(t.obj, (Vertex, Edge)) and test(t.obj.id)]
+
+    def step_hasNot(self, step, traversers):
+        key = self.value(step.args[0])
+        return [t for t in traversers if not self.has_property(t.obj, key)]
+
+    def step_is(self, step, traversers):
+        expected = self.value(step.args[0])
+        test = expected if callable(expected) else (lambda value: value == expected)
+        return [t for t in traversers if test(t.obj)]
+
+    def step_where(self, step, traversers):
+        args = step.args
+        first = self.value(args[0])
+
+        # where(eq('a')) / where('a', eq('b')) compare labeled objects
+        if isinstance(args[-1], Predicate) and args[-1].args and isinstance(args[-1].args[0], str):
+            predicate_arg = args[-1]
+            other_label = predicate_arg.args[0]
+            results = []
+            for t in traversers:
+                left = t.labels.get(args[0]) if len(args) == 2 else t.obj
+                right = t.labels.get(other_label, self.side_effects.get(other_label))
+                if len(self.by_modulators(step)) > 0:
+                    by = self.by_modulators(step)[0]
+                    left = self.apply_by(by, Traverser(left, t.path, t.labels))
+                    right = self.apply_by(by, Traverser(right, t.path, t.labels))
+                if make_predicate(predicate_arg.name, [right])(left):
+                    results.append(t)
+            return results
+
+        if isinstance(first, Traversal):
+            steps = self.steps_of(first)
+            # where(...as('a')) matches the results against the object labeled 'a' before
+            if steps and steps[-1].name == 'as':
+                label = self.value(steps[-1].args[0])
+                results = []
+                for t in traversers:
+                    if label not in t.labels:
+                        if self.test(first, t):
+                            results.append(t)
+                        continue
+                    matched = self.run_steps(steps[:-1], [t.copy()])
+                    if any(m.obj is t.labels[label] or m.obj == t.labels[label] for m in matched):
+                        results.append(t)
+                return results
+            return [t for t in traversers if self.test(first, t)]
+
+        if callable(first):
+            return [t for t in traversers if first(t.obj)]
+        raise GremlinQueryError("Unsupported where() arguments")
+
+    def step_filter(self, step, traversers):
+        traversal = self.value(step.args[0])
+        return [t for t in traversers if self.test(traversal, t)]
+
+    def step_not(self, step, traversers):
+        traversal = self.value(step.args[0])
+        return [t for t in traversers if not self.test(traversal, t)]
+
+    def step_and(self, step, traversers):
+        traversals = self.values(step.args)
+        return [t for t in traversers if all(self.test(traversal, t) for traversal in traversals)]
+
+    def step_or(self, step, traversers):
+        traversals = self.values(step.args)
+        return [t for t in traversers if any(self.test(traversal, t) for traversal in traversals)]
+
+    def step_dedup(self, step, traversers):
+        by_args = self.by_modulators(step)
+        labels = [arg for arg in self.values(step.args) if isinstance(arg, str)]
+        seen = set()
+        results = []
+        for t in traversers:
+            if labels:
+                key = tuple(hashable(t.labels.get(label)) for label in labels)
+            else:
+                key = hashable(self.apply_by(by_args[0], t) if by_args else t.obj)
+            if key not in seen:
+                seen.add(key)
+                results.append(t)
+        return results
+
+    def is_local(self, args):
+        return bool(args) and isinstance(args[0], Identifier) and args[0].token == 'local'
+
+    def numeric_args(self, step):
+        return [arg for arg in self.values(step.args) if not isinstance(arg, Identifier)]
+
+    def step_limit(self, step, traversers):
+        if self.is_local(step.args):
+            count = self.numeric_args(step)[0]
+            return [t.split(t.obj[:count] if isinstance(t.obj, list) else t.obj) for t in traversers]
+        return traversers[:self.numeric_args(step)[0]]
+
+    def step_range(self, step, traversers):
+        low, high = self.numeric_args(step)[:2]
+        return traversers[low:] if high == -1 else traversers[low:high]
+
+    def step_skip(self, step, traversers):
+        return traversers[self.numeric_args(step)[0]:]
+
+    def step_tail(self, step, traversers):
+        count = self.numeric_args(step)[0] if step.args else 1
+        return traversers[-count:] if count else []
+
+    def step_sample(self, step, traversers):
+        count = self.numeric_args(step)[0]
+        return traversers if len(traversers) <= count else random.sample(traversers, count)
+
+    def step_coin(self, step, traversers):
+        probability = self.value(step.args[0])
+        return [t for t in traversers if random.random() < probability]
+
+    def step_simplePath(self, step, traversers):
+        return [t for t in traversers if len({id(obj) for obj in t.path}) == len(t.path)]
+
+    def step_cyclicPath(self, step, traversers):
+        return [t for t in traversers if len({id(obj) for obj in t.path}) != len(t.path)]
+
+    #############################################
+    # Map steps
+    #############################################
+
+    def step_identity(self, step, traversers):
+        return traversers
+
+    def step_id(self, step, traversers):
+        return [t.split(t.obj.id) for t in traversers if isinstance(t.obj, (Vertex, Edge))]
+
+    def step_label(self, step, traversers):
+        return [t.split(t.obj.label if isinstance(t.obj, (Vertex, Edge)) else t.obj.key)
+                for t in traversers if isinstance(t.obj, (Vertex, Edge, VertexProperty))]
+
+    def step_constant(self, step, traversers):
+        value = self.value(step.args[0])
+        return [t.split(value) for t in traversers]
+
+    def step_values(self, step, traversers):
+        keys = [arg.token if isinstance(arg, Identifier) else arg for arg in self.values(step.args)]
+        results = []
+        for t in traversers:
+            obj = t.obj
+            if isinstance(obj, (Vertex, Edge)):
+                items = obj.properties.items() if not keys else [(key, obj.properties[key]) for key in keys if key in obj.properties]
+            elif isinstance(obj, dict):
+                items = obj.items() if not keys else [(key, obj[key]) for key in keys if key in obj]
+            else:
+                continue
+            results.extend(t.split(value) for _, value in items)
+        return results
+
+    def step_properties(self, step, traversers):
+        keys = self.values(step.args)
+        results = []
+        for t in traversers:
+            if isinstance(t.obj, (Vertex, Edge)):
+                for key, value in t.obj.properties.items():
+                    if not keys or key in keys:
+                        results.append(t.split(VertexProperty(t.obj, key, value)))
+        return results
+
+    def step_key(self, step, traversers):
+        return [t.split(t.obj.key) for t in traversers if isinstance(t.obj, VertexProperty)]
+
+    def step_value(self, step, traversers):
+        return [t.split(t.obj.value) for t in traversers if isinstance(t.obj, VertexProperty)]
+
+    def step_valueMap(self, step, traversers):
+        args = self.values(step.args)
+        with_tokens = bool(args) and args[0] is True
+        keys = [arg for arg in args if isinstance(arg, str)]
+        results = []
+        for t in traversers:
+            element = self.elements(t.obj)
+            value_map = {}
+            if with_tokens:
+                value_map['id'] = element.id
+                value_map['label'] = element.label
+            for key, value in element.properties.items():
+                if not keys or key in keys:
+                    value_map[key] = [value] if isinstance(element, Vertex) else value
+            results.append(t.split(value_map))
+        return results
+
+    def step_elementMap(self, step, traversers):
+        keys = [arg for arg in self.values(step.args) if isinstance(arg, str)]
+        results = []
+        for t in traversers:
+            element = self.elements(t.obj)
+            element_map = {'id': element.id, 'label': element.label}
+            element_map.update((key, value) for key, value in element.properties.items() if not keys or key in keys)
+            results.append(t.split(element_map))
+        return results
+
+    def step_project(self, step, traversers):
+        keys = self.values(step.args)
+        by_args = self.by_modulators(step)
+        results = []
+        for t in traversers:
+            projection = {}
+            for i, key in enumerate(keys):
+                projection[key] = self.apply_by(by_args[i % len(by_args)] if by_args else [], t)
+            results.append(t.split(projection))
+        return results
+
+    def step_select(self, step, traversers):
+        args = self.values(step.args)
+        by_args = self.by_modulators(step)
+
+        # select(keys) / select(values) on maps
+        if len(args) == 1 and isinstance(args[0], Identifier) and args[0].token in ('keys', 'values'):
+            column = args[0].token
+            return [t.split(list(t.obj.keys()) if column == 'keys' else list(t.obj.values()))
+                    for t in traversers if isinstance(t.obj, dict)]
+
+        # Pop (first, last, all) is ignored, the latest labeled object is used
+        labels = [arg for arg in args if not isinstance(arg, Identifier)]
+        results = []
+        for t in traversers:
+            selected = {}
+            for i, label in enumerate(labels):
+                if label in t.labels:
+                    obj = t.labels[label]
+                elif isinstance(t.obj, dict) and label in t.obj:
+                    obj = t.obj[label]
+                elif label in self.side_effects:
+                    obj = self.side_effects[label]
+                else:
+                    break
+                by = by_args[i % len(by_args)] if by_args else []
+                selected[label] = self.apply_by(by, Traverser(obj, t.path, t.labels))
+            else:
+                results.append(t.split(selected[labels[0]] if len(labels) == 1 else selected))
+        return results
+
+    def step_path(self, step, traversers):
+        by_args = self.by_modulators(step)
+        results = []
+        for t in traversers:
+            objects = t.path
+            if by_args:
+                objects = [self.apply_by(by_args[i % len(by_args)], Traverser(obj, t.path, t.labels))
+                           for i, obj in enumerate(objects)]
+            results.append(t.split(list(objects)))
+        return results
+
+    def step_as(self, step, traversers):
+        labels = self.values(step.args)
+        for t in traversers:
+            for label in labels:
+                t.labels[label] = t.obj
+        return traversers
+
+    def step_unfold(self, step, traversers):
+        results = []
+        for t in traversers:
+            if isinstance(t.obj, (list, tuple)):
+                results.extend(t.split(item) for item in t.obj)
+            elif isinstance(t.obj, dict):
+                results.extend(t.split({key: value}) for key, value in t.obj.items())
+            else:
+                results.append(t)
+        return results
+
+    def step_loops(self, step, traversers):
+        return [t.split(t.loops) for t in traversers]
+
+    def step_order(self, step, traversers):
+        by_args = self.by_modulators(step) or [[]]
+        local = self.is_local(step.args)
+        if local:
+            return [t.split(self.sorted_objects(t.obj, by_args, t)) for t in traversers]
+
+        ordered = list(traversers)
+        # Stable sorts from the last to the first modulator
+        for by in reversed(by_args):
+            order = self.value(by[1]).token if len(by) > 1 and isinstance(self.value(by[1]), Identifier) else 'asc'
+            if order == 'shuffle':
+                random.shuffle(ordered)
+                continue
+            key_args = by[:1]
+            if key_args and isinstance(self.value(key_args[0]), Identifier) and self.value(key_args[0]).token in ('asc', 'desc', 'incr', 'decr', 'shuffle'):
+                order = self.value(key_args[0]).token
+                key_args = []
+            ordered.sort(key=lambda t: sort_key(self.apply_by(key_args, t)), reverse=order in ('desc', 'decr'))
+        return ordered
+
+    def sorted_objects(self, obj, by_args, traverser):
+        if isinstance(obj, list):
+            items = [Traverser(item, traverser.path, traverser.labels) for item in obj]
+            return [t.obj for t in self.step_order(CompiledStep('order', []), items)] if by_args == [[]] else \
+                [t.obj for t in sorted(items, key=lambda t: sort_key(self.apply_by(by_args[0][:1], t)))]
+        return obj
+
+    #############################################
+    # Branch steps
+    #############################################
+
+    def step_local(self, step, traversers):
+        traversal = self.value(step.args[0])
+        return [result for t in traversers for result in self.run_child(traversal, t)]
+
+    def step_map(self, step, traversers):
+        traversal = self.value(step.args[0])
+        results = []
+        for t in traversers:
+            mapped = self.run_child(traversal, t)
+            if mapped:
+                results.append(t.split(mapped[0].obj))
+        return results
+
+    def step_flatMap(self, step, traversers):
+        traversal = self.value(step.args[0])
+        return [t.split(result.obj) for t in traversers for result in self.run_child(traversal, t)]
+
+    def step_union(self, step, traversers):
+        traversals = self.values(step.args)
+        return [result for t in traversers for traversal in traversals for result in self.run_child(traversal, t)]
+
+    def step_coalesce(self, step, traversers):
+        traversals = self.values(step.args)
+        results = []
+        for t in traversers:
+            for traversal in traversals:
+                branch = self.run_child(traversal, t)
+                if branch:
+                    results.extend(branch)
+                    break
+        return results
+
+    def step_optional(self, step, traversers):
+        traversal = self.value(step.args[0])
+        results = []
+        for t in traversers:
+            branch = self.run_child(traversal, t)
+            results.extend(branch if branch else [t])
+        return results
+
+    def step_choose(self, step, traversers):
+        args = self.values(step.args)
+        results = []
+        for t in traversers:
+            if len(args) >= 2:
+                branch = args[1] if self.test(args[0], t) else (args[2] if len(args) > 2 else None)
+                results.extend(self.run_child(branch, t) if branch is not None else [t])
+            else:
+                results.append(t)
+        return results
+
+    def step_repeat(self, step, traversers):
+        body = self.value(step.args[0])
+        times = [self.value(args[0]) for args in step.modulator_args('times')]
+        times = times[0] if times else None
+        until = step.modulator_args('until')
+        until = self.value(until[0][0]) if until else None
+        until_before = step.modulator_args('until_before')
+        until_before = self.value(until_before[0][0]) if until_before else None
+        emit = step.modulator_args('emit')
+        emit_before = step.modulator_args('emit_before')
+
+        def emits(modulators, t):
+            if not modulators:
+                return False
+            if not modulators[0]:
+                return True
+            return self.test(self.value(modulators[0][0]), t)
+
+        results = []
+        current = traversers
+        loops = 0
+        while current and loops < MAX_REPEAT_LOOPS:
+            to_run = []
+            for t in current:
+                if until_before is not None and self.test(until_before, t):
+                    results.append(t)
+                    continue
+                if emits(emit_before, t):
+                    results.append(t.copy())
+                to_run.append(t)
+
+            produced = self.run_steps(self.steps_of(body), to_run)
+            loops += 1
+            current = []
+            for t in produced:
+                t.loops = loops
+                if times is not None and loops >= times:
+                    results.append(t)
+                elif until is not None and self.test(until, t):
+                    results.append(t)
+                else:
+                    if emits(emit, t):
+                        results.append(t.copy())
+                    current.append(t)
+
+        # Traversers still looping when the guard stops the repeat are emitted as they are
+        if loops >= MAX_REPEAT_LOOPS and not emit:
+            results.extend(current)
+        for t in results:
+            t.loops = 0
+        return results
+
+    #############################################
+    # Reducing and side effect steps
+    #############################################
+
+    def step_count(self, step, traversers):
+        if self.is_local(step.args):
+            return [t.split(len(t.obj) if isinstance(t.obj, (list, dict)) else 1) for t in traversers]
+        return [Traverser(len(traversers), [], {})]
+
+    def step_fold(self, step, traversers):
+        return [Traverser([t.obj for t in traversers], [], {})]
+
+    def numbers(self, step, traversers):
+        if self.is_local(step.args):
+            return None
+        return [t.obj for t in traversers if isinstance(t.obj, (int, float)) and not isinstance(t.obj, bool)]
+
+    def step_sum(self, step, traversers):
+        return [Traverser(sum(self.numbers(step, traversers)), [], {})]
+
+    def step_max(self, step, traversers):
+        values = self.numbers(step, traversers) or [t.obj for t in traversers if isinstance(t.obj, str)]
+        return [Traverser(max(values), [], {})] if values else []
+
+    def step_min(self, step, traversers):
+        values = self.numbers(step, traversers) or [t.obj for t in traversers if isinstance(t.obj, str)]
+        return [Traverser(min(values), [], {})] if values else []
+
+    def step_mean(self, step, traversers):
+        values = self.numbers(step, traversers)
+        return [Traverser(sum(values) / len(values), [], {})] if values else []
+
+    def group_key(self, by_args, t):
+        key = self.apply_by(by_args, t)
+        if isinstance(key, list):
+            key = tuple(key)
+        return key
+
+    def step_group(self, step, traversers):
+        by_args = self.by_modulators(step)
+        key_by = by_args[0] if by_args else []
+        value_by = by_args[1] if len(by_args) > 1 else None
+
+        groups = {}
+        for t in traversers:
+            groups.setdefault(self.group_key(key_by, t), []).append(t)
+
+        result = {}
+        for key, members in groups.items():
+            if value_by is None or not value_by:
+                result[key] = [t.obj for t in members]
+                continue
+            value_modulator = self.value(value_by[0])
+            if isinstance(value_modulator, Traversal):
+                reduced = self.run_child_many(value_modulator, members)
+                steps = self.steps_of(value_modulator)
+                if steps and steps[-1].name in REDUCING_STEPS:
+                    result[key] = reduced[0].obj if reduced else None
+                else:
+                    result[key] = [r.obj for r in reduced]
+            else:
+                result[key] = [self.apply_by(value_by, t) for t in members]
+        return [Traverser(result, [], {})]
+
+    def step_groupCount(self, step, traversers):
+        by_args = self.by_modulators(step)
+        counts = {}
+        for t in traversers:
+            key = self.group_key(by_args[0] if by_args else [], t)
+            counts[key] = counts.get(key, 0) + 1
+        return [Traverser(counts, [], {})]
+
+    def step_tree(self, step, traversers):
+        by_args = self.by_modulators(step)
+        tree = {}
+        for t in traversers:
+            node = tree
+            for obj in t.path:
+                key = self.apply_by(by_args[0], Traverser(obj, t.path, t.labels)) if by_args else obj
+                node = node.setdefault(key if not isinstance(key, (list, dict)) else str(key), {})
+        return [Traverser(tree, [], {})]
+
+    def step_store(self, step, traversers):
+        key = self.value(step.args[0])
+        collection = self.side_effects.setdefault(key, [])
+        collection.extend(t.obj for t in traversers)
+        return traversers
+
+    def step_aggregate(self, step, traversers):
+        return self.step_store(step, traversers)
+
+    def step_cap(self, step, traversers):
+        key = self.value(step.args[0])
+        return [Traverser(self.side_effects.get(key, []), [], {})]
+
+    def step_sideEffect(self, step, traversers):
+        traversal = self.value(step.args[0])
+        for t in traversers:
+            self.run_child(traversal, t)
+        return traversers
+
+    def step_executionProfile(self, step, traversers):
+        return [Traverser({'backend': 'memory', 'results': len(traversers)}, [], {})]
@@ -0,0 +1,272 @@
+#############################################
+# Metrics of the ingester and the chatbot:
+# per-phase timers, counters (with labels, e.g.
+# errors by kind) and latency histograms of the
+# Gremlin and OpenAI calls. Everything goes to
+# the process wide registry `metrics`, which is
+# exported as a JSON summary and/or a Prometheus
+# textfile (node_exporter textfile collector format).
+# cProfile can be switched on around a whole run.
+#############################################
+
+from contextlib import contextmanager
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+METRIC_PREFIX = "cpprag_"
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def get_key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def format_key(key):
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{label}={value}" for label, value in labels) + "}"
+
+def format_prometheus_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    # Upper bound of the bucket holding the given fraction of the observations
+    def quantile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count, "max": self.max}
+
+    def merge(self, data):
+        if tuple(data["buckets"]) != tuple(self.buckets):
+            raise ValueError("histograms with different buckets can not be merged")
+        self.counts = [count + other for count, other in zip(self.counts, data["counts"])]
+        self.sum += data["sum"]
+        self.count += data["count"]
+        self.max = max(self.max, data["max"])
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    def increment(self, name, value=1, **labels):
+        key = get_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            timer = self.timers.get(phase)
+            if timer is None:
+                timer = [0.0, 0]
+                self.timers[phase] = timer
+            timer[0] += seconds
+            timer[1] += 1
+
+    # with metrics.time("parse"): ...
+    @contextmanager
+    def time(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    # with metrics.measure("openai_request", purpose="answer"): ...
+    # observes the latency of the call, a call raising an exception is also counted as an error of that name
+    @contextmanager
+    def measure(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.count_error(name)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def observe(self, name, seconds, **labels):
+        key = get_key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[key] = histogram
+            histogram.observe(seconds)
+
+    # Errors are counted by kind next to the place where they are printed
+    def count_error(self, kind):
+        self.increment("errors", kind=kind)
+
+    # Plain data of the registry, e.g. to be sent from a worker process and merged in the parent
+    def snapshot(self):
+        with self.lock:
+            return {
+                "timers": [[phase, seconds, count] for phase, (seconds, count) in self.timers.items()],
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, list(labels), histogram.to_dict()] for (name, labels), histogram in self.histograms.items()]
+            }
+
+    def merge(self, snapshot):
+        for phase, seconds, count in snapshot["timers"]:
+            with self.lock:
+                timer = self.timers.setdefault(phase, [0.0, 0])
+                timer[0] += seconds
+                timer[1] += count
+        for name, labels, value in snapshot["counters"]:
+            self.increment(name, value, **dict(labels))
+        for name, labels, data in snapshot["histograms"]:
+            key = get_key(name, dict(labels))
+            with self.lock:
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = Histogram(tuple(data["buckets"]))
+                    self.histograms[key] = histogram
+                histogram.merge(data)
+
+    def get_counter(self, name, **labels):
+        return self.counters.get(get_key(name, labels), 0)
+
+    # Seconds spent in a phase so far
+    def get_seconds(self, phase):
+        return self.timers.get(phase, (0.0, 0))[0]
+
+    def to_summary(self):
+        with self.lock:
+            return {
+                "started": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started)),
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "phases": {phase: {"seconds": round(seconds, 4), "count": count}
+                           for phase, (seconds, count) in self.timers.items()},
+                "counters": {format_key(key): value for key, value in self.counters.items()},
+                "latencies": {format_key(key): {
+                    "count": histogram.count,
+                    "mean_ms": round(histogram.sum / histogram.count * 1000, 3) if histogram.count else None,
+                    "p50_ms": round(histogram.quantile(0.5) * 1000, 3) if histogram.count else None,
+                    "p95_ms": round(histogram.quantile(0.95) * 1000, 3) if histogram.count else None,
+                    "max_ms": round(histogram.max * 1000, 3)
+                } for key, histogram in self.histograms.items()}
+            }
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            if self.timers:
+                lines.append(f"# TYPE {METRIC_PREFIX}phase_seconds_total counter")
+                for phase, (seconds, _) in self.timers.items():
+                    lines.append(f"{METRIC_PREFIX}phase_seconds_total{format_prometheus_labels([('phase', phase)])} {seconds}")
+                lines.append(f"# TYPE {METRIC_PREFIX}phase_runs_total counter")
+                for phase, (_, count) in self.timers.items():
+                    lines.append(f"{METRIC_PREFIX}phase_runs_total{format_prometheus_labels([('phase', phase)])} {count}")
+
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name}_total counter")
+                for (counter_name, labels), value in self.counters.items():
+                    if counter_name == name:
+                        lines.append(f"{METRIC_PREFIX}{name}_total{format_prometheus_labels(labels)} {value}")
+
+            for name in sorted({name for name, _ in self.histograms}):
+                metric = f"{METRIC_PREFIX}{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for (histogram_name, labels), histogram in self.histograms.items():
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{format_prometheus_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{metric}_sum{format_prometheus_labels(labels)} {histogram.sum}")
+                    lines.append(f"{metric}_count{format_prometheus_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def save_summary(self, path):
+        write_file(path, json.dumps(self.to_summary(), indent=2))
+
+    def save_prometheus(self, path):
+        write_file(path, self.to_prometheus())
+
+    # Writes the configured outputs, paths which are None are skipped
+    def export(self, summary_path=None, prometheus_path=None):
+        try:
+            if summary_path:
+                self.save_summary(summary_path)
+            if prometheus_path:
+                self.save_prometheus(prometheus_path)
+        except OSError as e:
+            print(f"ERROR writing metrics: {e}")
+
+# Written under a temporary name first, the textfile collector may read the file at any time
+def write_file(path, text):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temporary_path, path)
+
+metrics = Metrics()
+
+#############################################
+# cProfile hook
+#############################################
+
+# Profiler of the whole run when a path is configured, None otherwise
+def start_profiling(profile_path):
+    if not profile_path:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+# Stores the profile (for pstats/snakeviz) and prints the functions with the largest cumulative time
+def stop_profiling(profiler, profile_path, top=25):
+    if profiler is None:
+        return
+    profiler.disable()
+    profiler.dump_stats(profile_path)
+
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(top)
+    print(output.getvalue())
+    print(f"Profile written to {profile_path}")
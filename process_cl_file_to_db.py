@@ -1,14 +1,33 @@
 #############################################
 # This script allows processing of a single
 # C++ translation unit AST (abstract syntax tree) 
+# (or of all translation units of a compile_commands.json)
 # to an Azure Cosmos Graph DB.
 #############################################
 
 import clang.cindex
 from clang.cindex import CursorKind
-from gremlin_python.driver import client, serializer
+import graph_backend
 from dotenv import load_dotenv
+from gremlin_writer import GremlinBulkWriter, submit_with_retries
+from graph_records import GraphRecordCollector, GraphRecordMerger, PendingEdgeTable
+from compile_commands import load_compile_commands
+from usr_registry import UsrRegistry, start_usr_registry
+from header_ownership import get_preprocessor_context_hash, get_header_keys, claim_headers
+from ingest_manifest import IngestManifest, IncrementalFilter
+from graph_snapshot import SnapshotWriter
+from graph_metadata import publish_graph_metadata, get_graph_catalog, get_graph_version
+from graph_catalog import GraphCatalog, CatalogCollector
+from tu_cache import TranslationUnitCache
+from document_index import DocumentIndexCollector
+from trigram_index import TrigramIndexBuilder, load_trigram_index
+from vector_index import VectorIndexBuilder, HashingEmbedder, load_vector_index
+from cursor_identity import IdTable, InternedIdWriter, CursorIdentity, get_cursor_key
+from metrics import metrics, start_profiling, stop_profiling
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import fnmatch
 import os
+import time
 
 #############################################
 ### 0. Input
@@ -23,9 +42,75 @@ file_to_process = repo_path + "include/nlohmann/json.hpp"
 include_folders = f"{repo_path}include"
 defines = "_UNICODE;UNICODE;WIN32;_WINDOWS;_WIN32;STRICT;_MBCS;JSON_TEST_KEEP_MACROS;"
 
+# Alternatively process every translation unit of a compilation database (file_to_process,
+# include_folders and defines are then ignored) using a pool of worker processes
+compile_commands_path = None # e.g. repo_path + "build/compile_commands.json"
+ingest_workers = os.cpu_count()
+
+# Incremental mode: file hashes and compile flags of the last run are kept in this manifest,
+# unchanged translation units are skipped and only vertices/edges of changed files are rewritten
+incremental_manifest_path = None # e.g. ".cpprag_manifest.json"
+
+# Write the extracted graph to a local snapshot file instead of the database,
+# load it later with: python graph_snapshot.py load <snapshot>
+snapshot_path = None # e.g. "json.snapshot.gz"
+
+# Trigram index over spelling, usr and file of the vertices, used by the chatbot to resolve substring
+# searches into vertex ids. Rewritten after every run for the published graph version (not with snapshot_path).
+trigram_index_path = None # e.g. ".cpprag_cache/trigrams.idx"
+
+# Doc comments (up to this many characters) and signatures of the declarations are stored as the
+# raw_comment and signature properties. The vector index embeds them (with the hashing embedder of
+# this many dimensions), the chatbot picks the declarations most similar to a question with it.
+max_comment_length = 4000
+vector_index_path = None # e.g. ".cpprag_cache/vectors.idx"
+vector_dimensions = 1024
+
 cosmos_db_url = 'wss://cpp-codebase-playground.gremlin.cosmos.azure.com:443/'
 cosmos_db_username = "/dbs/codebase/colls/codebase-graph"
 
+# libclang shared library. The LIBCLANG_PATH environment variable (or .env entry) overrides it,
+# an empty path lets clang.cindex search for libclang itself
+libclang_path = 'C:\\Program Files\\LLVM\\bin\\libclang.dll'
+
+# Files whose cursors are walked (fnmatch patterns, use '/' as separator): cursors located in other
+# files are skipped together with their whole subtree. An empty include list means every file.
+walk_include_paths = []
+walk_exclude_paths = ["*Program Files*"]
+# Also skip cursors located in system headers (-isystem folders and the compiler's own headers)
+skip_system_headers = True
+# Walk a header shared by translation units only in the first one including it with the same macros,
+# language standard and target; the others only add the edges from their own declarations into it.
+# The owner of every header is kept in the incremental manifest for the next runs.
+deduplicate_headers = True
+
+# Descend into expressions (types referenced from code). Statements of function bodies are always
+# walked for their local declarations, skipping the expressions in them makes the walk much faster.
+extract_references = False
+# Let libclang skip parsing function bodies altogether (ignored when extract_references is on),
+# the local declarations of functions are then missing from the graph
+parse_skip_function_bodies = False
+
+# Parsed translation units are kept in this folder and loaded instead of parsed again while
+# none of their files and flags changed; least recently used ones are evicted by size and age
+tu_cache_path = None # e.g. ".cpprag_cache/tu"
+tu_cache_max_size = 4 << 30
+tu_cache_max_age = 7 * 24 * 3600
+
+# Number of vertices/edges sent in one traversal and number of such traversals awaited concurrently
+gremlin_batch_size = 50
+gremlin_max_in_flight_batches = 8
+# Request units per second the writes should stay under (e.g. the provisioned throughput of the
+# container), None to only back off when Cosmos DB throttles. Throttled batches are retried.
+gremlin_ru_budget = None
+gremlin_max_retries = 10
+
+# Phase timings, counters and Gremlin latencies of the run as a JSON summary and/or a Prometheus textfile
+metrics_summary_path = None # e.g. ".cpprag_metrics/ingest.json"
+metrics_textfile_path = None # e.g. "/var/lib/node_exporter/textfile_collector/cpprag_ingest.prom"
+# Profile the whole run with cProfile into this file
+profile_path = None # e.g. "ingest.prof"
+
 def parse_input(include_folders, defines):
     args = []
 
@@ -51,13 +136,33 @@ def parse_input(include_folders, defines):
 load_dotenv()
 
 # Set up clang index library
-clang.cindex.Config.set_library_file('C:\\Program Files\\LLVM\\bin\\libclang.dll')
+libclang_path = os.getenv("LIBCLANG_PATH", libclang_path)
+if libclang_path:
+    clang.cindex.Config.set_library_file(libclang_path)
+
+# Arguments every translation unit is parsed with
+clang_base_args = [
+    '-x', 'c++',
+    '-std=c++11', 
+    '-fparse-all-comments',
+    '-fno-delayed-template-parsing',
+    '-ferror-limit=0'
+]
+
+# Set up Gremlin client (Cosmos DB or the embedded graph, see graph_backend.py)
+def create_gremlin_client():
+    return graph_backend.create_gremlin_client(cosmos_db_url, cosmos_db_username)
 
-# Set up Gremlin client
-gremlin_client = client.Client(cosmos_db_url, 'g',
-                               username=cosmos_db_username,
-                               password=os.getenv("COSMOS_DB_PRIMARY_KEY"),
-                               message_serializer=serializer.GraphSONSerializersV2d0())
+# Created in main(), worker processes never talk to the database
+gremlin_client = None
+
+# All graph mutations go to the sink: the bulk writer, or a record collector in worker processes.
+# Records reference vertex ids by their number in id_table, the sink gets the strings back.
+graph_sink = None
+id_table = IdTable()
+
+# Memoized ids of the cursors and files of the translation unit being processed
+cursor_identity = None
 
 #############################################
 ### 2. Gremlin-related methods
@@ -83,9 +188,19 @@ def get_id(cursor, replacement_symbol = '_'):
             if cursor == cursor.canonical:
                 id = f"{id}"
             else:
-                id = f"{id}@{get_file_id(cursor.location.file.name)}@{cursor.location.line}"
+                id = f"{id}@{get_location_file_id(cursor.location.file.name)}@{cursor.location.line}"
     return id
 
+# File id of a file cursors are located in, memoized per translation unit
+def get_location_file_id(file_name):
+    if cursor_identity is None:
+        return get_file_id(file_name)
+    return cursor_identity.get_file_id(file_name)
+
+# Number of the cursor id in id_table (None if the cursor has no id), computed once per cursor
+def get_id_number(cursor):
+    return cursor_identity.get_id_number(cursor)
+
 def vertex_exists(cursor):    
     query = "g.V().has('id', id).count()"
     bindings = {"id": get_id(cursor)}
@@ -95,12 +210,32 @@ def vertex_exists(cursor):
     # Return True if the count is greater than 0, meaning the vertex exists
     return result[0] > 0
 
+# Remove all vertices (and so their edges) which came from the given files,
+# returns counts of removed vertices and edges per label (for the catalog)
+def drop_file_vertices(file_ids, files_per_query = 20):
+    file_ids = sorted(file_ids)
+    if not file_ids:
+        return {}, {}
+
+    bindings = {"file_ids": file_ids}
+    vertex_counts = submit_with_retries(gremlin_client, "g.V().has('file', within(file_ids)).groupCount().by(label)", bindings, gremlin_max_retries)
+    edge_counts = submit_with_retries(gremlin_client, "g.V().has('file', within(file_ids)).bothE().dedup().groupCount().by(label)", bindings, gremlin_max_retries)
+
+    # Dropping is idempotent, a throttled drop is simply repeated
+    for i in range(0, len(file_ids), files_per_query):
+        query = "g.V().has('file', within(file_ids)).drop()"
+        bindings = {"file_ids": file_ids[i:i + files_per_query]}
+        submit_with_retries(gremlin_client, query, bindings, gremlin_max_retries)
+
+    return (vertex_counts[0] if vertex_counts else {}), (edge_counts[0] if edge_counts else {})
+
 tu_cached = None
 
-# Add vertex to Gremlin database
-def add_vertex_to_gremlin(cursor, id, properties = {}):
+# Add vertex to the graph sink (buffered, see GremlinBulkWriter)
+def add_vertex_to_graph(cursor, id, properties = None):
     global tu_cached
 
+    properties = {} if properties is None else properties
     properties["id"] = id
     properties["label"] = cursor.kind.name
     properties["usr"] = cursor.get_usr()
@@ -108,39 +243,27 @@ def add_vertex_to_gremlin(cursor, id, properties = {}):
     if tu_cached is None:
         tu_cached = get_file_id(cursor.translation_unit.spelling)
     properties["tu"] = tu_cached
-    properties["file"] = get_file_id(cursor.location.file.name) #TODO: add file as a vertex?
+    properties["file"] = get_location_file_id(cursor.location.file.name) #TODO: add file as a vertex?
     properties["line"] = cursor.location.line
+    add_qualified_name_properties(cursor, properties)
+    add_documentation_properties(cursor, properties)
 
-    properties_pairs = [(key, value) for key, value in properties.items()]
-    query = "g.addV(label)"
-    bindings = {}
-
-    for i, (key, value) in enumerate(properties_pairs):
-        query += f".property('{key}', key_{i})"
-        bindings[f"key_{i}"] = value
-
-    gremlin_client.submit(query, bindings)
-
-# Add edge to Gremlin database
-def add_edge_to_gremlin(from_cursor, edge_label, to_cursor, property_key=None, property_value=None):
-    # Start the base query
-    query = ("g.V(from_id).as('from')"
-             ".V(to_id).addE(edge_label)")
-    bindings = {
-        "from_id": get_id(from_cursor),
-        "to_id": get_id(to_cursor),
-        "edge_label": edge_label
-    }
+    graph_sink.add_vertex(cursor.kind.name, properties)
+
+# Add edge to the graph sink (buffered, sent after its endpoint vertices)
+def add_edge_to_graph(from_cursor, edge_label, to_cursor, property_key=None, property_value=None):
+    from_id = get_id_number(from_cursor)
+    to_id = get_id_number(to_cursor)
+    if from_id is None or to_id is None:
+        return
+
+    properties = {}
 
     # Add property if provided
     if property_key and property_value:
-        query += ".property(edge_property_key, edge_property_value)"
-        bindings["edge_property_key"] = property_key
-        bindings["edge_property_value"] = property_value
+        properties[property_key] = property_value
 
-    # Finalize the query
-    query += ".from('from')"
-    gremlin_client.submit(query, bindings)
+    graph_sink.add_edge(from_id, edge_label, to_id, properties)
 
 #############################################
 ### 3. Adding properties for specific types
@@ -214,20 +337,245 @@ def get_conversion_function_properties(cursor):
     add_access_specifier(cursor, properties)
     return properties
 
+#############################################
+# Derived data materialized at ingest: qualified names, namespace paths and
+# overload groups as properties, and the transitive closure of the inheritance
+# as inherits_transitive edges, so that questions about them need no repeat() walks.
+#############################################
+
+# Vertices of these kinds get an overload group: the qualified name shared by all overloads
+function_kinds = {
+    CursorKind.FUNCTION_DECL, CursorKind.FUNCTION_TEMPLATE, CursorKind.CXX_METHOD,
+    CursorKind.CONSTRUCTOR, CursorKind.DESTRUCTOR, CursorKind.CONVERSION_FUNCTION
+}
+
+# Definitions of these kinds get the inheritance closure edges
+class_kinds = {
+    CursorKind.STRUCT_DECL, CursorKind.CLASS_DECL, CursorKind.CLASS_TEMPLATE,
+    CursorKind.CLASS_TEMPLATE_PARTIAL_SPECIALIZATION
+}
+
+# (qualified name, namespace path, files of the scope and its parents) per scope cursor,
+# for the translation unit being processed
+scope_names = {}
+
+# Files the derived data of the vertices of a file depends on ({file path: set of file paths}),
+# e.g. the headers of the base classes. The incremental manifest rewrites a file when one of them changes.
+file_dependencies = {}
+
+def add_file_dependencies(file_path, dependency_paths):
+    dependency_paths = set(dependency_paths)
+    dependency_paths.discard(file_path)
+    if dependency_paths:
+        file_dependencies.setdefault(file_path, set()).update(dependency_paths)
+
+def get_scope_names(scope):
+    if scope is None or scope.kind == CursorKind.TRANSLATION_UNIT:
+        return "", "", frozenset()
+
+    key = get_cursor_key(scope)
+    names = scope_names.get(key)
+    if names is None:
+        qualified_name, namespace, files = get_scope_names(scope.semantic_parent)
+        if scope.kind != CursorKind.LINKAGE_SPEC:
+            spelling = scope.spelling or "(anonymous)"
+            qualified_name = f"{qualified_name}::{spelling}" if qualified_name else spelling
+            if scope.kind == CursorKind.NAMESPACE:
+                namespace = qualified_name
+        if scope.location.file is not None:
+            files = files | {scope.location.file.name}
+        names = (qualified_name, namespace, files)
+        scope_names[key] = names
+    return names
+
+def add_qualified_name_properties(cursor, properties):
+    qualified_name, namespace, files = get_scope_names(cursor.semantic_parent)
+    spelling = cursor.spelling
+    properties["qualified_name"] = f"{qualified_name}::{spelling}" if qualified_name else spelling
+    properties["namespace"] = namespace
+    if cursor.kind in function_kinds:
+        properties["overload_group"] = properties["qualified_name"]
+    add_file_dependencies(cursor.location.file.name, files)
+
+# Direct and indirect base classes of a class definition as [(base cursor, depth)], breadth first so
+# every base comes with its shortest depth. The base cursors are the ones inherits edges point to.
+def get_base_classes(cursor):
+    bases = []
+    seen_ids = {get_id_number(cursor)}
+    level = [cursor]
+    depth = 0
+    while level:
+        depth += 1
+        next_level = []
+        for derived in level:
+            for child in derived.get_children():
+                if child.kind != CursorKind.CXX_BASE_SPECIFIER:
+                    continue
+                base = child.referenced
+                base_id = get_id_number(base) if base is not None else None
+                if base_id is None or base_id in seen_ids:
+                    continue
+                seen_ids.add(base_id)
+                bases.append((base, depth))
+                definition = base.get_definition()
+                if definition is not None:
+                    next_level.append(definition)
+        level = next_level
+    return bases
+
+# inherits_transitive edges (with the depth) from a class definition to all of its base classes,
+# so that the bases and the derived classes of a class are a single hop away
+def add_inheritance_closure(cursor):
+    base_files = set()
+    for base, depth in get_base_classes(cursor):
+        base_id = get_id_number(base)
+        if not base_id in processed_cursors_ids:
+            processed_cursors_ids.add(base_id)
+            if not is_owned_elsewhere(base):
+                add_vertex_to_graph(base, base_id, {})
+        add_edge_to_graph(cursor, 'inherits_transitive', base, 'depth', depth)
+
+        definition = base.get_definition() or base
+        if definition.location.file is not None:
+            base_files.add(definition.location.file.name)
+    add_file_dependencies(cursor.location.file.name, base_files)
+
+#############################################
+# Documentation of the declarations: doc comments and signatures
+#############################################
+
+# Declarations of these kinds get the type as their signature (parameters are part of the function signature)
+typed_kinds = {CursorKind.FIELD_DECL, CursorKind.VAR_DECL}
+
+# Name and parameters of a function, e.g. to_json(BasicJsonType &j, T &&val)
+def get_function_declarator(cursor):
+    arguments = list(cursor.get_arguments())
+    if not arguments:
+        # Templates do not list their parameters
+        return cursor.displayname
+    parameters = ", ".join(f"{argument.type.spelling} {argument.spelling}".strip() for argument in arguments)
+    return f"{cursor.spelling}({parameters})"
+
+# Doc comment (parsed thanks to -fparse-all-comments) and declaration signature, the text the vector index embeds
+def add_documentation_properties(cursor, properties):
+    comment = cursor.raw_comment
+    if comment:
+        properties["raw_comment"] = comment[:max_comment_length]
+
+    signature = None
+    if cursor.kind in (CursorKind.CONSTRUCTOR, CursorKind.DESTRUCTOR):
+        signature = get_function_declarator(cursor)
+    elif cursor.kind in function_kinds:
+        signature = f"{cursor.result_type.spelling} {get_function_declarator(cursor)}"
+        if cursor.kind == CursorKind.CXX_METHOD and cursor.is_const_method():
+            signature += " const"
+    elif cursor.kind in class_kinds:
+        signature = f"{'struct' if cursor.kind == CursorKind.STRUCT_DECL else 'class'} {cursor.displayname}"
+    elif cursor.kind in (CursorKind.TYPEDEF_DECL, CursorKind.TYPE_ALIAS_DECL):
+        signature = f"using {cursor.spelling} = {cursor.underlying_typedef_type.spelling}"
+    elif cursor.kind in typed_kinds:
+        signature = f"{cursor.type.spelling} {cursor.spelling}"
+    if signature and signature.strip():
+        properties["signature"] = signature.strip()
+
 #############################################
 ### 4. Processing
 #############################################
 
+# Id numbers of the vertices emitted for the translation unit being processed. Like id_table it is
+# cleared for every unit, so that the memory of a process does not grow with the corpus; vertices
+# coming from several units are deduplicated by the GraphRecordMerger in front of the writer.
 processed_cursors_ids = set()
 
-# Add vertex for cursor
-def process_cursor_as_vertex(cursor, processed_cursors, lexical_parent=None):
+# How cursors located in a file are walked: not at all, entirely, or (in headers owned by another
+# translation unit) only the namespaces and linkage specs, for the declarations of other files nested in them
+FILE_SKIPPED = 0
+FILE_WALKED = 1
+FILE_OWNED_ELSEWHERE = 2
+
+container_kinds = {CursorKind.NAMESPACE, CursorKind.LINKAGE_SPEC}
+
+# Decision per file name how cursors located in the file are walked
+walked_files = {}
+
+# Registry of the claimed (header, preprocessor context) pairs, None to walk every header in every translation unit
+header_registry = None
+# Headers of the current translation unit whose declarations another translation unit extracts
+owned_elsewhere_headers = set()
+# Headers claimed in this process, {header path: {preprocessor context hash: translation unit path}}
+header_claims = {}
+
+def is_path_walked(file_path):
+    file_path = file_path.replace('\\', '/')
+    if walk_include_paths and not any(fnmatch.fnmatch(file_path, pattern) for pattern in walk_include_paths):
+        return False
+    return not any(fnmatch.fnmatch(file_path, pattern) for pattern in walk_exclude_paths)
+
+def get_file_walk(cursor):
+    location = cursor.location
+    file = location.file
+    if file is None:
+        return FILE_SKIPPED
+
+    file_name = file.name
+    walk = walked_files.get(file_name)
+    if walk is None:
+        if not is_path_walked(file_name) or (skip_system_headers and location.is_in_system_header):
+            walk = FILE_SKIPPED
+        elif file_name in owned_elsewhere_headers:
+            walk = FILE_OWNED_ELSEWHERE
+        else:
+            walk = FILE_WALKED
+        walked_files[file_name] = walk
+    return walk
+
+# Whether the cursor is located in a header owned by another translation unit, which emits its vertex
+# (the current unit only adds the edges from its own declarations to it)
+def is_owned_elsewhere(cursor):
+    return bool(owned_elsewhere_headers) and get_file_walk(cursor) == FILE_OWNED_ELSEWHERE
+
+# Claims the walked headers of the translation unit for the preprocessor context it is parsed in,
+# the ones claimed before (by another translation unit or run) are owned elsewhere
+def claim_translation_unit_headers(tu, clang_args):
+    header_paths = {inclusion.include.name for inclusion in tu.get_includes() if is_path_walked(inclusion.include.name)}
+    context_hash = get_preprocessor_context_hash(clang_base_args + clang_args)
+    claims, owned_elsewhere = claim_headers(header_registry, tu.spelling, header_paths, context_hash)
+    for file_path, contexts in claims.items():
+        header_claims.setdefault(file_path, {}).update(contexts)
+    owned_elsewhere_headers.update(owned_elsewhere)
+    metrics.increment("headers_claimed", len(claims))
+    metrics.increment("headers_owned_elsewhere", len(owned_elsewhere))
+
+# Expression kinds, their subtrees are pruned unless references are extracted
+expression_kinds = {}
+
+def is_expression_kind(kind):
+    is_expression = expression_kinds.get(kind)
+    if is_expression is None:
+        is_expression = kind.is_expression()
+        expression_kinds[kind] = is_expression
+    return is_expression
+
+def get_child_walk(child):
+    if not extract_references and is_expression_kind(child.kind):
+        return FILE_SKIPPED
+    walk = get_file_walk(child)
+    if walk == FILE_OWNED_ELSEWHERE and child.kind not in container_kinds:
+        return FILE_SKIPPED
+    return walk
+
+# Add vertex for cursor, returns (whether to walk the subtree of the cursor, whether the cursor has edges)
+def process_cursor_as_vertex(cursor, lexical_parent=None):
+    has_edges = False
     try:
         if cursor.kind.is_declaration():
-            id = get_id(cursor)
-            if id and not id in processed_cursors_ids:
+            id = get_id_number(cursor)
+            # Every occurrence of a declaration adds its edges (e.g. an out-of-line definition after the
+            # declaration in the class), so they do not depend on which headers the unit walks itself.
+            # The vertex comes from the first occurrence, repeated edges are dropped by the merger.
+            has_edges = id is not None
+            if id is not None and not id in processed_cursors_ids:
                 processed_cursors_ids.add(id)
-                processed_cursors.append(cursor)
 
                 properties = {}
 
@@ -254,7 +602,7 @@ def process_cursor_as_vertex(cursor, processed_cursors, lexical_parent=None):
                     elif cursor.kind is CursorKind.NAMESPACE:
                         pass
                     elif cursor.kind is CursorKind.LINKAGE_SPEC:
-                        return
+                        return False, has_edges
                     elif cursor.kind is CursorKind.CONSTRUCTOR:
                         properties = get_constructor_properties(cursor)
                     elif cursor.kind is CursorKind.DESTRUCTOR:
@@ -275,30 +623,64 @@ def process_cursor_as_vertex(cursor, processed_cursors, lexical_parent=None):
                         cursor.kind is CursorKind.TYPE_ALIAS_TEMPLATE_DECL):
                         pass
                     else:
-                        return
+                        return False, has_edges
 
-                add_vertex_to_gremlin(cursor, id, properties)
+                # A definition has the id of its canonical declaration, whose header may be owned elsewhere
+                if not (cursor.is_definition() and is_owned_elsewhere(cursor.canonical)):
+                    add_vertex_to_graph(cursor, id, properties)
+                if cursor.kind in class_kinds and cursor.is_definition():
+                    add_inheritance_closure(cursor)
         elif cursor.kind.is_reference():
-            processed_cursors.append(cursor)
+            has_edges = True
 
-            id = get_id(cursor.referenced)
-            if id:
+            id = get_id_number(cursor.referenced)
+            if id is not None:
                 if not id in processed_cursors_ids:
                     processed_cursors_ids.add(id)
-                    add_vertex_to_gremlin(cursor.referenced, id, {})
+                    if not is_owned_elsewhere(cursor.referenced):
+                        add_vertex_to_graph(cursor.referenced, id, {})
                 if cursor.kind == CursorKind.CXX_BASE_SPECIFIER:
                     # Workaround, cursor.lexical_parent is sometimes None
-                    add_edge_to_gremlin(lexical_parent, 'inherits', cursor.referenced)
+                    add_edge_to_graph(lexical_parent, 'inherits', cursor.referenced)
 
         elif cursor.kind.is_expression():
             pass
         elif cursor.kind.is_statement():
             pass
     except Exception as e:
+        metrics.count_error("cursor")
         print(f"ERROR processing cursor at {cursor.location.file.name}:{cursor.location.line}: {e}")
 
-    for child in cursor.get_children():        
-        process_cursor_as_vertex(child, processed_cursors, cursor)
+    return True, has_edges
+
+# Add vertices and edges for the cursor and its subtree in one pass, in preorder with an explicit stack
+# instead of recursion. Subtrees located in files which are not walked and (by default) expressions are pruned,
+# containers located in headers owned elsewhere are only passed through. Returns the number of walked cursors
+# and the time spent on their edges.
+def walk_cursor(root, walk=FILE_WALKED):
+    cursors = 0
+    edge_seconds = 0.0
+    stack = [(root, None, walk)]
+    while stack:
+        cursor, lexical_parent, walk = stack.pop()
+        cursors += 1
+        if walk == FILE_WALKED:
+            descend, has_edges = process_cursor_as_vertex(cursor, lexical_parent)
+            if has_edges:
+                start = time.perf_counter()
+                process_walked_cursor_edges(cursor)
+                edge_seconds += time.perf_counter() - start
+            if not descend:
+                continue
+
+        children = []
+        for child in cursor.get_children():
+            child_walk = get_child_walk(child)
+            if child_walk != FILE_SKIPPED:
+                children.append((child, cursor, child_walk))
+        stack.extend(reversed(children))
+
+    return cursors, edge_seconds
 
 # Add edges for cursor
 def process_cursor_edges(cursor):
@@ -312,30 +694,30 @@ def process_cursor_edges(cursor):
                     cursor.kind is CursorKind.ENUM_DECL):
                     if cursor.semantic_parent:
                         if cursor.semantic_parent.kind == CursorKind.NAMESPACE:
-                            add_edge_to_gremlin(cursor.semantic_parent, 'contains', cursor)
+                            add_edge_to_graph(cursor.semantic_parent, 'contains', cursor)
                         elif cursor.semantic_parent.kind in (CursorKind.STRUCT_DECL, CursorKind.CLASS_DECL):
-                            add_edge_to_gremlin(cursor.semantic_parent, 'contains_inner', cursor)
+                            add_edge_to_graph(cursor.semantic_parent, 'contains_inner', cursor)
                 elif (cursor.kind is CursorKind.NAMESPACE or
                       cursor.kind is CursorKind.FUNCTION_DECL or
                       cursor.kind is CursorKind.FUNCTION_TEMPLATE):
                     if cursor.semantic_parent:
                         if cursor.semantic_parent.kind == CursorKind.NAMESPACE:
-                            add_edge_to_gremlin(cursor.semantic_parent, 'contains', cursor)
+                            add_edge_to_graph(cursor.semantic_parent, 'contains', cursor)
                 elif (cursor.kind is CursorKind.CXX_METHOD or
                     cursor.kind is CursorKind.CONSTRUCTOR or
                     cursor.kind is CursorKind.DESTRUCTOR or
                     cursor.kind is CursorKind.CONVERSION_FUNCTION):
-                    add_edge_to_gremlin(cursor.semantic_parent, 'contains_method', cursor.get_definition())
+                    add_edge_to_graph(cursor.semantic_parent, 'contains_method', cursor.get_definition())
                 elif cursor.kind is CursorKind.FIELD_DECL:
-                    add_edge_to_gremlin(cursor.semantic_parent, 'contains_field', cursor)
+                    add_edge_to_graph(cursor.semantic_parent, 'contains_field', cursor)
                 elif cursor.kind is CursorKind.PARM_DECL:
-                    add_edge_to_gremlin(cursor.semantic_parent, 'contains_argument', cursor)
+                    add_edge_to_graph(cursor.semantic_parent, 'contains_argument', cursor)
                 elif cursor.kind is CursorKind.ENUM_CONSTANT_DECL:
-                    add_edge_to_gremlin(cursor.semantic_parent, 'contains_value', cursor)
+                    add_edge_to_graph(cursor.semantic_parent, 'contains_value', cursor)
                 #elif cursor.kind is CursorKind.TYPEDEF_DECL:
                     #tp = cursor.underlying_typedef_type.get_declaration()
             else:
-                add_edge_to_gremlin(cursor, 'declares', cursor.canonical)
+                add_edge_to_graph(cursor, 'declares', cursor.canonical)
         elif cursor.kind.is_reference():
             pass
         elif cursor.kind.is_expression():
@@ -343,16 +725,53 @@ def process_cursor_edges(cursor):
         elif cursor.kind.is_statement():
             pass
     except Exception as e:
+        metrics.count_error("cursor_edges")
         print(f"ERROR processing cursor edges at {cursor.location.file.name}:{cursor.location.line}: {e}")
 
-# Process translation unit 
-def process_translation_unit(tu):
-    processed_cursors = []
+# Edges of a cursor met during the walk (which only visits cursors of walked files)
+def process_walked_cursor_edges(cursor):
+    try:
+        if cursor.kind.is_invalid():
+            raise ValueError('Invalid kind of cursor')
+        elif cursor.kind.is_unexposed():
+            pass #raise ValueError('Unexposed kind of cursor') ?
+        elif cursor.kind.is_translation_unit():
+            pass
+        else:
+            process_cursor_edges(cursor)
+    except Exception as e:
+        metrics.count_error("cursor_edges")
+        print(f"ERROR processing cursor edges at {cursor.location.file.name}:{cursor.location.line}: {e}")
 
-    # create nodes
+# Process translation unit, parsed with clang_args (needed to claim its headers)
+def process_translation_unit(tu, clang_args=None):
+    global tu_cached, cursor_identity, graph_sink
+
+    tu_cached = None
+    processed_cursors_ids.clear()
+    id_table.clear()
+    cursor_identity = CursorIdentity(id_table, get_id, get_file_id)
+    walked_files.clear()
+    scope_names.clear()
+    owned_elsewhere_headers.clear()
+    if header_registry is not None and clang_args is not None:
+        claim_translation_unit_headers(tu, clang_args)
+
+    # Edges are emitted right after the cursor they come from, the ones whose endpoint
+    # vertex was not emitted yet wait for it (or for the end of the translation unit)
+    sink = graph_sink
+    graph_sink = PendingEdgeTable(sink, processed_cursors_ids)
+
+    # Vertices and edges come from the same walk, the time of the edges is measured inside of it
+    cursors = 0
+    edge_seconds = 0.0
+    start = time.perf_counter()
+
+    # create nodes and edges
     for cursor in tu.cursor.get_children():
         try:
-            if cursor.location.file is None or "Program Files" in cursor.location.file.name:
+            walk = get_child_walk(cursor)
+            if walk == FILE_SKIPPED:
                 pass
             elif cursor.kind.is_invalid():
                 raise ValueError('Invalid kind of cursor')
@@ -361,42 +780,319 @@ def process_translation_unit(tu):
             elif cursor.kind.is_translation_unit():
                 pass
             else:
-                process_cursor_as_vertex(cursor, processed_cursors)
+                walked_cursors, walked_edge_seconds = walk_cursor(cursor, walk)
+                cursors += walked_cursors
+                edge_seconds += walked_edge_seconds
         except Exception as e:
+            metrics.count_error("cursor")
             print(f"ERROR processing cursor at {cursor.location.file.name}:{cursor.location.line}: {e}")
-    
-    # create edges
-    for cursor in processed_cursors:
-        try:
-            if cursor.location.file is None or "Program Files" in cursor.location.file.name:
-                pass
-            elif cursor.kind.is_invalid():
-                raise ValueError('Invalid kind of cursor')
-            elif cursor.kind.is_unexposed():
-                pass #raise ValueError('Unexposed kind of cursor') ?
-            elif cursor.kind.is_translation_unit():
-                pass
-            else:
-                process_cursor_edges(cursor)
-        except Exception as e:
-            print(f"ERROR processing cursor edges at {cursor.location.file.name}:{cursor.location.line}: {e}")
 
+    graph_sink.close()
+    graph_sink = sink
+    cursor_identity = None
+    scope_names.clear()
+    owned_elsewhere_headers.clear()
+
+    metrics.add_time("vertex_pass", time.perf_counter() - start - edge_seconds)
+    metrics.add_time("edge_pass", edge_seconds)
+    metrics.increment("cursors", cursors)
+
+#############################################
+### 5. Parallel ingestion of a compilation database
 #############################################
-### 5. Main
+# Every worker process parses its translation units with its own clang index and
+# sends back plain vertex/edge records, the parent process is the single writer.
+# Vertex ids are claimed in a shared registry so that workers do not send back
+# vertices (mostly coming from shared headers) already emitted by another worker,
+# and so are the headers, only the worker claiming a header walks it.
 #############################################
 
-# Create translation unit
-index = clang.cindex.Index.create()
-clang_args = parse_input(include_folders, defines)
-translation_unit = index.parse(file_to_process, args=[
-    '-x', 'c++',
-    '-std=c++11', 
-    '-fparse-all-comments',
-    '-fno-delayed-template-parsing',
-    '-ferror-limit=0'
-] + clang_args)
+worker_index = None
+worker_usr_registry = None
+
+def init_ingest_worker(usr_registry, shared_header_registry):
+    global worker_index, worker_usr_registry, header_registry
+    worker_index = clang.cindex.Index.create()
+    worker_usr_registry = usr_registry
+    header_registry = shared_header_registry
+
+def create_tu_cache():
+    return TranslationUnitCache(tu_cache_path, max_size=tu_cache_max_size, max_age=tu_cache_max_age)
+
+def parse_translation_unit(index, file_path, clang_args):
+    args = clang_base_args + clang_args
+    options = 0
+    if parse_skip_function_bodies and not extract_references:
+        options |= clang.cindex.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
+
+    if tu_cache_path:
+        tu_cache = create_tu_cache()
+        with metrics.time("tu_cache_load"):
+            translation_unit = tu_cache.load(index, file_path, args, options)
+        metrics.increment("tu_cache_lookups", result="miss" if translation_unit is None else "hit")
+        if translation_unit is not None:
+            return translation_unit
+
+    with metrics.time("parse"):
+        translation_unit = index.parse(file_path, args=args, options=options)
+
+    if tu_cache_path:
+        tu_cache.store(translation_unit, file_path, args, options)
+    return translation_unit
+
+# All files the translation unit consists of (the main file and every included file)
+def get_translation_unit_files(tu):
+    files = {tu.spelling}
+    for inclusion in tu.get_includes():
+        files.add(inclusion.include.name)
+    return files
+
+# Runs in a worker process, returns (file path, vertices, edges, files, file dependencies, header claims, metrics)
+# extracted from the translation unit. The metrics of the worker are sent along with every unit and merged by the parent.
+def extract_translation_unit(file_path, clang_args):
+    global graph_sink
+
+    metrics.reset()
+    file_dependencies.clear()
+    header_claims.clear()
+    collector = GraphRecordCollector()
+    graph_sink = collector
+    translation_unit = parse_translation_unit(worker_index, file_path, clang_args)
+    process_translation_unit(translation_unit, clang_args)
+    graph_sink = None
+
+    vertices, edges = id_table.materialize_records(collector.vertices, collector.edges)
+    claimed_ids = set(worker_usr_registry.claim([properties["id"] for _, properties in vertices]))
+    vertices = [vertex for vertex in vertices if vertex[1]["id"] in claimed_ids]
+    return (file_path, vertices, edges, get_translation_unit_files(translation_unit), file_dependencies,
+            header_claims, metrics.snapshot())
+
+# Returns files of every successfully processed translation unit. Headers of header_owners (kept from
+# previous runs) are owned elsewhere from the start. file_dependencies and header_claims hold those of this run.
+def ingest_translation_units_in_parallel(translation_units, sink, workers, header_owners=None):
+    file_dependencies.clear()
+    header_claims.clear()
+    merger = GraphRecordMerger(sink)
+    registry_manager, usr_registry = start_usr_registry()
+    tu_files = {}
+
+    try:
+        shared_header_registry = None
+        if deduplicate_headers:
+            shared_header_registry = registry_manager.UsrRegistry()
+            shared_header_registry.claim(get_header_keys(header_owners or {}))
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_ingest_worker,
+                                 initargs=(usr_registry, shared_header_registry)) as executor:
+            futures = [executor.submit(extract_translation_unit, file_path, clang_args)
+                       for file_path, clang_args in translation_units]
+
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    file_path, vertices, edges, files, dependencies, claims, worker_metrics = future.result()
+                except Exception as e:
+                    metrics.count_error("translation_unit")
+                    print(f"ERROR processing translation unit: {e}")
+                    continue
+                metrics.merge(worker_metrics)
+                for dependent_path, dependency_paths in dependencies.items():
+                    add_file_dependencies(dependent_path, dependency_paths)
+                for header_path, contexts in claims.items():
+                    header_claims.setdefault(header_path, {}).update(contexts)
+                merger.add_records(vertices, edges)
+                tu_files[file_path] = files
+                print(f"[{done}/{len(futures)}] {file_path}: {len(vertices)} vertices, {len(edges)} edges")
+    finally:
+        registry_manager.shutdown()
+
+    merger.close()
+    return tu_files
+
+# Sequential counterpart of ingest_translation_units_in_parallel, every translation unit is processed
+# in this process. Returns files of every processed translation unit.
+def ingest_translation_units(translation_units, sink, header_owners=None):
+    global graph_sink, header_registry
+
+    file_dependencies.clear()
+    header_claims.clear()
+    merger = GraphRecordMerger(sink)
+    graph_sink = InternedIdWriter(merger, id_table)
+    header_registry = None
+    if deduplicate_headers:
+        header_registry = UsrRegistry()
+        header_registry.claim(get_header_keys(header_owners or {}))
+    tu_files = {}
+
+    try:
+        index = clang.cindex.Index.create()
+        for file_path, clang_args in translation_units:
+            # Create translation unit
+            translation_unit = parse_translation_unit(index, file_path, clang_args)
+
+            # Walk the entire translation unit in preorder
+            process_translation_unit(translation_unit, clang_args)
+            tu_files[file_path] = get_translation_unit_files(translation_unit)
+    finally:
+        graph_sink = None
+        header_registry = None
+
+    merger.close()
+    return tu_files
+
+#############################################
+### 6. Main
+#############################################
+
+def main():
+    global gremlin_client
+
+    profiler = start_profiling(profile_path)
+
+    if snapshot_path:
+        graph_writer = SnapshotWriter(snapshot_path)
+    else:
+        gremlin_client = create_gremlin_client()
+
+        # All graph mutations go through the bulk writer
+        graph_writer = GremlinBulkWriter(gremlin_client,
+                                         batch_size=gremlin_batch_size,
+                                         max_in_flight=gremlin_max_in_flight_batches,
+                                         ru_budget=gremlin_ru_budget,
+                                         max_retries=gremlin_max_retries)
+
+    # The schema catalog records everything which gets written
+    catalog_collector = CatalogCollector(graph_writer)
+    sink = catalog_collector
+
+    # So do the trigram and the vector index
+    trigram_builder = None
+    if trigram_index_path and not snapshot_path:
+        trigram_builder = TrigramIndexBuilder()
+        sink = DocumentIndexCollector(sink, trigram_builder)
+    vector_builder = None
+    if vector_index_path and not snapshot_path:
+        vector_builder = VectorIndexBuilder(HashingEmbedder(vector_dimensions))
+        sink = DocumentIndexCollector(sink, vector_builder)
+
+    if compile_commands_path:
+        translation_units = load_compile_commands(compile_commands_path)
+    else:
+        translation_units = [(file_to_process, parse_input(include_folders, defines))]
+
+    # Incremental mode maintains the database, a snapshot always gets the whole graph
+    manifest = None
+    dirty_files = set()
+    dirty_file_ids = set()
+    dropped_vertex_counts, dropped_edge_counts = {}, {}
+    header_owners = {}
+    if incremental_manifest_path and not snapshot_path:
+        manifest = IngestManifest(incremental_manifest_path)
+        translation_units = [(file_path, clang_args) for file_path, clang_args in translation_units
+                             if not manifest.is_tu_unchanged(file_path, clang_args)]
+
+        # Outdated data is removed up front, the filter lets through only what has to be rewritten
+        dirty_files = manifest.get_dirty_files(translation_units)
+        dirty_file_ids = {get_file_id(file_path) for file_path in dirty_files}
+        with metrics.time("drop"):
+            dropped_vertex_counts, dropped_edge_counts = drop_file_vertices(dirty_file_ids)
+
+        # Vertices kept in the graph stay in the trigram index: taken from the index of the
+        # current graph version, or read from the graph when there is none
+        if trigram_builder is not None:
+            with metrics.time("trigram_index"):
+                trigram_index = load_trigram_index(trigram_index_path, get_graph_version(gremlin_client))
+                if trigram_index is not None:
+                    trigram_builder.load_index(trigram_index)
+                    trigram_index.close()
+                else:
+                    trigram_builder.load_graph(gremlin_client, gremlin_max_retries)
+                trigram_builder.remove_files(dirty_file_ids)
+        if vector_builder is not None:
+            with metrics.time("vector_index"):
+                vector_index = load_vector_index(vector_index_path, get_graph_version(gremlin_client))
+                if vector_index is not None:
+                    vector_builder.load_index(vector_index)
+                    vector_index.close()
+                else:
+                    vector_builder.load_graph(gremlin_client, gremlin_max_retries)
+                vector_builder.remove_files(dirty_file_ids)
+
+        # Headers which stay in the graph keep their owner
+        if deduplicate_headers:
+            header_owners = manifest.get_header_owners(dirty_files)
+
+        sink = IncrementalFilter(sink, manifest, dirty_file_ids)
+        print(f"Incremental run: {len(translation_units)} translation unit(s) to process, {len(dirty_file_ids)} file(s) to rewrite")
+
+    if compile_commands_path:
+        tu_files = ingest_translation_units_in_parallel(translation_units, sink, ingest_workers, header_owners)
+    else:
+        tu_files = ingest_translation_units(translation_units, sink, header_owners)
+
+    # Send what is still buffered and wait for every batch to be stored
+    with metrics.time("flush"):
+        graph_writer.close()
+    metrics.increment("vertices_written", graph_writer.vertices_written)
+    metrics.increment("edges_written", graph_writer.edges_written)
+    print(f"Written {graph_writer.vertices_written} vertices and {graph_writer.edges_written} edges")
+    if not snapshot_path:
+        print(f"Consumed {graph_writer.request_charge:.1f} RU, {graph_writer.throttled_batches} batch(es) throttled, {graph_writer.retries} retries")
+
+    if tu_cache_path:
+        evicted = create_tu_cache().evict()
+        if evicted:
+            print(f"Evicted {evicted} parsed translation unit(s) from the cache")
+
+    # The manifest is only updated when everything was stored, so that a failed run is redone next time
+    if manifest:
+        if graph_writer.failed_batches:
+            print("ERROR some writes failed, incremental manifest is not updated")
+        else:
+            sink.close()
+            for file_path, clang_args in translation_units:
+                if file_path in tu_files:
+                    manifest.record_tu(file_path, clang_args, tu_files[file_path])
+            manifest.record_file_dependencies(file_dependencies, dirty_files)
+            manifest.record_header_owners(header_claims, dirty_files)
+            manifest.save()
+
+    # Let the readers of the graph know that their cached schema is outdated,
+    # the stored catalog is updated with what was removed and written in this run.
+    # Mutations which failed were recorded by the collector but never stored, they are left out
+    # (the whole run is not: what was stored is dropped again, and subtracted, by the next run).
+    graph_version = None
+    if gremlin_client:
+        if graph_writer.vertices_written or graph_writer.edges_written or dirty_file_ids:
+            with metrics.time("publish"):
+                catalog = get_graph_catalog(gremlin_client) or GraphCatalog()
+                catalog.subtract(dropped_vertex_counts, dropped_edge_counts)
+                catalog_collector.catalog.subtract(graph_writer.failed_vertex_counts, graph_writer.failed_edge_counts)
+                catalog.merge(catalog_collector.catalog)
+                graph_version = publish_graph_metadata(gremlin_client, catalog)
+            print(f"Published graph version {graph_version}")
+        elif trigram_builder is not None or vector_builder is not None:
+            graph_version = get_graph_version(gremlin_client)
+        gremlin_client.close()
+
+    # The indexes are only used with the graph version they are written for
+    if trigram_builder is not None:
+        if graph_writer.failed_batches:
+            print("ERROR some writes failed, trigram index is not updated")
+        else:
+            with metrics.time("trigram_index"):
+                trigram_builder.save(trigram_index_path, graph_version)
+            print(f"Trigram index of {len(trigram_builder.documents)} vertices written to {trigram_index_path}")
+    if vector_builder is not None:
+        if graph_writer.failed_batches:
+            print("ERROR some writes failed, vector index is not updated")
+        else:
+            with metrics.time("vector_index"):
+                vector_builder.save(vector_index_path, graph_version)
+            print(f"Vector index of {len(vector_builder.documents)} vertices written to {vector_index_path}")
 
-# Walk the entire translation unit in preorder
-process_translation_unit(translation_unit)
+    metrics.export(metrics_summary_path, metrics_textfile_path)
+    stop_profiling(profiler, profile_path)
 
-gremlin_client.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#############################################
+# Prompts of the question answering path, shared by
+# the example chatbot (test_the_idea.py) and the
+# asyncio service (qa_service.py).
+#############################################
+
+from gremlin_parser import quote
+
+def build_gremlin_query_system_message(relationship_map, property_map, vertex_counts=None):
+    # Base system message
+    system_message = """
+        You are an expert in Azure Cosmos DB Gremlin query syntax. 
+        Your task is to strictly generate an efficient Gremlin query to help with the user prompt.
+        You are not to generate explanations or any other responses.
+        Your response will be used by another LLM to answer the user prompt, you only generate query to extract additional info for the main LLM. 
+        You have access to a graph database that represents a C++ codebase. 
+        The database consists of the following vertex types and their associated edge types:
+        """
+
+    # Add the relationship map and property map to the system message
+    for label in relationship_map.keys():
+        count = f" ({vertex_counts[label]} in the graph)" if vertex_counts and label in vertex_counts else ""
+        system_message += f"\n- `{label}` vertices{count} can have the following edges: {', '.join(relationship_map[label])}"
+        system_message += f"\n  `{label}` vertices have the following properties: {', '.join(property_map[label])}"
+    
+    # Specify that the response should be an exact Gremlin query
+    system_message += """    
+        Important Notes:
+        - Your response should be an exact Gremlin query and nothing else.
+        - The query should extract as little data as possible, do not extract all vertices or edges properties but only relevant ones, group them with their unique identifiers (id)
+        - Vertices have their fully qualified name (e.g. `ns::Class::method`) in `qualified_name` and the enclosing namespaces in `namespace` (e.g. `ns::detail`), all overloads of a function share the same `overload_group`: filter on these instead of walking `contains` edges.
+        - `inherits_transitive` edges (with the `depth` of the base) go from a class to every direct and indirect base class: use out('inherits_transitive') for all bases and in('inherits_transitive') for all derived classes instead of repeat() over `inherits`.
+        - Declarations have their `signature` (e.g. `void to_json(BasicJsonType &, T)`) and their doc comment in `raw_comment`: return them when the question asks how to use something.
+        - Allowed Gremlin Steps:
+            and, as, by, coalesce, constant
+            count, dedup, drop, executionProfile, fold
+            group, has, inject, is
+            limit, local, not, optional, or, order
+            path, project, properties, range
+            repeat, sample, select, store
+            TextP.startingWith(string), TextP.endingWith(string), TextP.containing(string), TextP.notStartingWith(string), TextP.notEndingWith(string), TextP.notContaining(string)
+            tree, unfold, union
+            V, E, out, in, both, outE, inE, bothE, outV, inV, bothV, otherV
+            where  
+        """
+    return system_message
+
+# Earlier turns of a conversation are referenced by their handle and a few result names,
+# the handle stands for the ids of the result vertices of that turn
+def build_conversation_context(conversation):
+    lines = []
+    for turn in conversation:
+        if turn["vertex_count"] == 0:
+            continue
+        names = ", ".join(turn["names"])
+        count = "" if turn["vertex_count"] is None else f"{turn['vertex_count']} vertices"
+        details = "; ".join(part for part in (count, names) if part)
+        lines.append(f"- {turn['handle']}: result of \"{turn['question']}\"" + (f" ({details})" if details else ""))
+    if not lines:
+        return ""
+    return ("This question follows up on earlier questions of the conversation. Their result vertices are available "
+            "by handle, start from them with g.V(<handle>) (e.g. g.V(turn1).has('is_virtual', true)) instead of "
+            "searching the graph again when the question refers to them:\n" + "\n".join(lines) + "\n")
+
+# Declarations similar to the question (from the vector index) the query can start from by id
+def build_candidates_context(candidates):
+    if not candidates:
+        return ""
+    lines = [f"- {quote(candidate['id'])} {candidate['name']}: {candidate['signature']}" for candidate in candidates]
+    return ("Declarations whose signature or doc comment is similar to the question (id, qualified name: signature), "
+            "start from them with g.V(<ids>) when they fit the question:\n" + "\n".join(lines) + "\n")
+
+def build_query_generation_user_message(user_request, conversation=(), candidates=()):
+    return (f"{build_conversation_context(conversation)}{build_candidates_context(candidates)}"
+            f"Generate a Gremlin query to help with the {user_request}")
+
+# Sent back to the query generator when the cost guard rejected its query
+def build_query_rejection_user_message(user_request, reason):
+    return f"The query was rejected before it was run: {reason}\nGenerate a corrected Gremlin query to help with the {user_request}"
+
+# The generated query sometimes comes wrapped in a markdown code block
+def clean_generated_query(response_text):
+    return response_text.replace("```gremlin", "").replace("```", "").strip()
+
+code_advisor_system_message = """
+        You are an expert codebase advisor. Your task is to help answer technical questions about the codebase.
+        The information you provide should be based on the data retrieved from the database in response to the user's query.
+        
+        Always tailor your response to the specific user question and the data provided.
+        
+        Guidelines for your response:
+        - Make sure your answer directly addresses the user's question.
+        - Use the database data to provide a precise and concise answer.
+        - If appropriate, list relevant information (such as classes, methods, or properties) in a simple and easy-parseable format.
+        - Do not add unnecessary details. Focus on answering the question clearly and succinctly.
+        - Your answer should be structured in a way that the user can easily understand and use.
+        """
+
+# Earlier answers of the conversation are passed shortened, their data is not repeated
+def build_code_advisor_user_message(user_question, query_result, conversation=(), answer_length=500):
+    history = ""
+    if conversation:
+        turns = []
+        for turn in conversation:
+            answer = turn["answer"] if len(turn["answer"]) <= answer_length else turn["answer"][:answer_length] + "..."
+            turns.append(f"Q: {turn['question']}\nA: {answer}")
+        history = "Earlier in this conversation:\n" + "\n".join(turns) + "\n\n"
+    return f"{history}User's question: {user_question}\nData retrieved from the database: {query_result}"
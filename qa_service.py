@@ -0,0 +1,432 @@
+#############################################
+# Asyncio question answering service: the same
+# question -> Gremlin query -> result -> answer path
+# as test_the_idea.py, but for many concurrent
+# questions behind an HTTP endpoint.
+#
+#   POST /ask {"question": "...", "session": "..." (optional, continues a conversation)}
+#   -> {"question", "query", "result" (shaped as passed to the advisor), "answer", "session"}
+#   GET /metrics -> stage timings, counters and latencies in the Prometheus text format
+#
+# Usage:
+#   python qa_service.py [--host 0.0.0.0] [--port 8080]
+#############################################
+
+from aiohttp import web
+from dotenv import load_dotenv
+from graph_backend import create_gremlin_client, submit_query_async, submit_result_set_async
+from graph_metadata import get_graph_metadata_async, get_graph_version_async, GRAPH_METADATA_LABEL
+from query_cache import QueryCache, normalize_question
+from result_shaping import shape_result_set, shape_result_chunks
+from qa_prompts import build_gremlin_query_system_message, build_query_generation_user_message, build_query_rejection_user_message, clean_generated_query, code_advisor_system_message, build_code_advisor_user_message
+from query_guard import QueryGuard
+from trigram_index import load_trigram_index
+from vector_index import load_vector_index
+from conversation_session import ConversationSession
+from collections import OrderedDict
+from metrics import metrics, start_profiling, stop_profiling
+import argparse
+import asyncio
+import functools
+import json
+import openai
+import os
+import time
+import uuid
+
+#############################################
+### 0. Input
+#############################################
+
+cosmos_db_url = 'wss://cpp-codebase-playground.gremlin.cosmos.azure.com:443/'
+cosmos_db_username = "/dbs/codebase/colls/codebase-graph"
+openai_endpoint = "https://cpp-codebase-rag.openai.azure.com/"
+openai_api_version = "2024-08-01-preview"
+
+# Questions answered at the same time, further ones wait for a free slot
+max_concurrent_questions = 32
+
+# Connections of the Gremlin connection pool (also the limit of Gremlin requests in flight) and LLM requests in flight
+gremlin_pool_size = 8
+max_concurrent_llm_requests = 16
+
+# Timeouts of the single stages (seconds)
+schema_timeout = 60
+query_generation_timeout = 60
+query_execution_timeout = 60
+answer_timeout = 120
+
+# How often the graph version is checked; a new version rebuilds the schema and invalidates the caches
+graph_version_poll_interval = 30
+
+# Query results reach the advisor as compact tables of at most this many tokens (plus a summary of the rest)
+result_token_budget = 4000
+result_scan_limit = 100000
+
+# Cost guard of the generated queries: queries estimated to read more vertices and edges than this
+# go back to the generator (at most max_query_attempts generations), results are limited to query_result_limit rows
+query_max_cost = 100000
+query_result_limit = 1000
+max_query_attempts = 3
+# Trigram index written by the ingester (its trigram_index_path), substring searches are resolved into vertex ids with it
+trigram_index_path = None # e.g. ".cpprag_cache/trigrams.idx"
+# Vector index written by the ingester (its vector_index_path), the declarations most similar to the
+# question are offered to the query generator as starting points
+vector_index_path = None # e.g. ".cpprag_cache/vectors.idx"
+vector_candidates = 10
+vector_min_score = 0.1
+
+# Conversations: follow-up questions of a session run against the working subgraph of its earlier
+# results. Sessions idle for longer than session_ttl seconds (or beyond max_sessions) are dropped.
+max_sessions = 1000
+session_ttl = 1800
+session_max_vertices = 5000
+
+query_cache_path = ".cpprag_cache/queries.json"
+query_cache_size = 1000
+query_cache_ttl = 24 * 3600
+
+# Metrics are served on GET /metrics and, when the service stops, written to these files
+metrics_summary_path = None # e.g. ".cpprag_metrics/qa_service.json"
+metrics_textfile_path = None
+# Profile the service from start to stop with cProfile into this file
+profile_path = None # e.g. "qa_service.prof"
+
+#############################################
+### 1. Service
+#############################################
+
+class QuestionError(Exception):
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
+class QAService:
+    def __init__(self, gremlin_client, openai_client, query_cache):
+        self.gremlin_client = gremlin_client
+        self.openai_client = openai_client
+        self.query_cache = query_cache
+        self.question_slots = asyncio.Semaphore(max_concurrent_questions)
+        self.llm_slots = asyncio.Semaphore(max_concurrent_llm_requests)
+        # Requests beyond the pool size would wait for a connection in a worker thread each
+        self.gremlin_slots = asyncio.Semaphore(gremlin_pool_size)
+        self.schema_lock = asyncio.Lock()
+        self.graph_version = None
+        self.system_message = None
+        self.catalog = None
+        self.query_guard = QueryGuard(None, query_max_cost, query_result_limit)
+        self.vector_index = None
+        self.schema_loaded = False
+        self.pending_queries = {}
+        # session id -> [session, lock, last use], least recently used first
+        self.sessions = OrderedDict()
+
+    # Runs one stage of a question with its timeout, failures are reported (and counted) with the stage name
+    async def run_stage(self, stage, timeout, awaitable):
+        phase = stage.replace(' ', '_')
+        try:
+            with metrics.time(phase):
+                return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            metrics.count_error(f"{phase}_timeout")
+            raise QuestionError(stage, f"{stage} timed out after {timeout} s")
+        except QuestionError:
+            raise
+        except Exception as e:
+            metrics.count_error(phase)
+            raise QuestionError(stage, f"{stage} failed: {e}")
+
+    async def submit(self, query, bindings=None, kind="schema"):
+        async with self.gremlin_slots:
+            with metrics.measure("gremlin_request", kind=kind):
+                return await submit_query_async(self.gremlin_client, query, bindings)
+
+    # Shaped text of the query result. ResultSet chunks are read with blocking calls, so in a worker thread.
+    # Queries starting from vertices of the session run against its working subgraph.
+    async def execute_query(self, query, session):
+        loop = asyncio.get_running_loop()
+        local_result = await loop.run_in_executor(None, session.run_locally, query)
+        if local_result is not None:
+            return shape_result_chunks(session.record_results(query, [local_result]), result_token_budget, result_scan_limit)
+
+        is_cached, result = self.query_cache.get_result(query)
+        metrics.increment("query_cache_lookups", level="result", result="hit" if is_cached else "miss")
+        if is_cached:
+            return result
+        async with self.gremlin_slots:
+            with metrics.measure("gremlin_request", kind="query"):
+                result_set = await submit_result_set_async(self.gremlin_client, query)
+                result = await loop.run_in_executor(None, shape_result_set, session.record_results(query, result_set),
+                                                    result_token_budget, result_scan_limit)
+        self.query_cache.put_result(query, result)
+        return result
+
+    # purpose labels the latency of the request (query_generation or answer_generation),
+    # history holds the earlier messages of the conversation
+    async def chat(self, system_message, user_message, max_tokens, purpose, history=()):
+        async with self.llm_slots:
+            with metrics.measure("openai_request", purpose=purpose):
+                response = await self.openai_client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=[
+                        {"role": "system", "content": system_message},
+                        *history,
+                        {"role": "user", "content": user_message},
+                    ],
+                    max_tokens=max_tokens,
+                    temperature=0.2
+                )
+        return response.choices[0].message.content
+
+    #############################################
+    # Schema
+    #############################################
+
+    # Schema from label scans, for graphs without catalog. The scans of all labels run concurrently.
+    async def scan_schema(self):
+        labels = [label for label in await self.submit("g.V().label().dedup()") if label != GRAPH_METADATA_LABEL]
+
+        async def scan_label(label):
+            edges, properties = await asyncio.gather(
+                self.submit("g.V().hasLabel(label).outE().label().dedup()", {"label": label}),
+                self.submit("g.V().hasLabel(label).valueMap(true).limit(1)", {"label": label}))
+            return edges, list(properties[0].keys()) if properties else []
+
+        scans = await asyncio.gather(*(scan_label(label) for label in labels))
+        relationship_map = {label: scan[0] for label, scan in zip(labels, scans)}
+        property_map = {label: scan[1] for label, scan in zip(labels, scans)}
+        return relationship_map, property_map
+
+    # Reads the graph version and rebuilds the schema (and drops cached queries) when it changed
+    async def refresh_schema(self, force=False):
+        async with self.schema_lock:
+            async with self.gremlin_slots:
+                with metrics.measure("gremlin_request", kind="metadata"):
+                    graph_version = await get_graph_version_async(self.gremlin_client)
+            if self.schema_loaded and not force and graph_version == self.graph_version and graph_version is not None:
+                # The ingester writes the trigram index after it published the version
+                if trigram_index_path and self.query_guard.trigram_index is None:
+                    self.update_query_guard()
+                if vector_index_path and self.vector_index is None:
+                    self.vector_index = load_vector_index(vector_index_path, self.graph_version)
+                return
+
+            with metrics.time("schema_fetch"):
+                async with self.gremlin_slots:
+                    with metrics.measure("gremlin_request", kind="metadata"):
+                        metadata = await get_graph_metadata_async(self.gremlin_client)
+                catalog = metadata["catalog"]
+                if catalog is not None:
+                    relationship_map, property_map = catalog.get_relationship_map(), catalog.get_property_map()
+                    vertex_counts = catalog.get_vertex_counts()
+                else:
+                    relationship_map, property_map = await self.scan_schema()
+                    vertex_counts = None
+
+            self.system_message = build_gremlin_query_system_message(relationship_map, property_map, vertex_counts)
+            self.catalog = catalog
+            self.graph_version = metadata["version"]
+            self.update_query_guard()
+            self.update_vector_index()
+            self.query_cache.set_graph_version(self.graph_version)
+            self.schema_loaded = True
+            print(f"Schema loaded for graph version {self.graph_version}")
+
+    # Guard of the generated queries with the catalog and the trigram index of the current graph version
+    def update_query_guard(self):
+        trigram_index = load_trigram_index(trigram_index_path, self.graph_version)
+        self.query_guard = QueryGuard(self.catalog, query_max_cost, query_result_limit, trigram_index=trigram_index)
+
+    # Vector index of the current graph version, questions still searching the old one keep it open until they are done
+    def update_vector_index(self):
+        self.vector_index = load_vector_index(vector_index_path, self.graph_version)
+
+    # Declarations similar to the question from the vector index, searched in a worker thread
+    async def get_candidates(self, question):
+        vector_index = self.vector_index
+        if vector_index is None:
+            return []
+        with metrics.measure("vector_search"):
+            results = await asyncio.get_running_loop().run_in_executor(None, vector_index.search, [question],
+                                                                       vector_candidates, vector_min_score)
+        return results[0]
+
+    async def poll_graph_version(self):
+        while True:
+            await asyncio.sleep(graph_version_poll_interval)
+            try:
+                await asyncio.wait_for(self.refresh_schema(), schema_timeout)
+            except Exception as e:
+                metrics.count_error("schema_refresh")
+                print(f"ERROR refreshing the graph schema: {e}")
+
+    #############################################
+    # Question answering
+    #############################################
+
+    # Generated queries pass the cost guard, a rejected query goes back to the LLM with the reason.
+    # Handles of earlier turns of the session are replaced by the ids of their vertices first.
+    async def generate_query(self, question, session=None):
+        if not self.schema_loaded:
+            await self.refresh_schema()
+        conversation = session.get_conversation() if session is not None else ()
+        candidates = await self.get_candidates(question)
+        user_message = build_query_generation_user_message(question, conversation, candidates)
+        history = []
+        for _ in range(max_query_attempts):
+            response = await self.chat(self.system_message, user_message, 1000, "query_generation", history)
+            query = clean_generated_query(response)
+            if session is not None:
+                query = await asyncio.get_running_loop().run_in_executor(None, session.resolve_handles, query)
+            guarded_query, reason = self.query_guard.check(query)
+            if guarded_query is not None:
+                return guarded_query
+            history += [{"role": "user", "content": user_message}, {"role": "assistant", "content": query}]
+            user_message = build_query_rejection_user_message(question, reason)
+        raise QuestionError("query generation", f"generated query was rejected: {reason}")
+
+    # The same question asked again while its query is being generated waits for that query
+    async def generate_query_once(self, question):
+        key = normalize_question(question)
+        task = self.pending_queries.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.run_stage("query generation", query_generation_timeout + schema_timeout,
+                                                        self.generate_query(question)))
+            self.pending_queries[key] = task
+            task.add_done_callback(lambda _: self.pending_queries.pop(key, None))
+        # A client going away must not cancel the generation for the others
+        return await asyncio.shield(task)
+
+    #############################################
+    # Sessions
+    #############################################
+
+    # Session of the id (a new one for an unknown or missing id) with its lock, idle sessions are dropped
+    def get_session(self, session_id):
+        now = time.monotonic()
+        while self.sessions:
+            oldest_id, (_, _, last_used) = next(iter(self.sessions.items()))
+            if now - last_used <= session_ttl and len(self.sessions) < max_sessions:
+                break
+            del self.sessions[oldest_id]
+            metrics.increment("sessions_expired")
+
+        entry = self.sessions.get(session_id) if session_id else None
+        if entry is None:
+            session_id = uuid.uuid4().hex
+            entry = [ConversationSession(self.gremlin_client, session_max_vertices, query_result_limit), asyncio.Lock(), now]
+            self.sessions[session_id] = entry
+            metrics.increment("sessions_started")
+        entry[2] = now
+        self.sessions.move_to_end(session_id)
+        return session_id, entry[0], entry[1]
+
+    async def answer(self, question, session_id=None):
+        async with self.question_slots:
+            session_id, session, session_lock = self.get_session(session_id)
+            # The questions of one conversation are answered one after the other
+            async with session_lock:
+                if not self.schema_loaded:
+                    await self.run_stage("query generation", schema_timeout, self.refresh_schema())
+                session.set_graph_version(self.graph_version)
+
+                # Follow-up questions depend on the earlier turns, they are neither cached nor shared
+                if session.get_conversation():
+                    query = await self.run_stage("query generation", query_generation_timeout + schema_timeout,
+                                                 self.generate_query(question, session))
+                else:
+                    query = self.query_cache.get_query(question)
+                    metrics.increment("query_cache_lookups", level="query", result="miss" if query is None else "hit")
+                    if query is None:
+                        query = await self.generate_query_once(question)
+                        self.query_cache.put_query(question, query)
+
+                try:
+                    result = await self.run_stage("query execution", query_execution_timeout, self.execute_query(query, session))
+                except QuestionError:
+                    self.query_cache.discard_query(question)
+                    raise
+
+                user_message = build_code_advisor_user_message(question, result, session.get_conversation())
+                answer = await self.run_stage("answer", answer_timeout,
+                                              self.chat(code_advisor_system_message, user_message, 2000, "answer_generation"))
+                session.add_turn(question, query, answer)
+                metrics.increment("questions_answered")
+                return {"question": question, "query": query, "result": result, "answer": answer, "session": session_id}
+
+#############################################
+### 2. HTTP endpoint
+#############################################
+
+# Query results are GraphSON, anything else is sent as text
+json_dumps = functools.partial(json.dumps, default=str)
+
+async def handle_ask(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return web.json_response({"error": "request body is not JSON"}, status=400)
+    question = body.get("question") if isinstance(body, dict) else None
+    if not isinstance(question, str) or not question.strip():
+        return web.json_response({"error": "'question' is required"}, status=400)
+    session_id = body.get("session")
+    if session_id is not None and not isinstance(session_id, str):
+        return web.json_response({"error": "'session' must be a string"}, status=400)
+
+    service = request.app["service"]
+    try:
+        response = await service.answer(question.strip(), session_id)
+    except QuestionError as e:
+        status = 504 if "timed out" in str(e) else 502
+        return web.json_response({"error": str(e), "stage": e.stage}, status=status)
+    return web.json_response(response, dumps=json_dumps)
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.to_prometheus(), content_type="text/plain", charset="utf-8")
+
+async def start_service(app):
+    service = app["service"]
+    app["profiler"] = start_profiling(profile_path)
+    # The first questions should not wait for the schema, it is read while the server starts up
+    try:
+        await asyncio.wait_for(service.refresh_schema(), schema_timeout)
+    except Exception as e:
+        print(f"ERROR loading the graph schema: {e}")
+    app["version_poller"] = asyncio.create_task(service.poll_graph_version())
+
+async def stop_service(app):
+    service = app["service"]
+    app["version_poller"].cancel()
+    service.query_cache.save()
+    await service.openai_client.close()
+    await asyncio.get_running_loop().run_in_executor(None, service.gremlin_client.close)
+    metrics.export(metrics_summary_path, metrics_textfile_path)
+    stop_profiling(app["profiler"], profile_path)
+
+def create_app():
+    load_dotenv()
+
+    gremlin_client = create_gremlin_client(cosmos_db_url, cosmos_db_username, pool_size=gremlin_pool_size)
+    openai_client = openai.AsyncAzureOpenAI(api_key=os.getenv("OPENAI_API_KEY"),
+                                            azure_endpoint=openai_endpoint,
+                                            api_version=openai_api_version)
+    query_cache = QueryCache(query_cache_path, max_queries=query_cache_size, max_results=query_cache_size, ttl=query_cache_ttl)
+
+    app = web.Application()
+    app["service"] = QAService(gremlin_client, openai_client, query_cache)
+    app.router.add_post("/ask", handle_ask)
+    app.router.add_get("/metrics", handle_metrics)
+    app.on_startup.append(start_service)
+    app.on_cleanup.append(stop_service)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Question answering service over the C++ codebase graph")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
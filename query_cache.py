@@ -0,0 +1,163 @@
+#############################################
+# Two-level cache of the question answering path:
+#   normalized question text -> generated Gremlin query
+#   normalized Gremlin query -> query result
+# Both levels belong to one graph version and are dropped
+# as soon as the ingester published a new one. Entries are
+# evicted least recently used first and after a time to live,
+# the cache can be persisted to a JSON file between runs.
+#############################################
+
+from collections import OrderedDict
+from gremlin_parser import parse_gremlin, to_gremlin, GremlinSyntaxError
+import json
+import os
+import re
+import threading
+import time
+
+CACHE_VERSION = 1
+
+class LRUCache:
+    def __init__(self, max_entries=1000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] < time.time():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # Live entries as [key, value, expires_at], least recently used first
+    def to_list(self):
+        now = time.time()
+        with self.lock:
+            return [[key, value, expires_at] for key, (value, expires_at) in self.entries.items()
+                    if expires_at is None or expires_at >= now]
+
+    def load_list(self, entries):
+        now = time.time()
+        with self.lock:
+            for key, value, expires_at in entries:
+                if expires_at is None or expires_at >= now:
+                    self.entries[key] = (value, expires_at)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+# Case, whitespace and trailing punctuation do not change the question,
+# quoted text (usually an identifier) keeps its case
+def normalize_question(question):
+    question = re.sub(r"\s+", " ", question.strip()).replace('"', "'")
+    parts = re.split(r"('[^']*')", question)
+    question = ''.join(part if part.startswith("'") else part.lower() for part in parts)
+    return re.sub(r"\s*[?.!]+$", "", question)
+
+# Canonical form of the query: parsed and written back, the text is only
+# collapsed if the query can not be parsed
+def normalize_query(query):
+    try:
+        return to_gremlin(parse_gremlin(query))
+    except GremlinSyntaxError:
+        return re.sub(r"\s+", " ", query.strip())
+
+class QueryCache:
+    def __init__(self, path=None, max_queries=1000, max_results=1000, ttl=3600):
+        self.path = path
+        self.queries = LRUCache(max_queries, ttl)
+        self.results = LRUCache(max_results, ttl)
+        self.graph_version = None
+
+        if path and os.path.exists(path):
+            self.load()
+
+    # Everything cached for another graph version is dropped. A graph without a
+    # version stamp can not be told apart from a changed one, nothing is cached for it.
+    def set_graph_version(self, graph_version):
+        if graph_version != self.graph_version:
+            self.queries.clear()
+            self.results.clear()
+            self.graph_version = graph_version
+
+    def get_query(self, question):
+        if self.graph_version is None:
+            return None
+        return self.queries.get(normalize_question(question))
+
+    def put_query(self, question, query):
+        if self.graph_version is not None:
+            self.queries.put(normalize_question(question), query)
+
+    # Used when a cached query turned out to be wrong (e.g. failed to execute)
+    def discard_query(self, question):
+        self.queries.discard(normalize_question(question))
+
+    # Returns (True, result) on a hit, (False, None) otherwise (None is a valid result)
+    def get_result(self, query):
+        if self.graph_version is None:
+            return False, None
+        entry = self.results.get(normalize_query(query))
+        if entry is None:
+            return False, None
+        return True, entry[0]
+
+    def put_result(self, query, result):
+        if self.graph_version is not None:
+            self.results.put(normalize_query(query), [result])
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"ERROR reading query cache {self.path}: {e}")
+            return
+        if data.get("version") != CACHE_VERSION:
+            return
+        self.graph_version = data["graph_version"]
+        self.queries.load_list(data["queries"])
+        self.results.load_list(data["results"])
+
+    def save(self):
+        if not self.path:
+            return
+        data = {
+            "version": CACHE_VERSION,
+            "graph_version": self.graph_version,
+            "queries": self.queries.to_list(),
+            "results": self.results.to_list(),
+        }
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            # Results which are not plain JSON (should not happen with GraphSON) are stored as text
+            json.dump(data, f, default=str)
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,455 @@
+#############################################
+# Cost guard of the LLM-generated Gremlin queries.
+# A generated query is parsed before it is run and
+# the number of vertices and edges it reads is
+# estimated from the label counts of the graph
+# catalog. Pathological shapes are rewritten:
+#   - hasId()/id filters at the start become V(ids),
+#     filters on indexed properties move to the front
+#   - substring/prefix/suffix filters at the start are
+#     resolved into V(ids) by the trigram index
+#   - repeat() without times()/until() gets a times()
+#   - valueMap(true)/elementMap() become a projection
+#     of the keys the query needs
+#   - a limit() is added to unbounded results
+# Queries which can not be parsed, modify the graph
+# or are estimated above the cost limit are rejected
+# with a reason which goes back to the query generator.
+#############################################
+
+from gremlin_parser import parse_gremlin, to_gremlin, Traversal, Step, Identifier, Predicate, GremlinSyntaxError
+from metrics import metrics
+
+# Vertices and edges a query may read, by the estimate
+DEFAULT_MAX_COST = 100000
+# Results a query returns at most, limit() is added to queries which could return more
+DEFAULT_RESULT_LIMIT = 1000
+# Loops of a repeat() without times()/until(), and the most loops a times() may ask for
+DEFAULT_REPEAT_TIMES = 5
+MAX_REPEAT_TIMES = 10
+
+# Properties the graph can look up without a scan, and the vertices one value is expected to match
+INDEXED_PROPERTIES = ('id', 'usr', 'spelling', 'qualified_name', 'overload_group', 'file')
+INDEXED_MATCHES = 10
+
+# Ids the trigram index may put into V(ids), filters matching more vertices are left to the graph
+DEFAULT_MAX_INDEX_IDS = 1000
+
+# Properties of a vertex shown in place of valueMap(true), next to the ones used by the query
+PROJECTED_PROPERTIES = ('qualified_name', 'file', 'line')
+
+MUTATING_STEPS = {'addV', 'addE', 'property', 'drop'}
+
+# Steps from vertices to their edges or neighbours
+ADJACENCY_STEPS = {'out', 'in', 'both', 'outE', 'inE', 'bothE'}
+
+# Steps which reduce all their input into one result
+REDUCING_STEPS = {'count', 'fold', 'sum', 'max', 'min', 'mean', 'group', 'groupCount', 'tree', 'cap', 'executionProfile'}
+
+# Steps which may produce more traversers than they get
+EXPANDING_STEPS = ADJACENCY_STEPS | {'V', 'E', 'bothV', 'unfold', 'union', 'repeat', 'flatMap', 'local', 'coalesce',
+                                     'optional', 'choose', 'values', 'properties', 'inject'}
+
+# Steps which bound the number of traversers
+LIMITING_STEPS = {'limit', 'range', 'tail', 'sample'}
+
+# Steps whose string arguments are property keys
+KEY_STEPS = {'values', 'properties', 'valueMap', 'elementMap', 'select', 'by', 'hasNot'}
+
+class QueryGuard:
+    # catalog is the GraphCatalog of the graph, without one the cost is not estimated (queries are still rewritten),
+    # trigram_index the TrigramIndex of the same graph version (or None)
+    def __init__(self, catalog=None, max_cost=DEFAULT_MAX_COST, result_limit=DEFAULT_RESULT_LIMIT, repeat_times=DEFAULT_REPEAT_TIMES,
+                 trigram_index=None, max_index_ids=DEFAULT_MAX_INDEX_IDS):
+        self.max_cost = max_cost
+        self.result_limit = result_limit
+        self.repeat_times = repeat_times
+        self.trigram_index = trigram_index
+        self.max_index_ids = max_index_ids
+
+        self.vertex_counts = None
+        if catalog is not None:
+            self.vertex_counts = catalog.get_vertex_counts()
+            self.edge_counts = dict(catalog.edge_labels)
+            self.total_vertices = sum(self.vertex_counts.values())
+            self.total_edges = sum(self.edge_counts.values())
+            # Vertices which can have an edge of the label
+            self.edge_sources = {}
+            for label, edge_labels in catalog.get_relationship_map().items():
+                for edge_label in edge_labels:
+                    self.edge_sources[edge_label] = self.edge_sources.get(edge_label, 0) + self.vertex_counts[label]
+
+    # Returns (query, None) with the query to run (possibly rewritten) or (None, reason) if it is rejected
+    def check(self, query):
+        try:
+            traversal = parse_gremlin(query)
+        except GremlinSyntaxError as e:
+            return self.reject("syntax", f"The query could not be parsed: {e}.")
+        if traversal.source != 'g':
+            return self.reject("syntax", "The query has to start with g.")
+
+        mutation = find_step(traversal, MUTATING_STEPS)
+        if mutation is not None:
+            return self.reject("mutation", f"The query modifies the graph with {mutation}(), only read queries are allowed.")
+
+        rewrites = []
+        if anchor_start(traversal):
+            rewrites.append("anchor")
+        if self.trigram_index is not None and anchor_on_trigram_index(traversal, self.trigram_index, self.max_index_ids):
+            rewrites.append("trigram_index")
+        if bound_repeats(traversal, self.repeat_times):
+            rewrites.append("repeat_times")
+        if project_value_maps(traversal, get_property_keys(traversal)):
+            rewrites.append("projection")
+        if not is_bounded(traversal.steps):
+            traversal.steps.append(Step('limit', [self.result_limit]))
+            rewrites.append("limit")
+
+        if self.vertex_counts is not None:
+            cost, _ = self.estimate_steps(traversal.steps, 1)
+            if cost > self.max_cost:
+                return self.reject("cost", f"The query would read about {int(cost):,} vertices and edges, at most {self.max_cost:,} are allowed. "
+                                           f"Start from hasLabel() together with has() on one of {', '.join(INDEXED_PROPERTIES[1:])} "
+                                           f"instead of scanning all vertices, and avoid unbounded traversals.")
+
+        for rewrite in rewrites:
+            metrics.increment("query_rewrites", rewrite=rewrite)
+        return to_gremlin(traversal), None
+
+    def reject(self, kind, reason):
+        metrics.increment("queries_rejected", reason=kind)
+        return None, reason
+
+    #############################################
+    # Cost estimate
+    #############################################
+
+    # (cost, count) of running the steps on count traversers: cost is the number of vertices and
+    # edges read, count the number of traversers produced. Filters are assumed to keep everything.
+    def estimate_steps(self, steps, count):
+        cost = 0.0
+        index = 0
+        folded = []
+        while index < len(steps):
+            step = steps[index]
+            name = step.name
+
+            if name in ('V', 'E'):
+                start_count, index = self.estimate_start(steps, index)
+                count *= start_count
+                cost += count
+                continue
+            index += 1
+
+            # Every traverser runs the nested traversals
+            nested = [self.estimate_steps(arg.steps, 1) for arg in step.args if isinstance(arg, Traversal)]
+            if name != 'repeat':
+                cost += count * sum(nested_cost for nested_cost, _ in nested)
+            nested_counts = [nested_count for _, nested_count in nested]
+
+            if name in ADJACENCY_STEPS:
+                count *= self.get_fan_out(get_strings(step.args), name)
+                cost += count
+            elif name == 'bothV':
+                count *= 2
+                cost += count
+            elif name == 'repeat':
+                body_cost, body_count = nested[0] if nested else (0.0, 1.0)
+                loops, emits = get_repeat_loops(steps, index - 1, self.repeat_times)
+                emitted = 0.0
+                for _ in range(loops):
+                    cost += count * body_cost
+                    count *= body_count
+                    emitted += count
+                if emits:
+                    count = emitted
+            elif name == 'union':
+                count *= sum(nested_counts)
+            elif name in ('coalesce', 'choose', 'local', 'flatMap'):
+                count *= max(nested_counts, default=1)
+            elif name == 'optional':
+                count *= max(nested_counts + [1])
+            elif name in ('values', 'properties'):
+                count *= max(1, len(get_strings(step.args)))
+            elif name == 'inject':
+                count *= len(step.args)
+            elif name in REDUCING_STEPS:
+                folded.append(count)
+                count = 1
+            elif name == 'unfold':
+                count = folded.pop() if folded else count
+            elif name in LIMITING_STEPS:
+                count = min(count, get_limit(step))
+        return cost, count
+
+    # (count, index after the start) of V()/E() and the filters the index can answer (or a limit right after the start)
+    def estimate_start(self, steps, index):
+        step = steps[index]
+        ids = get_ids(step.args)
+        if ids:
+            return len(ids), index + 1
+
+        is_vertex = step.name == 'V'
+        count = self.total_vertices if is_vertex else self.total_edges
+        label_counts = self.vertex_counts if is_vertex else self.edge_counts
+        index += 1
+        while index < len(steps) and steps[index].name in ('hasLabel', 'hasId', 'has', 'limit'):
+            filter_step = steps[index]
+            if filter_step.name == 'limit':
+                # Reading stops after the first vertices
+                count = min(count, get_limit(filter_step))
+                index += 1
+                break
+            if filter_step.name == 'hasLabel':
+                count = min(count, sum(label_counts.get(label, 0) for label in get_strings(filter_step.args)))
+            elif filter_step.name == 'hasId':
+                count = min(count, len(get_ids(filter_step.args)))
+            else:
+                label, key, values = get_has_filter(filter_step)
+                if label is not None:
+                    count = min(count, label_counts.get(label, 0))
+                if key in INDEXED_PROPERTIES and values:
+                    count = min(count, len(values) * (1 if key == 'id' else INDEXED_MATCHES))
+                elif key is not None:
+                    # Filters on other properties are checked on every candidate
+                    break
+            index += 1
+        return count, index
+
+    # Average number of edges (of the labels, all when none are given) of a vertex
+    def get_fan_out(self, edge_labels, step_name):
+        edge_labels = edge_labels or list(self.edge_counts)
+        fan_out = sum(self.edge_counts.get(label, 0) / max(1, self.edge_sources.get(label, 0)) for label in edge_labels)
+        return fan_out * 2 if step_name.startswith('both') else fan_out
+
+#############################################
+# Query shape helpers
+#############################################
+
+def get_strings(args):
+    strings = []
+    for arg in args:
+        if isinstance(arg, str):
+            strings.append(arg)
+        elif isinstance(arg, list):
+            strings.extend(get_strings(arg))
+        elif isinstance(arg, Predicate) and arg.name in ('eq', 'within'):
+            strings.extend(get_strings(arg.args))
+    return strings
+
+def get_ids(args):
+    return [arg for arg in args if not isinstance(arg, (Traversal, Identifier, Predicate))]
+
+# (label, key, values) of has(key), has(key, value) or has(label, key, value); values are the
+# values an equality (or within) filter looks up, empty for other predicates
+def get_has_filter(step):
+    args = step.args
+    label = args[0] if len(args) == 3 and isinstance(args[0], str) else None
+    key = args[-2] if len(args) >= 2 else (args[0] if args else None)
+    if isinstance(key, Identifier):
+        key = key.token
+    if not isinstance(key, str):
+        return label, None, []
+    if len(args) < 2:
+        return label, key, []
+    value = args[-1]
+    if isinstance(value, Predicate):
+        return label, key, get_strings([value]) if value.name in ('eq', 'within') else []
+    if isinstance(value, Traversal):
+        return label, key, []
+    return label, key, [value]
+
+def get_limit(step):
+    numbers = [arg for arg in step.args if isinstance(arg, (int, float)) and not isinstance(arg, bool)]
+    if step.name == 'tail' and not numbers:
+        return 1
+    if not numbers or any(isinstance(arg, Identifier) and arg.token == 'local' for arg in step.args):
+        return float('inf')
+    if step.name == 'range':
+        return numbers[-1] - numbers[0] if len(numbers) >= 2 and numbers[-1] >= 0 else float('inf')
+    return numbers[-1]
+
+# (loops, emits) of the repeat() at the index with the times()/until()/emit() around it
+def get_repeat_loops(steps, index, default_times):
+    modulators = get_repeat_modulators(steps, index)
+    emits = any(step.name == 'emit' for step in modulators)
+    for step in modulators:
+        if step.name == 'times' and step.args and isinstance(step.args[0], int):
+            return step.args[0], emits
+    return default_times, emits
+
+def get_repeat_modulators(steps, index):
+    modulators = []
+    position = index - 1
+    while position >= 0 and steps[position].name in ('until', 'emit'):
+        modulators.append(steps[position])
+        position -= 1
+    position = index + 1
+    while position < len(steps) and steps[position].name in ('times', 'until', 'emit'):
+        modulators.append(steps[position])
+        position += 1
+    return modulators
+
+def iterate_traversals(traversal):
+    yield traversal
+    for step in traversal.steps:
+        for arg in step.args:
+            if isinstance(arg, Traversal):
+                yield from iterate_traversals(arg)
+
+# Name of the first step (also in nested traversals) with one of the names, None if there is none
+def find_step(traversal, names):
+    for nested in iterate_traversals(traversal):
+        for step in nested.steps:
+            if step.name in names:
+                return step.name
+    return None
+
+# Property keys used anywhere in the query (filters, values, selections, ordering)
+def get_property_keys(traversal):
+    keys = []
+    step_labels = set()
+    for nested in iterate_traversals(traversal):
+        for step in nested.steps:
+            if step.name == 'as':
+                step_labels.update(get_strings(step.args))
+            elif step.name in ('has', 'hasNot'):
+                _, key, _ = get_has_filter(step)
+                keys.append(key)
+            elif step.name in KEY_STEPS:
+                keys.extend(get_strings(step.args))
+    return [key for key in dict.fromkeys(keys) if key and key not in step_labels and key not in ('id', 'label')]
+
+# True if the result of the steps is bounded: a limit or a reducing step after the last step which could expand it
+def is_bounded(steps):
+    for step in reversed(steps):
+        if step.name in LIMITING_STEPS and get_limit(step) != float('inf'):
+            return True
+        if step.name in REDUCING_STEPS:
+            return True
+        if step.name in EXPANDING_STEPS:
+            return False
+    return False
+
+#############################################
+# Rewrites
+#############################################
+
+# g.V().hasId(x) / has('id', x) -> g.V(x); filters on indexed properties are moved in front of the
+# other filters at the start, so the graph looks the candidates up instead of scanning a label
+def anchor_start(traversal):
+    steps = traversal.steps
+    if not steps or steps[0].name not in ('V', 'E'):
+        return False
+
+    end = 1
+    while end < len(steps) and steps[end].name in ('has', 'hasLabel', 'hasId'):
+        end += 1
+    filters = steps[1:end]
+    changed = False
+
+    if not steps[0].args:
+        for position, step in enumerate(filters):
+            if step.name == 'hasId':
+                ids = get_ids(step.args)
+            elif step.name == 'has' and len(step.args) == 2:
+                _, key, ids = get_has_filter(step)
+                ids = ids if key == 'id' else []
+            else:
+                continue
+            if ids:
+                steps[0] = Step(steps[0].name, ids)
+                del filters[position]
+                changed = True
+                break
+
+    def priority(step):
+        if step.name != 'has':
+            return 1
+        _, key, values = get_has_filter(step)
+        return 0 if key in INDEXED_PROPERTIES and values else 2
+
+    ordered = sorted(filters, key=priority)
+    if changed or [id(step) for step in ordered] != [id(step) for step in steps[1:end]]:
+        steps[1:end] = ordered
+        return True
+    return False
+
+# g.V().has(key, TextP.containing(text)) -> g.V(ids).has(key, TextP.containing(text)) with the ids of the
+# matching vertices from the trigram index (the filter stays, it is cheap on a few vertices)
+def anchor_on_trigram_index(traversal, trigram_index, max_ids):
+    steps = traversal.steps
+    if not steps or steps[0].name != 'V' or steps[0].args:
+        return False
+
+    ids = None
+    index = 1
+    while index < len(steps) and steps[index].name in ('has', 'hasLabel'):
+        step = steps[index]
+        index += 1
+        if step.name != 'has' or len(step.args) < 2:
+            continue
+        _, key, _ = get_has_filter(step)
+        predicate = step.args[-1]
+        if not isinstance(predicate, Predicate) or len(predicate.args) != 1 or not isinstance(predicate.args[0], str):
+            continue
+        found = trigram_index.find(key, predicate.name, predicate.args[0])
+        if found is not None:
+            ids = set(found) if ids is None else ids & set(found)
+
+    if ids is None or len(ids) > max_ids:
+        return False
+    if ids:
+        steps[0] = Step('V', sorted(ids))
+    else:
+        # No vertex matches, g.V() without ids would be every vertex
+        steps.insert(1, Step('limit', [0]))
+    return True
+
+# repeat() without times() or until() ends after repeat_times loops, times() asking for more is lowered
+def bound_repeats(traversal, repeat_times):
+    changed = False
+    for nested in iterate_traversals(traversal):
+        steps = nested.steps
+        index = 0
+        while index < len(steps):
+            if steps[index].name == 'repeat':
+                modulators = get_repeat_modulators(steps, index)
+                times = [step for step in modulators if step.name == 'times']
+                if times:
+                    args = times[0].args
+                    if args and isinstance(args[0], int) and args[0] > MAX_REPEAT_TIMES:
+                        args[0] = MAX_REPEAT_TIMES
+                        changed = True
+                elif not any(step.name == 'until' for step in modulators):
+                    # A times() next to until() would replace it, a repeat() with until() is only bounded by the limit
+                    steps.insert(index + 1, Step('times', [repeat_times]))
+                    changed = True
+            index += 1
+    return changed
+
+# valueMap()/valueMap(true)/elementMap() without keys -> project('id', 'label', keys...) of the needed keys
+def project_value_maps(traversal, needed_keys):
+    changed = False
+    for nested in iterate_traversals(traversal):
+        steps = nested.steps
+        for index, step in enumerate(steps):
+            if step.name not in ('valueMap', 'elementMap'):
+                continue
+            keys = get_strings(step.args)
+            with_tokens = step.name == 'elementMap' or any(arg is True for arg in step.args)
+            if step.name == 'valueMap' and keys and not with_tokens:
+                # Already a projection
+                continue
+            if not keys:
+                keys = list(dict.fromkeys(list(PROJECTED_PROPERTIES) + needed_keys))
+            steps[index:index + 1] = build_projection(keys)
+            changed = True
+    return changed
+
+# Multi-valued like valueMap(): every key maps to the list of its values (empty when the property is missing)
+def build_projection(keys):
+    projection = [Step('project', ['id', 'label'] + keys), Step('by', [Identifier('id')]), Step('by', [Identifier('label')])]
+    for key in keys:
+        projection.append(Step('by', [Traversal('__', [Step('values', [key]), Step('fold', [])])]))
+    return projection
@@ -0,0 +1,164 @@
+#############################################
+# Shapes Gremlin query results for the advisor LLM.
+# Results are read chunk by chunk from the result set
+# and turned into compact tables: the keys of a row
+# shape are written once as the table header, equal
+# rows are merged. Rows are only added while they fit
+# into the token budget, the rest is only counted and
+# summarized (row counts and the largest groups).
+#############################################
+
+import json
+
+# Rough number of characters per token of the LLM tokenizer
+CHARACTERS_PER_TOKEN = 4
+
+# Columns used to summarize the rows which did not fit into the budget
+GROUP_COLUMNS = ('label', 'kind', 'type')
+
+def estimate_tokens(text):
+    return len(text) // CHARACTERS_PER_TOKEN + 1
+
+# Single values of valueMap() come as one-element lists
+def unwrap(value):
+    if isinstance(value, list) and len(value) == 1:
+        return value[0]
+    return value
+
+# One result item as {column: value}
+def flatten_result(item):
+    if not isinstance(item, dict):
+        return {'value': item}
+
+    # Vertices and edges in GraphSON form
+    if item.get('type') in ('vertex', 'edge') and 'id' in item:
+        row = {'id': item['id'], 'label': item.get('label')}
+        if item['type'] == 'edge':
+            row['outV'] = item.get('outV')
+            row['inV'] = item.get('inV')
+        for key, value in (item.get('properties') or {}).items():
+            if isinstance(value, list):
+                value = [v.get('value') if isinstance(v, dict) else v for v in value]
+            row[key] = unwrap(value.get('value') if isinstance(value, dict) and 'value' in value else value)
+        return row
+
+    return {str(key): unwrap(value) for key, value in item.items()}
+
+def format_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, separators=(',', ':'), default=str)
+    return str(value).replace('\n', ' ').replace('|', '\\|')
+
+class ResultTable:
+    def __init__(self, columns):
+        self.columns = columns
+        self.rows = {}
+
+    def header(self):
+        return ' | '.join(self.columns)
+
+class ResultShaper:
+    def __init__(self, token_budget=4000, scan_limit=100000):
+        self.token_budget = token_budget
+        self.scan_limit = scan_limit
+        self.tables = {}
+        self.tokens = 0
+        self.rows_seen = 0
+        self.rows_included = 0
+        self.duplicate_rows = 0
+        self.omitted_groups = {}
+        self.budget_exhausted = False
+        self.scan_stopped = False
+
+    # False once nothing more should be read (the rows are then only summarized as far as they were counted)
+    def add(self, item):
+        if self.rows_seen >= self.scan_limit:
+            self.scan_stopped = True
+            return False
+        self.rows_seen += 1
+
+        row = flatten_result(item)
+        columns = tuple(row.keys())
+        cells = tuple(format_cell(value) for value in row.values())
+
+        table = self.tables.get(columns)
+        if table is not None and cells in table.rows:
+            table.rows[cells] += 1
+            self.duplicate_rows += 1
+            return True
+
+        if not self.budget_exhausted:
+            cost = estimate_tokens(' | '.join(cells))
+            if table is None:
+                cost += estimate_tokens(' | '.join(columns)) + 8
+            if self.tokens + cost <= self.token_budget:
+                if table is None:
+                    table = ResultTable(columns)
+                    self.tables[columns] = table
+                table.rows[cells] = 1
+                self.tokens += cost
+                self.rows_included += 1
+                return True
+            self.budget_exhausted = True
+
+        group = next((str(row[column]) for column in GROUP_COLUMNS if row.get(column) is not None), ', '.join(columns))
+        self.omitted_groups[group] = self.omitted_groups.get(group, 0) + 1
+        return True
+
+    def add_chunk(self, chunk):
+        for item in chunk:
+            if not self.add(item):
+                return False
+        return True
+
+    def is_truncated(self):
+        return self.budget_exhausted or self.scan_stopped
+
+    def summary(self):
+        if not self.is_truncated():
+            return ""
+        omitted = self.rows_seen - self.rows_included - self.duplicate_rows
+        summary = f"Result truncated to fit {self.token_budget} tokens: {self.rows_included} of {self.rows_seen}"
+        summary += " read rows are listed" if self.scan_stopped else " rows are listed"
+        if self.scan_stopped:
+            summary += f", reading stopped after {self.scan_limit} rows (the query returns more)"
+        if omitted:
+            top_groups = sorted(self.omitted_groups.items(), key=lambda group: -group[1])[:10]
+            summary += f". Omitted rows ({omitted}) by group: " + ', '.join(f"{group}: {count}" for group, count in top_groups)
+            if len(self.omitted_groups) > len(top_groups):
+                summary += f", ... ({len(self.omitted_groups) - len(top_groups)} more groups)"
+        return summary + "."
+
+    def to_text(self):
+        if self.rows_seen == 0:
+            return "The query returned no results."
+
+        lines = []
+        for number, table in enumerate(self.tables.values(), 1):
+            if len(self.tables) > 1:
+                lines.append(f"Table {number}:")
+            lines.append(table.header())
+            for cells, count in table.rows.items():
+                line = ' | '.join(cells)
+                lines.append(f"{line} (x{count})" if count > 1 else line)
+        if self.duplicate_rows:
+            lines.append(f"({self.duplicate_rows} duplicate rows merged, (xN) is the number of occurrences)")
+        summary = self.summary()
+        if summary:
+            lines.append(summary)
+        return '\n'.join(lines)
+
+# Compact text of the results given as an iterable of chunks (lists of result items).
+# Reading stops at the scan limit, so a huge result is never materialized as a whole.
+def shape_result_chunks(chunks, token_budget=4000, scan_limit=100000):
+    shaper = ResultShaper(token_budget, scan_limit)
+    for chunk in chunks:
+        if not shaper.add_chunk(chunk):
+            break
+    return shaper.to_text()
+
+# Streams a gremlin_python ResultSet (or anything iterable in chunks the same way)
+def shape_result_set(result_set, token_budget=4000, scan_limit=100000):
+    return shape_result_chunks(result_set, token_budget, scan_limit)
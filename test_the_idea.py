@@ -4,8 +4,18 @@
 #############################################
 
 import openai
-from gremlin_python.driver import client, serializer
+from graph_backend import create_gremlin_client
 from dotenv import load_dotenv
+from graph_metadata import get_graph_metadata, get_graph_version, GRAPH_METADATA_LABEL
+from query_cache import QueryCache
+from result_shaping import shape_result_set, shape_result_chunks
+from qa_prompts import build_gremlin_query_system_message, build_query_generation_user_message, build_query_rejection_user_message, clean_generated_query, code_advisor_system_message, build_code_advisor_user_message
+from query_guard import QueryGuard
+from trigram_index import load_trigram_index
+from vector_index import load_vector_index
+from conversation_session import ConversationSession
+from metrics import metrics, start_profiling, stop_profiling
+import json
 import os
 
 load_dotenv()
@@ -16,30 +26,71 @@ openai.base_url = "https://cpp-codebase-rag.openai.azure.com/openai/"
 openai.api_version = "2024-08-01-preview"
 
 # Gremlin DB connection setup
-gremlin_client = client.Client('wss://cpp-codebase-playground.gremlin.cosmos.azure.com:443/', 'g',
-                               username="/dbs/codebase/colls/codebase-graph",
-                               password=os.getenv("COSMOS_DB_PRIMARY_KEY"),
-                               message_serializer=serializer.GraphSONSerializersV2d0())
+gremlin_client = create_gremlin_client('wss://cpp-codebase-playground.gremlin.cosmos.azure.com:443/',
+                                       "/dbs/codebase/colls/codebase-graph")
+
+# Schema of the graph (and the system message built from it) is cached on disk per graph version
+schema_cache_path = ".cpprag_cache/schema.json"
+
+# Generated queries and their results are cached per graph version (LRU with time to live, set the path to None to keep it in memory only)
+query_cache_path = ".cpprag_cache/queries.json"
+query_cache_size = 1000
+query_cache_ttl = 24 * 3600
+query_cache = QueryCache(query_cache_path, max_queries=query_cache_size, max_results=query_cache_size, ttl=query_cache_ttl)
+
+# Query results reach the advisor as compact tables of at most this many tokens (plus a summary of the rest)
+result_token_budget = 4000
+# Rows read at most from one result, the rest of a huge result is not even counted
+result_scan_limit = 100000
+
+# Generated queries are checked before they run: queries estimated to read more vertices and edges
+# than this are sent back to the generator (at most max_query_attempts generations per question),
+# unbounded results are limited to query_result_limit rows
+query_max_cost = 100000
+query_result_limit = 1000
+max_query_attempts = 3
+# Trigram index written by the ingester (its trigram_index_path), substring searches are resolved into vertex ids with it
+trigram_index_path = None # e.g. ".cpprag_cache/trigrams.idx"
+# Vector index written by the ingester (its vector_index_path): the declarations whose signature or doc comment
+# is most similar to the question (at most vector_candidates with a score of vector_min_score) are offered
+# to the query generator as starting points
+vector_index_path = None # e.g. ".cpprag_cache/vectors.idx"
+vector_candidates = 10
+vector_min_score = 0.1
+
+# Vertices kept in the working subgraph of the conversation, follow-up questions on earlier
+# results run against it and only fetch the vertices and edges it does not hold yet
+session_max_vertices = 5000
+
+# Phase timings and Gremlin/OpenAI latencies of the run as a JSON summary and/or a Prometheus textfile
+metrics_summary_path = None # e.g. ".cpprag_metrics/qa.json"
+metrics_textfile_path = None
+# Profile the run with cProfile into this file
+profile_path = None # e.g. "qa.prof"
+
+# Runs a query to the end, its latency is recorded by kind
+def submit_query(query, kind, bindings=None):
+    with metrics.measure("gremlin_request", kind=kind):
+        return gremlin_client.submit(query, bindings).all().result()
 
 def get_vertex_labels():
     query = "g.V().label().dedup()"
-    return gremlin_client.submit(query).all().result()
+    return [label for label in submit_query(query, "schema") if label != GRAPH_METADATA_LABEL]
 
 def get_edge_labels_for_vertex(label):
     query = f"g.V().hasLabel('{label}').outE().label().dedup()"
-    return gremlin_client.submit(query).all().result()
+    return submit_query(query, "schema")
 
 def get_properties_for_vertex(label):
     query = f"g.V().hasLabel('{label}').valueMap(true).limit(1)"
-    result = gremlin_client.submit(query).all().result()
+    result = submit_query(query, "schema")
     
     if result:
         # Extract property keys from the value map
         return list(result[0].keys())
     return []
 
-def build_relationship_map():
-    vertex_labels = get_vertex_labels()
+def build_relationship_map(vertex_labels):
     relationship_map = {}
     
     for label in vertex_labels:
@@ -48,8 +99,7 @@ def build_relationship_map():
     
     return relationship_map
 
-def build_property_map():
-    vertex_labels = get_vertex_labels()
+def build_property_map(vertex_labels):
     property_map = {}
     
     for label in vertex_labels:
@@ -58,126 +108,242 @@ def build_property_map():
     
     return property_map
 
-def build_gremlin_query_system_message():
-    relationship_map = build_relationship_map()
-    property_map = build_property_map()
-    
-    # Base system message
-    system_message = """
-        You are an expert in Azure Cosmos DB Gremlin query syntax. 
-        Your task is to strictly generate an efficient Gremlin query to help with the user prompt.
-        You are not to generate explanations or any other responses.
-        Your response will be used by another LLM to answer the user prompt, you only generate query to extract additional info for the main LLM. 
-        You have access to a graph database that represents a C++ codebase. 
-        The database consists of the following vertex types and their associated edge types:
-        """
-
-    # Add the relationship map and property map to the system message
-    for label in relationship_map.keys():
-        system_message += f"\n- `{label}` vertices can have the following edges: {', '.join(relationship_map[label])}"
-        system_message += f"\n  `{label}` vertices have the following properties: {', '.join(property_map[label])}"
-    
-    # Specify that the response should be an exact Gremlin query
-    system_message += """    
-        Important Notes:
-        - Your response should be an exact Gremlin query and nothing else.
-        - The query should extract as little data as possible, do not extract all vertices or edges properties but only relevant ones, group them with their unique identifiers (id)
-        - Allowed Gremlin Steps:
-            and, as, by, coalesce, constant
-            count, dedup, drop, executionProfile, fold
-            group, has, inject, is
-            limit, local, not, optional, or, order
-            path, project, properties, range
-            repeat, sample, select, store
-            TextP.startingWith(string), TextP.endingWith(string), TextP.containing(string), TextP.notStartingWith(string), TextP.notEndingWith(string), TextP.notContaining(string)
-            tree, unfold, union
-            V, E, out, in, both, outE, inE, bothE, outV, inV, bothV, otherV
-            where  
-        """
-    return system_message
-
-def generate_gremlin_query(user_request):
+cached_system_message = None
+cached_graph_version = None
+
+def load_cached_system_message(graph_version):
+    try:
+        with open(schema_cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cache.get("graph_version") != graph_version:
+        return None
+    return cache["system_message"]
+
+def save_cached_system_message(graph_version, relationship_map, property_map, system_message):
+    os.makedirs(os.path.dirname(schema_cache_path) or '.', exist_ok=True)
+    with open(schema_cache_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "graph_version": graph_version,
+            "relationship_map": relationship_map,
+            "property_map": property_map,
+            "system_message": system_message
+        }, f)
+
+# System message with the graph schema, the schema is only read again when the
+# ingester published a new graph version (a graph without version stamp is never cached).
+# The schema comes from the catalog stored by the ingester, label scans are the fallback.
+# Returns the system message and the graph metadata (version and catalog).
+def get_gremlin_query_system_message():
+    global cached_system_message, cached_graph_version
+
+    with metrics.measure("gremlin_request", kind="metadata"):
+        metadata = get_graph_metadata(gremlin_client)
+    graph_version = metadata["version"]
+    if graph_version is not None:
+        if cached_system_message is not None and cached_graph_version == graph_version:
+            return cached_system_message, metadata
+
+        system_message = load_cached_system_message(graph_version)
+        if system_message is not None:
+            cached_system_message, cached_graph_version = system_message, graph_version
+            return system_message, metadata
+
+    catalog = metadata["catalog"]
+    if catalog is not None:
+        relationship_map = catalog.get_relationship_map()
+        property_map = catalog.get_property_map()
+        vertex_counts = catalog.get_vertex_counts()
+    else:
+        vertex_labels = get_vertex_labels()
+        relationship_map = build_relationship_map(vertex_labels)
+        property_map = build_property_map(vertex_labels)
+        vertex_counts = None
+    system_message = build_gremlin_query_system_message(relationship_map, property_map, vertex_counts)
+
+    if graph_version is not None:
+        save_cached_system_message(graph_version, relationship_map, property_map, system_message)
+        cached_system_message, cached_graph_version = system_message, graph_version
+    return system_message, metadata
+
+cached_trigram_index = None
+
+# Trigram index of the graph version (None if there is none), opened once per version
+def get_trigram_index(graph_version):
+    global cached_trigram_index
+
+    if cached_trigram_index is None or cached_trigram_index.graph_version != graph_version:
+        if cached_trigram_index is not None:
+            cached_trigram_index.close()
+        cached_trigram_index = load_trigram_index(trigram_index_path, graph_version)
+    return cached_trigram_index
+
+cached_vector_index = None
+
+# Vector index of the graph version (None if there is none), opened once per version
+def get_vector_index(graph_version):
+    global cached_vector_index
+
+    if cached_vector_index is None or cached_vector_index.graph_version != graph_version:
+        if cached_vector_index is not None:
+            cached_vector_index.close()
+        cached_vector_index = load_vector_index(vector_index_path, graph_version)
+    return cached_vector_index
+
+# Declarations similar to the question, the query can start from them by id
+def get_candidates(user_request, graph_version):
+    vector_index = get_vector_index(graph_version)
+    if vector_index is None:
+        return []
+    with metrics.measure("vector_search"):
+        return vector_index.search([user_request], vector_candidates, vector_min_score)[0]
+
+# Generated query after the cost guard, None if every generated query was rejected.
+# Follow-up questions depend on the earlier turns of the session, they are not cached.
+def generate_gremlin_query(user_request, session):
+    conversation = session.get_conversation()
+    if not conversation:
+        # The same question was already answered for this graph version
+        cached_query = query_cache.get_query(user_request)
+        metrics.increment("query_cache_lookups", level="query", result="miss" if cached_query is None else "hit")
+        if cached_query is not None:
+            return cached_query
+
     # Get the enriched system message with metadata from the database
-    system_message = build_gremlin_query_system_message()
+    with metrics.time("schema_fetch"):
+        system_message, metadata = get_gremlin_query_system_message()
+    query_guard = QueryGuard(metadata["catalog"], query_max_cost, query_result_limit,
+                             trigram_index=get_trigram_index(metadata["version"]))
     
     # Prepare the user message (the specific query request)
-    user_message = f"Generate a Gremlin query to help with the {user_request}"
-
-    # Interact with the LLM to generate the query
-    response = openai.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": user_message},
-        ],
-        max_tokens=1000,
-        temperature=0.2
-    )
-    
-    # Extract the generated Gremlin query from the response
-    query = response.choices[0].message.content
-    cleaned_query = query.replace("```gremlin", "").replace("```", "").strip()
-    return cleaned_query
+    candidates = get_candidates(user_request, metadata["version"])
+    user_message = build_query_generation_user_message(user_request, conversation, candidates)
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_message},
+    ]
+
+    for _ in range(max_query_attempts):
+        # Interact with the LLM to generate the query
+        with metrics.measure("openai_request", purpose="query_generation"):
+            response = openai.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                max_tokens=1000,
+                temperature=0.2
+            )
+        
+        # Extract the generated Gremlin query from the response
+        cleaned_query = clean_generated_query(response.choices[0].message.content)
+
+        # Runaway queries are rewritten or go back to the LLM with the reason,
+        # handles of earlier turns are replaced by the ids of their vertices first
+        guarded_query, reason = query_guard.check(session.resolve_handles(cleaned_query))
+        if guarded_query is not None:
+            if not conversation:
+                query_cache.put_query(user_request, guarded_query)
+            return guarded_query
+
+        print(f"Generated query was rejected: {reason}")
+        messages.append({"role": "assistant", "content": cleaned_query})
+        messages.append({"role": "user", "content": build_query_rejection_user_message(user_request, reason)})
+    return None
+
+# Queries starting from vertices of the session run against its working subgraph
+def execute_gremlin_query(query, session):
+    local_result = session.run_locally(query)
+    if local_result is not None:
+        return shape_result_chunks(session.record_results(query, [local_result]), result_token_budget, result_scan_limit)
+
+    is_cached, result = query_cache.get_result(query)
+    metrics.increment("query_cache_lookups", level="result", result="hit" if is_cached else "miss")
+    if is_cached:
+        return result
 
-def execute_gremlin_query(query):
     try:
-        result = gremlin_client.submit(query).all().result()
+        # The result is streamed chunk by chunk into its shaped form, it is never held as a whole
+        with metrics.measure("gremlin_request", kind="query"):
+            result = shape_result_set(session.record_results(query, gremlin_client.submit(query)),
+                                      result_token_budget, result_scan_limit)
+        query_cache.put_result(query, result)
         return result
     except Exception as e:
         print(f"Error executing query: {e}")
         return None
 
-def generate_code_advisor_response(user_question, query_result):
-    system_message = """
-        You are an expert codebase advisor. Your task is to help answer technical questions about the codebase.
-        The information you provide should be based on the data retrieved from the database in response to the user's query.
-        
-        Always tailor your response to the specific user question and the data provided.
-        
-        Guidelines for your response:
-        - Make sure your answer directly addresses the user's question.
-        - Use the database data to provide a precise and concise answer.
-        - If appropriate, list relevant information (such as classes, methods, or properties) in a simple and easy-parseable format.
-        - Do not add unnecessary details. Focus on answering the question clearly and succinctly.
-        - Your answer should be structured in a way that the user can easily understand and use.
-        """
-    
-    # Combine the user question and query result for the context
-    query_summary = f"User's question: {user_question}\nData retrieved from the database: {query_result}"
+def generate_code_advisor_response(user_question, query_result, session):
+    # Combine the user question, the earlier turns and the query result for the context
+    query_summary = build_code_advisor_user_message(user_question, query_result, session.get_conversation())
     
     # Send the message to the OpenAI model to generate the answer
-    response = openai.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": query_summary},
-        ],
-        max_tokens=2000,
-        temperature=0.2
-    )
+    with metrics.measure("openai_request", purpose="answer_generation"):
+        response = openai.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": code_advisor_system_message},
+                {"role": "user", "content": query_summary},
+            ],
+            max_tokens=2000,
+            temperature=0.2
+        )
     
     return response.choices[0].message.content
 
-def main():
-    user_request = "what namespaces exist in this package?"
-    user_request = "what classes have 'exception' substring in their identifiers ?"
-    user_request = "what classes inherit exception?"
-    user_request = 'list all functions (including template) in namespace detail'
-    user_request = "list me all functions (including template) to_json overloads and list of their parameters"
+# Answers one question of the conversation, False if it failed
+def answer_question(user_request, session):
+    # Cached queries and results of an older graph version are dropped here
+    with metrics.measure("gremlin_request", kind="metadata"):
+        graph_version = get_graph_version(gremlin_client)
+    query_cache.set_graph_version(graph_version)
+    session.set_graph_version(graph_version)
 
-    gremlin_query = generate_gremlin_query(user_request)
+    with metrics.time("query_generation"):
+        gremlin_query = generate_gremlin_query(user_request, session)
+    if gremlin_query is None:
+        print("Query generation failed.")
+        return False
     print(f"\nGenerated Gremlin Query:\n {gremlin_query}")
 
-    query_result = execute_gremlin_query(gremlin_query)
+    with metrics.time("query_execution"):
+        query_result = execute_gremlin_query(gremlin_query, session)
     if query_result is None:
         print("Query execution failed.")
-        return
+        query_cache.discard_query(user_request)
+        return False
     
     print(f"\nQuery result is:\n{query_result}")
 
-    final_answer = generate_code_advisor_response(user_request, query_result)
+    with metrics.time("answer_generation"):
+        final_answer = generate_code_advisor_response(user_request, query_result, session)
     print(f"\nCode Advisor Answer:\n {final_answer}")
 
+    session.add_turn(user_request, gremlin_query, final_answer)
+    return True
+
+def main():
+    user_request = "what namespaces exist in this package?"
+    user_request = "what classes have 'exception' substring in their identifiers ?"
+    user_request = "what classes inherit exception?"
+    user_request = 'list all functions (including template) in namespace detail'
+    user_request = "list me all functions (including template) to_json overloads and list of their parameters"
+
+    profiler = start_profiling(profile_path)
+    session = ConversationSession(gremlin_client, session_max_vertices, query_result_limit)
+
+    # Follow-up questions are read until an empty line (or the end of the input)
+    while answer_question(user_request, session):
+        try:
+            user_request = input("\nFollow-up question (empty line to quit): ").strip()
+        except EOFError:
+            break
+        if not user_request:
+            break
+
+    query_cache.save()
+    metrics.export(metrics_summary_path, metrics_textfile_path)
+    stop_profiling(profiler, profile_path)
+
 if __name__ == "__main__":
     main()
     gremlin_client.close()
\ No newline at end of file
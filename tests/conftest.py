@@ -0,0 +1,36 @@
+#############################################
+# Tests run with pytest from the repository root:
+#   python -m pytest -q
+# The modules are flat scripts in the root folder.
+# Ingestion tests need libclang (LIBCLANG_PATH, an
+# empty path lets clang.cindex search for it), they
+# are skipped when it cannot be loaded.
+#############################################
+
+import os
+import pytest
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The ingester module, once libclang could be loaded
+@pytest.fixture(scope="session")
+def ingester():
+    pytest.importorskip("clang.cindex")
+    import clang.cindex
+    import process_cl_file_to_db
+    try:
+        clang.cindex.Index.create()
+    except Exception as e:
+        pytest.skip(f"libclang is not available: {e}")
+    return process_cl_file_to_db
+
+# Compilation database of the synthetic benchmark corpus
+@pytest.fixture(scope="session")
+def translation_units(ingester, tmp_path_factory):
+    import benchmark
+    from compile_commands import load_compile_commands
+    directory = str(tmp_path_factory.mktemp("corpus"))
+    compile_commands_path = benchmark.generate_corpus(directory, namespaces=2, classes=6, methods=3, overloads=2,
+                                                      templates=1, inheritance_depth=3, translation_units=4)
+    return load_compile_commands(compile_commands_path)
@@ -0,0 +1,29 @@
+#############################################
+# The benchmark runs the ingester's own entry
+# points and reports what the graph holds.
+#############################################
+
+import pytest
+
+def run_ingest(tmp_path, workers):
+    import benchmark
+    from memory_graph import MemoryGraph
+    compile_commands_path = benchmark.generate_corpus(str(tmp_path / "corpus"), namespaces=2, classes=4, methods=2, overloads=2,
+                                                      templates=1, inheritance_depth=2, translation_units=3)
+    graph = MemoryGraph()
+    report = benchmark.run_ingest_benchmark(compile_commands_path, benchmark.CountingGremlinClient(graph),
+                                            trigram_index_path=str(tmp_path / "trigrams.idx"), workers=workers)
+    return graph, report
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_report_counts_what_was_ingested(ingester, tmp_path, workers):
+    from graph_metadata import GRAPH_METADATA_LABEL
+    process_cursor_as_vertex = ingester.process_cursor_as_vertex
+    graph, report = run_ingest(tmp_path, workers)
+
+    assert ingester.process_cursor_as_vertex is process_cursor_as_vertex
+    assert report["workers"] == workers and report["failed_batches"] == 0
+    assert report["vertices"] == sum(1 for vertex in graph.vertices.values() if vertex.label != GRAPH_METADATA_LABEL)
+    assert report["edges"] == len(graph.edges)
+    assert report["cursors"] > report["vertices"] > 0
+    assert report["round_trips"] > 0
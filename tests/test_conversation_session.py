@@ -0,0 +1,94 @@
+#############################################
+# Conversation sessions: follow-up queries run on
+# the working subgraph with only the missing parts
+# fetched from the graph, turn handles stand for
+# the result vertices of earlier questions.
+#############################################
+
+from conversation_session import ConversationSession
+from memory_graph import MemoryGraph
+
+# Graph of the database, records the queries it answers
+class RemoteGraph(MemoryGraph):
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def execute(self, query, bindings=None):
+        self.queries.append(query)
+        return super().execute(query, bindings)
+
+def create_remote_graph():
+    graph = RemoteGraph()
+    for name in ("Base", "Middle", "Leaf", "Other"):
+        graph.add_vertex("CLASS_DECL", {"id": name.lower(), "spelling": name, "qualified_name": f"ns::{name}"})
+    graph.add_vertex("FIELD_DECL", {"id": "count", "spelling": "count"})
+    graph.add_edge("middle", "inherits_from", "base")
+    graph.add_edge("leaf", "inherits_from", "middle")
+    graph.add_edge("base", "contains_field", "count")
+    return graph
+
+def answer(session, question, query, results):
+    list(session.record_results(query, [results]))
+    session.add_turn(question, query, f"answer to {question}")
+
+def test_follow_up_runs_on_the_working_subgraph():
+    remote = create_remote_graph()
+    session = ConversationSession(remote)
+    query = "g.V('leaf').out('inherits_from').out('inherits_from').values('spelling')"
+    assert session.run_locally(query) == remote.execute(query) == ["Base"]
+
+    # Everything it needs is held now, the same query fetches nothing
+    remote.queries.clear()
+    assert session.run_locally(query) == ["Base"]
+    assert remote.queries == []
+
+    # Another edge label of a held vertex is fetched, the vertices are not
+    assert session.run_locally("g.V('base').out('contains_field').values('spelling')") == ["count"]
+    assert len(remote.queries) == 2
+    assert "outE('contains_field')" in remote.queries[0]
+
+def test_queries_over_the_whole_graph_run_remotely():
+    session = ConversationSession(create_remote_graph())
+    assert session.run_locally("g.V().hasLabel('CLASS_DECL').count()") is None
+    assert session.run_locally("g.V('leaf').repeat(out('inherits_from')).emit().values('spelling')") is None
+    assert session.run_locally("g.V(") is None
+    assert session.graph.vertices == {}
+
+def test_handles_stand_for_the_result_vertices_of_a_turn():
+    remote = create_remote_graph()
+    session = ConversationSession(remote)
+    query = "g.V().hasLabel('CLASS_DECL').has('spelling', TextP.startingWith('M'))"
+    answer(session, "Which classes start with M?", query, remote.execute(query))
+    assert session.resolve_handles("g.V(turn1).in('inherits_from')") == "g.V('middle').in('inherits_from')"
+    assert session.get_conversation() == [{"handle": "turn1", "question": "Which classes start with M?",
+                                           "answer": "answer to Which classes start with M?",
+                                           "vertex_count": 1, "names": ["ns::Middle"]}]
+
+    # A result without vertices is traced back to them by the vertex part of its query
+    query = "g.V().hasLabel('CLASS_DECL').has('spelling', TextP.startingWith('L')).values('spelling')"
+    answer(session, "Which classes start with L?", query, remote.execute(query))
+    assert session.get_conversation()[-1]["vertex_count"] is None
+    assert session.resolve_handles("g.V(turn2, turn1)") == "g.V('leaf', 'middle')"
+
+    # Unknown handles and queries without handles stay as they are
+    assert session.resolve_handles("g.V(turn9)") == "g.V(turn9)"
+    assert session.resolve_handles("g.V('base')") == "g.V('base')"
+
+def test_working_subgraph_is_bounded_and_kept_per_graph_version():
+    remote = create_remote_graph()
+    session = ConversationSession(remote, max_vertices=2)
+    session.set_graph_version("v1")
+    assert session.run_locally("g.V('leaf').out('inherits_from').values('spelling')") == ["Middle"]
+    assert session.run_locally("g.V('base').values('spelling')") == ["Base"]
+    answer(session, "Base?", "g.V('base')", [])
+    # The least recently used vertex is evicted, with the neighbourhoods which held its edges
+    assert sorted(session.graph.vertices) == ["base", "middle"]
+    assert session.graph.neighbourhoods == {}
+
+    remote.queries.clear()
+    assert session.run_locally("g.V('leaf').out('inherits_from').values('spelling')") == ["Middle"]
+    assert remote.queries
+
+    session.set_graph_version("v2")
+    assert session.graph.vertices == {}
@@ -0,0 +1,76 @@
+#############################################
+# Interned vertex ids and the memoized identity
+# of cursors: every cursor id is computed once per
+# translation unit, records carry id numbers until
+# they reach the writer.
+#############################################
+
+from graph_records import GraphRecordCollector
+from test_header_ownership import ingest
+
+def test_id_table_interns_and_materializes():
+    from cursor_identity import IdTable
+    table = IdTable()
+    assert table.intern("c:@S@A") == 0
+    assert table.intern("c:@S@B") == 1
+    assert table.intern("c:@S@A") == 0
+    assert table.get_string(1) == "c:@S@B"
+
+    vertices, edges = table.materialize_records([("CLASS_DECL", {"id": 1, "spelling": "B"})], [(1, "inherits_from", 0, {})])
+    assert vertices == [("CLASS_DECL", {"id": "c:@S@B", "spelling": "B"})]
+    assert edges == [("c:@S@B", "inherits_from", "c:@S@A", {})]
+
+    table.clear()
+    assert table.intern("c:@S@B") == 0
+
+def test_interned_id_writer_passes_id_strings():
+    from cursor_identity import IdTable, InternedIdWriter
+    table = IdTable()
+    collector = GraphRecordCollector()
+    writer = InternedIdWriter(collector, table)
+    writer.add_vertex("CLASS_DECL", {"id": table.intern("c:@S@A")})
+    writer.add_edge(table.intern("c:@S@B"), "inherits_from", table.intern("c:@S@A"), {"access": "public"})
+    assert collector.vertices == [("CLASS_DECL", {"id": "c:@S@A"})]
+    assert collector.edges == [("c:@S@B", "inherits_from", "c:@S@A", {"access": "public"})]
+
+def test_cursor_id_is_computed_once_per_cursor(ingester, tmp_path):
+    import clang.cindex
+    from cursor_identity import IdTable, CursorIdentity
+    (tmp_path / "a.hpp").write_text("#pragma once\nclass A { public: int x; };\n")
+    (tmp_path / "main.cpp").write_text('#include "a.hpp"\nint main() { A a; A b; return a.x + b.x; }\n')
+    tu = clang.cindex.Index.create().parse(str(tmp_path / "main.cpp"), args=['-x', 'c++'])
+
+    computed = []
+    def compute_id(cursor):
+        computed.append(cursor.spelling)
+        return ingester.get_id(cursor)
+    file_ids = []
+    def compute_file_id(file_name):
+        file_ids.append(file_name)
+        return ingester.get_file_id(file_name)
+    table = IdTable()
+    identity = CursorIdentity(table, compute_id, compute_file_id)
+
+    class_a = next(cursor for cursor in tu.cursor.get_children() if cursor.spelling == "A")
+    references = [cursor.referenced for cursor in tu.cursor.walk_preorder()
+                  if cursor.kind == clang.cindex.CursorKind.TYPE_REF and cursor.spelling == "class A"]
+    assert len(references) == 2
+
+    number = identity.get_id_number(class_a)
+    assert table.get_string(number) == ingester.get_id(class_a)
+    assert [identity.get_id_number(cursor) for cursor in references] == [number, number]
+    assert computed == ["A"]
+
+    # Cursors without id get no number, and are not asked again
+    assert identity.get_id_number(tu.cursor) is None
+    assert identity.get_id_number(tu.cursor) is None
+    assert computed == ["A", tu.cursor.spelling]
+
+    assert identity.get_file_id("a.hpp") == identity.get_file_id("a.hpp") == ingester.get_file_id("a.hpp")
+    assert file_ids == ["a.hpp"]
+
+def test_ingested_records_carry_id_strings(ingester, translation_units):
+    vertices, edges = ingest(ingester, translation_units)
+    assert all(isinstance(id, str) and id for id in vertices)
+    assert all(isinstance(from_id, str) and from_id and isinstance(to_id, str) and to_id
+               for from_id, _, to_id in edges)
@@ -0,0 +1,89 @@
+#############################################
+# Properties derived at ingest: qualified names,
+# namespaces and overload groups of the vertices,
+# inherits_transitive edges with the shortest depth,
+# and the files that derived data depends on.
+#############################################
+
+import pytest
+
+from graph_records import GraphRecordCollector
+
+BASE_HEADER = """#pragma once
+namespace outer {
+namespace inner {
+struct Base { void run(); void run(int times); };
+}
+struct Left : inner::Base {};
+struct Right : inner::Base {};
+}
+"""
+
+DERIVED_HEADER = """#pragma once
+#include "base.hpp"
+namespace outer {
+struct Diamond : Left, Right {};
+int helper(int value);
+double helper(double value);
+}
+extern "C" { int plain(int value); }
+"""
+
+MAIN_FILE = """#include "derived.hpp"
+namespace { struct Hidden {}; }
+int main() { return 0; }
+"""
+
+@pytest.fixture
+def graph(ingester, tmp_path):
+    (tmp_path / "base.hpp").write_text(BASE_HEADER)
+    (tmp_path / "derived.hpp").write_text(DERIVED_HEADER)
+    (tmp_path / "main.cpp").write_text(MAIN_FILE)
+    collector = GraphRecordCollector()
+    ingester.ingest_translation_units([(str(tmp_path / "main.cpp"), [f"-I{tmp_path}"])], collector)
+    vertices = {}
+    for label, properties in collector.vertices:
+        vertices.setdefault(properties.get("qualified_name"), []).append(properties)
+    return vertices, collector.edges
+
+def get_vertex(vertices, qualified_name):
+    assert len(vertices[qualified_name]) == 1
+    return vertices[qualified_name][0]
+
+def test_qualified_names_and_namespaces(graph):
+    vertices, _ = graph
+    base = get_vertex(vertices, "outer::inner::Base")
+    assert (base["spelling"], base["namespace"]) == ("Base", "outer::inner")
+    assert get_vertex(vertices, "outer::Diamond")["namespace"] == "outer"
+    # The namespace of a namespace is the enclosing one
+    assert get_vertex(vertices, "outer::inner")["namespace"] == "outer"
+    assert get_vertex(vertices, "outer")["namespace"] == ""
+    # extern "C" is no scope of its own
+    assert get_vertex(vertices, "plain")["namespace"] == ""
+    assert get_vertex(vertices, "(anonymous)::Hidden")["namespace"] == "(anonymous)"
+
+def test_overloads_share_their_group(graph):
+    vertices, _ = graph
+    runs = vertices["outer::inner::Base::run"]
+    assert len({properties["id"] for properties in runs}) == 2
+    assert {properties["overload_group"] for properties in runs} == {"outer::inner::Base::run"}
+    assert {properties["overload_group"] for properties in vertices["outer::helper"]} == {"outer::helper"}
+    assert "overload_group" not in get_vertex(vertices, "outer::Diamond")
+
+def test_inheritance_closure_has_the_shortest_depth(graph):
+    vertices, edges = graph
+    names = {properties["id"]: name for name, group in vertices.items() for properties in group}
+    closure = sorted((names[from_id], names[to_id], properties["depth"])
+                     for from_id, label, to_id, properties in edges if label == "inherits_transitive")
+    assert closure == [
+        ("outer::Diamond", "outer::Left", 1),
+        ("outer::Diamond", "outer::Right", 1),
+        ("outer::Diamond", "outer::inner::Base", 2),
+        ("outer::Left", "outer::inner::Base", 1),
+        ("outer::Right", "outer::inner::Base", 1),
+    ]
+
+def test_derived_data_records_its_files(ingester, graph, tmp_path):
+    # Diamond needs the base class definitions of base.hpp for its closure
+    assert str(tmp_path / "base.hpp") in ingester.file_dependencies[str(tmp_path / "derived.hpp")]
+    assert str(tmp_path / "derived.hpp") not in ingester.file_dependencies.get(str(tmp_path / "base.hpp"), set())
@@ -0,0 +1,61 @@
+#############################################
+# Memory-mapped index file shared by the trigram
+# and the vector index.
+#############################################
+
+import array
+
+from document_index import DocumentIndexBuilder, DocumentIndex, load_document_index
+
+class NumberIndexBuilder(DocumentIndexBuilder):
+    fields = ('name', 'file')
+    file_field = 'file'
+
+    def save(self, path, graph_version):
+        ids = sorted(self.documents)
+        numbers = array.array('I', range(len(ids))).tobytes()
+        self.write(path, b"TESTINDX", 1, ids, {"graph_version": graph_version}, [("numbers", len(numbers), [numbers])])
+
+class NumberIndex(DocumentIndex):
+    magic = b"TESTINDX"
+    version = 1
+    kind = "number index"
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.numbers = self.section("numbers", 'I')
+
+def test_documents_and_sections_round_trip(tmp_path):
+    path = str(tmp_path / "numbers.idx")
+    builder = NumberIndexBuilder()
+    builder.documents = {"b": ("Bé", "f1"), "a": ("", "f2"), "c": ("C", "f1")}
+    builder.save(path, "v1")
+
+    index = load_document_index(NumberIndex, path, "v1")
+    assert list(index.iterate_documents()) == [("a", ("", "f2")), ("b", ("Bé", "f1")), ("c", ("C", "f1"))]
+    assert index.numbers.tolist() == [0, 1, 2]
+    assert all(offset % 64 == 0 for offset, length in index.header["sections"].values())
+
+    builder = NumberIndexBuilder()
+    builder.load_index(index)
+    index.close()
+    builder.remove_files({"f1"})
+    assert builder.documents == {"a": ("", "f2")}
+
+def test_other_files_are_not_loaded(tmp_path, capsys):
+    path = str(tmp_path / "numbers.idx")
+    NumberIndexBuilder().save(path, "v1")
+    assert load_document_index(NumberIndex, path, "v2") is None
+    assert load_document_index(NumberIndex, path, None) is None
+
+    NumberIndex.version = 2
+    try:
+        assert load_document_index(NumberIndex, path, "v1") is None
+    finally:
+        NumberIndex.version = 1
+    with open(path, 'wb') as f:
+        f.write(b"NOTINDEX" + bytes(64))
+    assert load_document_index(NumberIndex, path, "v1") is None
+    assert capsys.readouterr().out.splitlines() == [
+        f"ERROR reading number index {path}: {path} has index version 1, expected 2",
+        f"ERROR reading number index {path}: {path} is not a number index"]
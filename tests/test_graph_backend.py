@@ -0,0 +1,63 @@
+#############################################
+# Asyncio submissions must not block the event loop
+# while they wait for a pooled Gremlin connection.
+#############################################
+
+import asyncio
+import queue
+from concurrent.futures import Future
+
+from graph_backend import submit_query_async
+
+# Result set which completes when the test finishes it, its connection goes back to the pool then
+class PendingResultSet:
+    def __init__(self, client, connection):
+        self.client = client
+        self.connection = connection
+        self.future = Future()
+
+    def finish(self, results):
+        self.client.connections.put(self.connection)
+        self.future.set_result(results)
+
+    def all(self):
+        return self.future
+
+# Like gremlin_python's Client: submit_async takes a connection from the pool with a blocking get
+class PooledGremlinClient:
+    def __init__(self, pool_size):
+        self.connections = queue.Queue()
+        for connection in range(pool_size):
+            self.connections.put(connection)
+        self.result_sets = []
+
+    def submit_async(self, message, bindings=None, request_options=None):
+        connection = self.connections.get(True, timeout=5)
+        result_set = PendingResultSet(self, connection)
+        self.result_sets.append(result_set)
+        future = Future()
+        future.set_result(result_set)
+        return future
+
+async def wait_for_result_sets(client, count):
+    while len(client.result_sets) < count:
+        await asyncio.sleep(0.01)
+
+def test_waiting_for_a_connection_keeps_the_loop_running():
+    async def run():
+        client = PooledGremlinClient(pool_size=1)
+        first = asyncio.ensure_future(submit_query_async(client, "g.V()"))
+        await wait_for_result_sets(client, 1)
+        second = asyncio.ensure_future(submit_query_async(client, "g.E()"))
+
+        # The second request waits for the only connection, the loop finishes the first one meanwhile
+        await asyncio.sleep(0.05)
+        assert len(client.result_sets) == 1
+        client.result_sets[0].finish([1])
+        assert await first == [1]
+
+        await wait_for_result_sets(client, 2)
+        client.result_sets[1].finish([2])
+        assert await second == [2]
+
+    asyncio.run(asyncio.wait_for(run(), 10))
@@ -0,0 +1,47 @@
+#############################################
+# Schema catalog maintained at ingest: counts of
+# what was stored, merged into the stored catalog.
+#############################################
+
+from graph_catalog import GraphCatalog, CatalogCollector
+from gremlin_writer import GremlinBulkWriter
+from memory_graph import MemoryGraph
+from test_gremlin_writer import RefusingGremlinClient
+
+def test_catalog_round_trip_and_subtract():
+    catalog = GraphCatalog()
+    catalog.record_vertex("CLASS_DECL", ["id", "spelling"])
+    catalog.record_vertex("CLASS_DECL", ["id", "file"])
+    catalog.record_vertex("FIELD_DECL", ["id"])
+    catalog.record_edge("CLASS_DECL", "contains_field")
+
+    loaded = GraphCatalog.from_json(catalog.to_json())
+    assert loaded.get_vertex_counts() == {"CLASS_DECL": 2, "FIELD_DECL": 1}
+    assert loaded.get_property_map()["CLASS_DECL"] == ["file", "id", "spelling"]
+    assert loaded.get_relationship_map()["CLASS_DECL"] == ["contains_field"]
+
+    loaded.subtract({"FIELD_DECL": 1}, {"contains_field": 1})
+    assert loaded.get_vertex_counts() == {"CLASS_DECL": 2}
+    assert loaded.edge_labels == {}
+
+def test_failed_writes_are_left_out_of_the_catalog():
+    graph = MemoryGraph()
+    writer = GremlinBulkWriter(RefusingGremlinClient(graph, "bad"), batch_size=4)
+    collector = CatalogCollector(writer)
+    for id in ("a", "b", "bad", "c"):
+        collector.add_vertex("CLASS_DECL", {"id": id})
+    collector.add_vertex("FIELD_DECL", {"id": "f"})
+    collector.add_edge("a", "contains_field", "f")
+    collector.add_edge("bad", "contains_field", "f")
+    writer.close()
+
+    # The edge of the refused vertex is not sent either
+    assert writer.failed_vertex_counts == {"CLASS_DECL": 1}
+    assert writer.failed_edge_counts == {"contains_field": 1}
+    collector.catalog.subtract(writer.failed_vertex_counts, writer.failed_edge_counts)
+
+    stored = GraphCatalog()
+    stored.merge(collector.catalog)
+    assert stored.get_vertex_counts() == {"CLASS_DECL": 3, "FIELD_DECL": 1}
+    assert stored.edge_labels == {"contains_field": len(graph.edges)}
+    assert sum(stored.get_vertex_counts().values()) == len(graph.vertices)
@@ -0,0 +1,91 @@
+#############################################
+# Graph snapshots: write/read round trip of the
+# records, replay into a writer, diff of two
+# snapshots, and a snapshot of the ingested corpus.
+#############################################
+
+import gzip
+import pytest
+
+from graph_records import GraphRecordCollector
+from graph_snapshot import SnapshotWriter, read_snapshot, load_snapshot, diff_snapshots
+
+def write_snapshot(path, vertices, edges):
+    writer = SnapshotWriter(path)
+    for label, properties in vertices:
+        writer.add_vertex(label, properties)
+    for edge in edges:
+        writer.add_edge(*edge)
+    writer.close()
+    return writer
+
+VERTICES = [("CLASS_DECL", {"id": "base", "spelling": "Base", "line": 3, "is_abstract": True, "comment": None}),
+            ("CLASS_DECL", {"id": "derived", "spelling": "Derived", "line": 12, "is_abstract": False, "comment": "A base"}),
+            ("FIELD_DECL", {"id": "count", "spelling": "count", "size": 4.5})]
+EDGES = [("derived", "inherits_from", "base", {"access": "public"}),
+         ("base", "contains_field", "count", {})]
+
+def test_round_trip_keeps_labels_ids_and_value_types(tmp_path):
+    path = str(tmp_path / "graph.snapshot.gz")
+    writer = write_snapshot(path, VERTICES, EDGES)
+    assert (writer.vertices_written, writer.edges_written) == (3, 2)
+
+    records = list(read_snapshot(path))
+    assert records[:3] == [("vertex", label, dict(properties, label=label)) for label, properties in VERTICES]
+    assert records[3:] == [("edge",) + edge for edge in EDGES]
+
+    # Repeated strings are written once
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        assert sum(1 for line in f if line.startswith('["S","CLASS_DECL"]')) == 1
+
+def test_load_holds_edges_back_until_their_endpoints(tmp_path):
+    path = str(tmp_path / "graph.snapshot.gz")
+    # Edge first, then its endpoints, and a duplicated vertex
+    writer = SnapshotWriter(path)
+    writer.add_edge(*EDGES[0])
+    for label, properties in VERTICES + VERTICES[:1]:
+        writer.add_vertex(label, properties)
+    writer.close()
+
+    collector = GraphRecordCollector()
+    load_snapshot(path, collector)
+    assert [properties["id"] for _, properties in collector.vertices] == ["base", "derived", "count"]
+    assert collector.edges == [EDGES[0]]
+
+def test_not_a_snapshot(tmp_path):
+    path = str(tmp_path / "other.gz")
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write('["OTHER", 1]\n')
+    with pytest.raises(ValueError, match="not a graph snapshot"):
+        list(read_snapshot(path))
+
+def test_diff(tmp_path, capsys):
+    old_path = str(tmp_path / "old.snapshot.gz")
+    new_path = str(tmp_path / "new.snapshot.gz")
+    write_snapshot(old_path, VERTICES, EDGES)
+    write_snapshot(new_path,
+                   [VERTICES[0], ("CLASS_DECL", dict(VERTICES[1][1], line=13)),
+                    ("METHOD", {"id": "get", "spelling": "get"})],
+                   [EDGES[0], ("base", "contains_method", "get", {})])
+    diff_snapshots(old_path, new_path)
+    assert capsys.readouterr().out.splitlines() == [
+        "- vertex count",
+        "+ vertex get",
+        "~ vertex derived: line",
+        "- edge base -contains_field-> count",
+        "+ edge base -contains_method-> get",
+    ]
+
+    diff_snapshots(new_path, new_path)
+    assert capsys.readouterr().out == ""
+
+def test_snapshot_of_the_corpus_loads_the_ingested_graph(ingester, translation_units, tmp_path):
+    from test_header_ownership import ingest, dump_graph
+    path = str(tmp_path / "corpus.snapshot.gz")
+    writer = SnapshotWriter(path)
+    ingester.ingest_translation_units(translation_units, writer)
+    writer.close()
+
+    collector = GraphRecordCollector()
+    load_snapshot(path, collector)
+    assert dump_graph(collector) == ingest(ingester, translation_units)
@@ -0,0 +1,210 @@
+#############################################
+# Bulk writer against the embedded graph: failed
+# batches are split until only the offending
+# mutations are lost, throttled ones are retried
+# and slow the writer down.
+#############################################
+
+from concurrent.futures import Future
+
+import pytest
+
+import gremlin_writer
+from gremlin_writer import GremlinBulkWriter, RequestUnitBudget
+from memory_graph import MemoryGraph
+
+# Fails every request binding the given value, like a vertex the database refuses
+class RefusingGremlinClient:
+    def __init__(self, graph, refused_value):
+        self.graph = graph
+        self.refused_value = refused_value
+        self.requests = 0
+
+    def submit_async(self, message, bindings=None, request_options=None):
+        self.requests += 1
+        future = Future()
+        if self.refused_value in (bindings or {}).values():
+            future.set_exception(ValueError(f"refused {self.refused_value}"))
+        else:
+            future.set_result(self.graph.submit(message, bindings))
+        return future
+
+def write_vertices(client, ids, batch_size=8):
+    writer = GremlinBulkWriter(client, batch_size=batch_size, max_in_flight=2)
+    for id in ids:
+        writer.add_vertex("CLASS_DECL", {"id": id, "spelling": id})
+    writer.add_edge(ids[0], "contains", ids[1])
+    writer.close()
+    return writer
+
+def test_refused_vertex_is_the_only_one_lost():
+    graph = MemoryGraph()
+    client = RefusingGremlinClient(graph, "v5")
+    writer = write_vertices(client, [f"v{i}" for i in range(8)])
+
+    assert sorted(graph.vertices) == sorted(f"v{i}" for i in range(8) if i != 5)
+    assert writer.vertices_written == 7 and writer.edges_written == 1
+    assert writer.failed_batches == 1
+    assert writer.failed_vertex_counts == {"CLASS_DECL": 1}
+    assert writer.failed_edge_counts == {}
+
+def test_conflicting_id_is_resolved_by_the_upsert_halves():
+    graph = MemoryGraph()
+    graph.submit("g.addV('CLASS_DECL').property('id', 'v3')").all().result()
+    writer = write_vertices(graph, [f"v{i}" for i in range(8)])
+
+    assert sorted(graph.vertices) == sorted(f"v{i}" for i in range(8))
+    assert graph.vertices["v3"].properties["spelling"] == "v3"
+    assert writer.vertices_written == 8 and writer.failed_batches == 0
+    assert len(graph.edges) == 1
+
+def test_edge_to_a_missing_vertex_counts_as_failed():
+    graph = MemoryGraph()
+    writer = GremlinBulkWriter(graph, batch_size=8)
+    writer.add_vertex("CLASS_DECL", {"id": "a"})
+    writer.add_vertex("CLASS_DECL", {"id": "b"})
+    writer.add_edge("a", "inherits_from", "b")
+    writer.add_edge("a", "inherits_from", "missing")
+    writer.add_edge("a", "contains_field", "b")
+    writer.close()
+
+    assert len(graph.edges) == 2
+    assert writer.edges_written == 2
+    assert writer.failed_edge_counts == {"inherits_from": 1}
+
+#############################################
+# Throttling against a local stand-in of Cosmos DB
+#############################################
+
+# Clock of the writer, sleeping only advances it
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+class ThrottledError(Exception):
+    def __init__(self, retry_after_ms):
+        super().__init__("RequestRateTooLarge")
+        self.status_attributes = {"x-ms-status-code": 429, "x-ms-retry-after-ms": retry_after_ms}
+
+class ChargedResultSet:
+    def __init__(self, results, charge):
+        self.results = results
+        self.status_attributes = {"x-ms-total-request-charge": charge}
+
+    def all(self):
+        future = Future()
+        future.set_result(self.results)
+        return future
+
+# Throttles the requests with the given numbers (from 1) with a 429, charges every other one
+class ThrottlingGremlinClient:
+    def __init__(self, graph, throttled_requests, charge_per_request=10.0, retry_after_ms=50):
+        self.graph = graph
+        self.throttled_requests = throttled_requests
+        self.charge_per_request = charge_per_request
+        self.retry_after_ms = retry_after_ms
+        self.queries = []
+        self.writer = None
+        self.in_flight_limits = []
+
+    def submit_async(self, message, bindings=None, request_options=None):
+        self.queries.append(message)
+        if self.writer is not None:
+            self.in_flight_limits.append(self.writer.in_flight_limit)
+        future = Future()
+        if len(self.queries) in self.throttled_requests:
+            future.set_exception(ThrottledError(self.retry_after_ms))
+        else:
+            future.set_result(ChargedResultSet(self.graph.execute(message, bindings), self.charge_per_request))
+        return future
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(gremlin_writer, "time", clock)
+    return clock
+
+def test_throttled_batch_is_retried_after_the_delay(clock):
+    graph = MemoryGraph()
+    client = ThrottlingGremlinClient(graph, {1})
+    writer = GremlinBulkWriter(client, batch_size=4, max_in_flight=1)
+    for i in range(4):
+        writer.add_vertex("CLASS_DECL", {"id": f"v{i}"})
+    writer.close()
+
+    assert clock.sleeps == [0.05]
+    assert len(client.queries) == 2
+    # The retry is an upsert, the throttled request may have been applied in part
+    assert client.queries[1].startswith("g.inject(0).union(V(v0_id).fold().coalesce(")
+    assert sorted(graph.vertices) == ["v0", "v1", "v2", "v3"]
+    assert writer.retries == 1 and writer.throttled_batches == 1
+    assert writer.vertices_written == 4 and writer.failed_batches == 0
+    assert writer.request_charge == 10.0
+
+def test_in_flight_limit_halves_and_recovers(clock):
+    graph = MemoryGraph()
+    client = ThrottlingGremlinClient(graph, {9})
+    writer = GremlinBulkWriter(client, batch_size=1, max_in_flight=8)
+    client.writer = writer
+    for i in range(60):
+        writer.add_vertex("CLASS_DECL", {"id": f"v{i}"})
+    writer.close()
+
+    limits = client.in_flight_limits
+    assert limits[0] == 8.0
+    assert min(limits) == 4.0
+    # Additive increase: back to the maximum after a few rounds of successful batches
+    assert limits[-1] == 8.0
+    assert limits.index(8.0, limits.index(4.0)) - limits.index(4.0) > 4
+    assert len(graph.vertices) == 60 and writer.throttled_batches == 1
+
+def test_batches_throttled_together_halve_the_limit_once(clock):
+    graph = MemoryGraph()
+    client = ThrottlingGremlinClient(graph, {1, 2, 3})
+    writer = GremlinBulkWriter(client, batch_size=1, max_in_flight=4)
+    client.writer = writer
+    for i in range(4):
+        writer.add_vertex("CLASS_DECL", {"id": f"v{i}"})
+    writer.close()
+
+    # The other two were sent at the old rate, before the first one was throttled
+    assert writer.throttled_batches == 3
+    assert min(client.in_flight_limits) == 2.0
+    assert len(graph.vertices) == 4
+
+def test_request_unit_budget_blocks_submission_when_empty(clock):
+    budget = RequestUnitBudget(100)
+    budget.reserve(80)
+    budget.reserve(20)
+    assert clock.sleeps == []
+    # The bucket is empty, half of its rate is a wait of half a second
+    budget.reserve(50)
+    assert clock.sleeps == [0.5]
+    # A charge above the reservation is paid for by the next submit
+    budget.settle(50, 100)
+    budget.reserve(10)
+    assert clock.sleeps == [0.5, 0.6]
+
+def test_writer_stays_under_the_budget(clock):
+    graph = MemoryGraph()
+    client = ThrottlingGremlinClient(graph, set(), charge_per_request=50.0)
+    writer = GremlinBulkWriter(client, batch_size=5, max_in_flight=1, ru_budget=100)
+    for i in range(50):
+        writer.add_vertex("CLASS_DECL", {"id": f"v{i}"})
+    writer.close()
+
+    # 10 batches of 50 RU: the first two fit into the full bucket, the others wait for it
+    assert writer.request_charge == 500.0
+    assert clock.sleeps == [0.5] * 8
+    assert len(graph.vertices) == 50
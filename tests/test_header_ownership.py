@@ -0,0 +1,81 @@
+#############################################
+# Header ownership claims, and the graph extracted
+# with shared headers walked once: the same in the
+# parallel and the sequential path, and the same as
+# when every header is walked in every unit.
+#############################################
+
+from header_ownership import get_preprocessor_context_hash, get_header_key, get_header_keys, claim_headers
+from usr_registry import UsrRegistry
+
+def test_context_hash_keeps_preprocessor_arguments_only():
+    base = get_preprocessor_context_hash(['-x', 'c++', '-std=c++11', '-DA=1'])
+    assert get_preprocessor_context_hash(['-x', 'c++', '-std=c++11', '-DA=1', '-I/include', '-Wall']) == base
+    assert get_preprocessor_context_hash(['-x', 'c++', '-std=c++11', '-D', 'A=1']) == base
+    assert get_preprocessor_context_hash(['-x', 'c++', '-std=c++11', '-DA=2']) != base
+    assert get_preprocessor_context_hash(['-x', 'c++', '-std=c++17', '-DA=1']) != base
+    assert get_preprocessor_context_hash(['-x', 'c++', '-std=c++11', '-DA=1', '-include', 'config.h']) != base
+
+def test_first_unit_claims_header_per_context():
+    registry = UsrRegistry()
+    claims, owned_elsewhere = claim_headers(registry, 'a.cpp', {'a.cpp', 'x.hpp', 'y.hpp'}, 'c1')
+    assert claims == {'x.hpp': {'c1': 'a.cpp'}, 'y.hpp': {'c1': 'a.cpp'}}
+    assert owned_elsewhere == set()
+
+    claims, owned_elsewhere = claim_headers(registry, 'b.cpp', {'b.cpp', 'y.hpp', 'z.hpp'}, 'c1')
+    assert claims == {'z.hpp': {'c1': 'b.cpp'}}
+    assert owned_elsewhere == {'y.hpp'}
+
+    # Another macro context walks the header again
+    claims, owned_elsewhere = claim_headers(registry, 'c.cpp', {'c.cpp', 'y.hpp'}, 'c2')
+    assert claims == {'y.hpp': {'c2': 'c.cpp'}}
+    assert owned_elsewhere == set()
+
+def test_recorded_owners_are_preclaimed():
+    registry = UsrRegistry()
+    registry.claim(get_header_keys({'x.hpp': {'c1': 'a.cpp'}}))
+    assert registry.claim([get_header_key('x.hpp', 'c1')]) == []
+    claims, owned_elsewhere = claim_headers(registry, 'b.cpp', {'x.hpp'}, 'c1')
+    assert claims == {} and owned_elsewhere == {'x.hpp'}
+
+#############################################
+# Ingestion of the synthetic benchmark corpus
+#############################################
+
+# Vertices by id and edges of the extracted graph. The tu property names the unit which emitted
+# the vertex (the owner of its header), which one that is depends on the order the workers run in.
+def dump_graph(collector):
+    vertices = {properties["id"]: (label, {key: value for key, value in properties.items() if key != "tu"})
+                for label, properties in collector.vertices}
+    edges = {(from_id, edge_label, to_id) for from_id, edge_label, to_id, _ in collector.edges}
+    assert len(vertices) == len(collector.vertices)
+    assert len(edges) == len(collector.edges)
+    return vertices, edges
+
+# Settings are module globals of the ingester, changed for this run only
+def ingest(ingester, translation_units, workers=None, **settings):
+    from graph_records import GraphRecordCollector
+    collector = GraphRecordCollector()
+    defaults = {name: getattr(ingester, name) for name in settings}
+    for name, value in settings.items():
+        setattr(ingester, name, value)
+    try:
+        if workers:
+            ingester.ingest_translation_units_in_parallel(translation_units, collector, workers)
+        else:
+            ingester.ingest_translation_units(translation_units, collector)
+    finally:
+        for name, value in defaults.items():
+            setattr(ingester, name, value)
+    return dump_graph(collector)
+
+def test_parallel_and_sequential_ingestion_give_the_same_graph(ingester, translation_units):
+    sequential_vertices, sequential_edges = ingest(ingester, translation_units)
+    assert sequential_vertices and sequential_edges
+    for workers in (2, 4):
+        vertices, edges = ingest(ingester, translation_units, workers)
+        assert vertices == sequential_vertices
+        assert edges == sequential_edges
+
+def test_deduplicated_headers_give_the_same_graph(ingester, translation_units):
+    assert ingest(ingester, translation_units) == ingest(ingester, translation_units, deduplicate_headers=False)
@@ -0,0 +1,120 @@
+#############################################
+# Incremental ingestion: dirty files from the
+# manifest and the filter letting through only
+# what is missing from the graph.
+#############################################
+
+import os
+import re
+
+from ingest_manifest import IngestManifest, IncrementalFilter
+
+class RecordingWriter:
+    def __init__(self):
+        self.vertices = []
+        self.edges = []
+
+    def add_vertex(self, label, properties):
+        self.vertices.append(properties["id"])
+
+    def add_edge(self, from_id, edge_label, to_id, properties=None):
+        self.edges.append((from_id, edge_label, to_id))
+
+def write_file(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+def test_dirty_files_follow_changes_flags_and_dependencies(tmp_path):
+    tu, base, derived = (str(tmp_path / name) for name in ("main.cpp", "base.h", "derived.h"))
+    for path in (tu, base, derived):
+        write_file(path, path)
+    manifest_path = str(tmp_path / "manifest.json")
+
+    manifest = IngestManifest(manifest_path)
+    manifest.record_tu(tu, ["-std=c++17"], [tu, base, derived])
+    manifest.record_file_dependencies({derived: {base}}, [])
+    manifest.save()
+
+    manifest = IngestManifest(manifest_path)
+    assert manifest.is_tu_unchanged(tu, ["-std=c++17"])
+    assert manifest.get_dirty_files([(tu, ["-std=c++17"])]) == set()
+    assert manifest.get_dirty_files([(tu, ["-std=c++20"])]) == {tu, base, derived}
+
+    write_file(base, "changed")
+    os.utime(base, (0, 0))
+    manifest = IngestManifest(manifest_path)
+    assert not manifest.is_tu_unchanged(tu, ["-std=c++17"])
+    # The derived header depends on the changed base
+    assert manifest.get_dirty_files([(tu, ["-std=c++17"])]) == {base, derived}
+
+def test_filter_lets_through_only_rewritten_vertices(tmp_path):
+    manifest = IngestManifest(str(tmp_path / "manifest.json"))
+    manifest.record_file_vertices({"a.h": {"ns", "a1"}, "b.h": {"b1"}}, [])
+
+    writer = RecordingWriter()
+    incremental_filter = IncrementalFilter(writer, manifest, {"b.h"})
+    # The namespace is kept from a.h, emitted again from b.h
+    incremental_filter.add_vertex("NAMESPACE", {"id": "ns", "file": "b.h"})
+    incremental_filter.add_vertex("CLASS_DECL", {"id": "b2", "file": "b.h"})
+    incremental_filter.add_vertex("CLASS_DECL", {"id": "b2", "file": "b.h"})
+    incremental_filter.add_edge("ns", "contains", "b2")
+    incremental_filter.add_edge("ns", "contains", "a1")
+    incremental_filter.close()
+
+    assert writer.vertices == ["b2"]
+    assert writer.edges == [("ns", "contains", "b2")]
+    assert manifest.file_vertices == {"a.h": {"ns", "a1"}, "b.h": {"b2"}}
+
+#############################################
+# Incremental run of the ingester after a header
+# was edited, against a full run of the edited corpus
+#############################################
+
+def run_ingester(ingester, monkeypatch, compile_commands_path, graph_path, manifest_path):
+    import graph_backend
+    monkeypatch.setenv("GRAPH_BACKEND", f"memory:{graph_path}")
+    monkeypatch.setattr(graph_backend, "memory_graphs", {})
+    settings = {"compile_commands_path": compile_commands_path, "incremental_manifest_path": manifest_path,
+                "ingest_workers": 2, "snapshot_path": None, "trigram_index_path": None, "vector_index_path": None,
+                "tu_cache_path": None, "metrics_summary_path": None, "metrics_textfile_path": None, "profile_path": None}
+    for name, value in settings.items():
+        monkeypatch.setattr(ingester, name, value)
+    ingester.main()
+
+# Vertices (without the unit which emitted them), edges and the published catalog
+def dump_stored_graph(graph_path):
+    from graph_metadata import GRAPH_METADATA_LABEL, get_graph_catalog
+    from memory_graph import MemoryGraph
+    graph = MemoryGraph(graph_path)
+    vertices = {vertex.id: (vertex.label, {key: value for key, value in vertex.properties.items() if key != "tu"})
+                for vertex in graph.vertices.values() if vertex.label != GRAPH_METADATA_LABEL}
+    edges = sorted((edge.out_vertex.id, edge.label, edge.in_vertex.id) for edge in graph.edges.values())
+    catalog = get_graph_catalog(graph)
+    return vertices, edges, catalog.get_vertex_counts(), catalog.edge_labels
+
+def test_incremental_run_after_a_header_edit_equals_a_full_run(ingester, monkeypatch, tmp_path, capsys):
+    import benchmark
+    compile_commands_path = benchmark.generate_corpus(str(tmp_path / "corpus"), namespaces=2, classes=4, methods=2, overloads=2,
+                                                      templates=1, inheritance_depth=2, translation_units=3)
+    incremental_graph, manifest = str(tmp_path / "incremental.gz"), str(tmp_path / "manifest.json")
+    run_ingester(ingester, monkeypatch, compile_commands_path, incremental_graph, manifest)
+
+    # A new field, and a new class derived from the edited one
+    header_path = str(tmp_path / "corpus" / "include" / "ns1.hpp")
+    with open(header_path) as f:
+        header = f.read()
+    header = header.replace("    double field1;\n", "    double field1;\n    int added_field;\n", 1)
+    header = header.replace("class Class1_1 ", "class Extra1 : public Class1_0 {\npublic:\n    int extra;\n};\n\nclass Class1_1 ", 1)
+    with open(header_path, 'w') as f:
+        f.write(header)
+
+    capsys.readouterr()
+    run_ingester(ingester, monkeypatch, compile_commands_path, incremental_graph, manifest)
+    assert re.search(r"Incremental run: \d+ translation unit\(s\) to process, [1-9]\d* file\(s\) to rewrite", capsys.readouterr().out)
+    full_graph = str(tmp_path / "full.gz")
+    run_ingester(ingester, monkeypatch, compile_commands_path, full_graph, str(tmp_path / "full_manifest.json"))
+
+    incremental = dump_stored_graph(incremental_graph)
+    full = dump_stored_graph(full_graph)
+    assert any(properties.get("spelling") == "added_field" for label, properties in full[0].values())
+    assert incremental == full
@@ -0,0 +1,55 @@
+#############################################
+# Embedded graph store: the Gremlin step subset
+# used by this project, Cosmos-like id conflicts
+# and snapshot round trips.
+#############################################
+
+import pytest
+
+from gremlin_parser import parse_gremlin, to_gremlin, GremlinSyntaxError
+from memory_graph import MemoryGraph
+
+@pytest.fixture
+def graph():
+    graph = MemoryGraph()
+    graph.add_vertex("CLASS_DECL", {"id": "base", "spelling": "Base", "file": "a.h"})
+    graph.add_vertex("CLASS_DECL", {"id": "derived", "spelling": "Derived", "file": "b.h"})
+    graph.add_vertex("CLASS_DECL", {"id": "leaf", "spelling": "Leaf", "file": "b.h"})
+    graph.add_vertex("FIELD_DECL", {"id": "count", "spelling": "count", "file": "a.h"})
+    graph.add_edge("derived", "inherits_from", "base")
+    graph.add_edge("leaf", "inherits_from", "derived")
+    graph.add_edge("base", "contains_field", "count")
+    return graph
+
+def query(graph, text, bindings=None):
+    return graph.submit(text, bindings).all().result()
+
+def test_parse_round_trip():
+    text = "g.V().has('spelling',TextP.containing(\"x\")).out( 'a' ).limit(3)"
+    assert to_gremlin(parse_gremlin(text)) == "g.V().has('spelling', TextP.containing('x')).out('a').limit(3)"
+    with pytest.raises(GremlinSyntaxError):
+        parse_gremlin("g.V(")
+
+def test_traversals(graph):
+    assert query(graph, "g.V().hasLabel('CLASS_DECL').has('spelling', TextP.containing('er')).values('spelling')") == ["Derived"]
+    assert query(graph, "g.V('leaf').repeat(out('inherits_from')).emit().values('spelling')") == ["Derived", "Base"]
+    assert query(graph, "g.V().has('file', 'b.h').count()") == [2]
+    assert query(graph, "g.V('base').in('inherits_from').project('id', 'name').by(id).by('spelling')") == [{"id": "derived", "name": "Derived"}]
+    assert query(graph, "g.V(class_id).out('contains_field').valueMap('spelling')", {"class_id": "base"}) == [{"spelling": ["count"]}]
+    assert query(graph, "g.V().hasLabel('CLASS_DECL').order().by('spelling', desc).limit(2).values('spelling')") == ["Leaf", "Derived"]
+    assert query(graph, "g.V().groupCount().by(label)") == [{"CLASS_DECL": 3, "FIELD_DECL": 1}]
+
+def test_existing_id_is_a_conflict(graph):
+    result_set = graph.submit("g.addV('CLASS_DECL').property('id', 'base').property('spelling', 'Other')")
+    with pytest.raises(Exception, match="already exists"):
+        result_set.all().result()
+    assert len(graph.vertices) == 4
+    assert query(graph, "g.V('base').values('spelling')") == ["Base"]
+
+def test_snapshot_round_trip(graph, tmp_path):
+    path = str(tmp_path / "graph.gz")
+    graph.save_snapshot(path)
+    loaded = MemoryGraph.from_snapshot(path)
+    assert set(loaded.vertices) == set(graph.vertices)
+    assert query(loaded, "g.E().count()") == [3]
+    assert query(loaded, "g.V().has('file', 'a.h').values('spelling')") == query(graph, "g.V().has('file', 'a.h').values('spelling')")
@@ -0,0 +1,107 @@
+#############################################
+# Metrics registry: timers, labelled counters and
+# latency histograms, merging of worker snapshots,
+# the JSON summary and the Prometheus textfile.
+#############################################
+
+import json
+import pytest
+
+from metrics import Metrics, Histogram, start_profiling, stop_profiling
+from test_header_ownership import ingest
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram((0.1, 1.0))
+    assert histogram.quantile(0.5) is None
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(1.0) == 2.0
+    assert (histogram.count, histogram.sum, histogram.max) == (4, 2.65, 2.0)
+
+    with pytest.raises(ValueError):
+        histogram.merge(Histogram((0.1,)).to_dict())
+
+def test_measure_counts_failed_calls():
+    registry = Metrics()
+    with registry.measure("openai_request", purpose="answer"):
+        pass
+    with pytest.raises(RuntimeError):
+        with registry.measure("openai_request", purpose="answer"):
+            raise RuntimeError("throttled")
+    assert registry.histograms[("openai_request", (("purpose", "answer"),))].count == 2
+    assert registry.get_counter("errors", kind="openai_request") == 1
+
+def test_worker_snapshots_are_merged():
+    worker = Metrics()
+    worker.add_time("parse", 1.5)
+    worker.increment("cursors", 10)
+    worker.increment("submits", 2, kind="vertex")
+    worker.observe("gremlin_request", 0.02, kind="vertex")
+
+    parent = Metrics()
+    parent.add_time("parse", 0.5)
+    parent.increment("cursors", 5)
+    # Snapshots travel between processes as plain data
+    for _ in range(2):
+        parent.merge(json.loads(json.dumps(worker.snapshot())))
+
+    assert parent.get_seconds("parse") == 3.5
+    assert parent.timers["parse"][1] == 3
+    assert parent.get_counter("cursors") == 25
+    assert parent.get_counter("submits", kind="vertex") == 4
+    assert parent.histograms[("gremlin_request", (("kind", "vertex"),))].count == 2
+
+def test_summary_and_prometheus_export(tmp_path):
+    registry = Metrics()
+    registry.add_time("parse", 0.25)
+    registry.increment("cursors", 7)
+    registry.count_error("cursor")
+    registry.observe("gremlin_request", 0.02, kind='a"b')
+
+    summary = registry.to_summary()
+    assert summary["phases"] == {"parse": {"seconds": 0.25, "count": 1}}
+    assert summary["counters"] == {"cursors": 7, "errors{kind=cursor}": 1}
+    assert summary["latencies"]['gremlin_request{kind=a"b}']["p50_ms"] == 20.0
+
+    lines = registry.to_prometheus().splitlines()
+    assert "# TYPE cpprag_phase_seconds_total counter" in lines
+    assert 'cpprag_phase_seconds_total{phase="parse"} 0.25' in lines
+    assert "cpprag_cursors_total 7" in lines
+    assert 'cpprag_errors_total{kind="cursor"} 1' in lines
+    assert "# TYPE cpprag_gremlin_request_seconds histogram" in lines
+    assert 'cpprag_gremlin_request_seconds_bucket{kind="a\\"b",le="0.01"} 0' in lines
+    assert 'cpprag_gremlin_request_seconds_bucket{kind="a\\"b",le="0.025"} 1' in lines
+    assert 'cpprag_gremlin_request_seconds_bucket{kind="a\\"b",le="+Inf"} 1' in lines
+    assert 'cpprag_gremlin_request_seconds_count{kind="a\\"b"} 1' in lines
+
+    summary_path = tmp_path / "metrics" / "summary.json"
+    prometheus_path = tmp_path / "metrics" / "cpprag.prom"
+    registry.export(str(summary_path), str(prometheus_path))
+    assert json.loads(summary_path.read_text())["counters"] == summary["counters"]
+    assert prometheus_path.read_text() == registry.to_prometheus()
+    assert sorted(path.name for path in (tmp_path / "metrics").iterdir()) == ["cpprag.prom", "summary.json"]
+
+def test_profile_is_written_when_configured(tmp_path, capsys):
+    assert start_profiling(None) is None
+    profile_path = str(tmp_path / "run.prof")
+    profiler = start_profiling(profile_path)
+    sum(range(1000))
+    stop_profiling(profiler, profile_path)
+    assert (tmp_path / "run.prof").stat().st_size > 0
+    assert f"Profile written to {profile_path}" in capsys.readouterr().out
+
+def test_parallel_ingestion_merges_worker_metrics(ingester, translation_units):
+    from metrics import metrics
+    metrics.reset()
+    ingest(ingester, translation_units)
+    sequential_cursors = metrics.get_counter("cursors")
+    assert sequential_cursors > 0
+    assert metrics.timers["parse"][1] == len(translation_units)
+
+    metrics.reset()
+    ingest(ingester, translation_units, 2)
+    assert metrics.get_counter("cursors") == sequential_cursors
+    assert metrics.timers["parse"][1] == len(translation_units)
@@ -0,0 +1,56 @@
+#############################################
+# Query and result cache: normalized keys, and
+# everything dropped once a new graph version
+# is published.
+#############################################
+
+from graph_metadata import publish_graph_metadata, get_graph_version
+from memory_graph import MemoryGraph
+from query_cache import QueryCache, LRUCache
+
+QUERY = "g.V().hasLabel('CLASS_DECL').values('spelling')"
+
+def test_keys_are_normalized():
+    cache = QueryCache()
+    cache.set_graph_version("v1")
+    cache.put_query("Which classes derive from 'Base'?", QUERY)
+    cache.put_result(QUERY, None)
+
+    assert cache.get_query("  which CLASSES derive   from \"Base\"") == QUERY
+    assert cache.get_query("Which classes derive from 'base'?") is None
+    assert cache.get_result('g.V().hasLabel("CLASS_DECL").values("spelling")') == (True, None)
+
+def test_new_graph_version_drops_the_cache(tmp_path):
+    graph = MemoryGraph()
+    cache_path = str(tmp_path / "cache.json")
+    cache = QueryCache(cache_path)
+    # Nothing is cached for a graph the ingester never published
+    cache.set_graph_version(get_graph_version(graph))
+    cache.put_query("classes", QUERY)
+    assert cache.get_query("classes") is None
+
+    cache.set_graph_version(publish_graph_metadata(graph))
+    cache.put_query("classes", QUERY)
+    cache.put_result(QUERY, ["A"])
+    cache.save()
+
+    # Loaded for the same version the entries are still there
+    cache = QueryCache(cache_path)
+    cache.set_graph_version(get_graph_version(graph))
+    assert cache.get_query("classes") == QUERY
+    assert cache.get_result(QUERY) == (True, ["A"])
+
+    cache.set_graph_version(publish_graph_metadata(graph))
+    assert cache.get_query("classes") is None
+    assert cache.get_result(QUERY) == (False, None)
+
+def test_lru_eviction_and_ttl():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert [key for key, value, expires_at in cache.to_list()] == ["a", "c"]
+
+    cache.load_list([["d", 4, 0.0]])
+    assert cache.get("d") is None
@@ -0,0 +1,56 @@
+#############################################
+# Cost guard of the generated queries: rejected
+# shapes and the rewrites of the accepted ones.
+#############################################
+
+import pytest
+
+from graph_catalog import GraphCatalog
+from query_guard import QueryGuard
+
+# Answers TextP filters on spelling like the trigram index
+class SpellingIndex:
+    def __init__(self, spellings):
+        self.spellings = spellings
+
+    def find(self, key, predicate, text):
+        if key != 'spelling' or predicate != 'containing':
+            return None
+        return [id for id, spelling in self.spellings.items() if text in spelling]
+
+@pytest.fixture
+def guard():
+    catalog = GraphCatalog()
+    for i in range(50000):
+        catalog.record_vertex("CLASS_DECL", ["id", "spelling"])
+    for i in range(200000):
+        catalog.record_vertex("CALL_EXPR", ["id"])
+    for i in range(300000):
+        catalog.record_edge("CLASS_DECL", "calls")
+    return QueryGuard(catalog)
+
+def test_rejected_queries(guard):
+    assert guard.check("g.V('a').drop()") == (None, "The query modifies the graph with drop(), only read queries are allowed.")
+    assert guard.check("g.V(")[1].startswith("The query could not be parsed")
+    assert guard.check("__.V()")[1] == "The query has to start with g."
+    query, reason = guard.check("g.V().out('calls').out('calls').values('spelling')")
+    assert query is None and reason.startswith("The query would read about 10,750,000 vertices and edges")
+
+def test_rewrites(guard):
+    assert guard.check("g.V().hasLabel('CLASS_DECL').has('id', 'x').out('inherits_from').values('spelling')") == \
+        ("g.V('x').hasLabel('CLASS_DECL').out('inherits_from').values('spelling').limit(1000)", None)
+    assert guard.check("g.V().has('spelling', 'W').repeat(out('x')).times(50).path()") == \
+        ("g.V().has('spelling', 'W').repeat(out('x')).times(10).path().limit(1000)", None)
+    query, reason = guard.check("g.V().hasLabel('CLASS_DECL').has('spelling', 'Widget').repeat(out('inherits_from')).emit().valueMap(true)")
+    assert query.startswith("g.V().has('spelling', 'Widget').hasLabel('CLASS_DECL').repeat(out('inherits_from')).times(5).emit()"
+                            ".project('id', 'label', 'qualified_name', 'file', 'line', 'spelling')")
+
+def test_trigram_index_anchors_substring_filters():
+    guard = QueryGuard(trigram_index=SpellingIndex({"a": "Widget", "b": "WidgetFactory", "c": "Gadget"}), max_index_ids=2)
+    assert guard.check("g.V().has('spelling', TextP.containing('Widget')).count()") == \
+        ("g.V('a', 'b').has('spelling', TextP.containing('Widget')).count()", None)
+    assert guard.check("g.V().has('spelling', TextP.containing('None')).count()") == \
+        ("g.V().limit(0).has('spelling', TextP.containing('None')).count()", None)
+    # More ids than the guard may put into V(), the graph filters
+    assert guard.check("g.V().has('spelling', TextP.containing('dget')).count()") == \
+        ("g.V().has('spelling', TextP.containing('dget')).count()", None)
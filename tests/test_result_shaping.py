@@ -0,0 +1,45 @@
+#############################################
+# Shaping of query results for the advisor:
+# tables per row shape, merged duplicates, the
+# token budget and the scan limit.
+#############################################
+
+from result_shaping import shape_result_chunks, flatten_result
+
+def test_tables_and_duplicates():
+    chunks = [[{'id': 'a', 'spelling': ['A'], 'file': ['x.h']}, {'id': 'b', 'spelling': ['B'], 'file': ['x.h']}],
+              [{'id': 'a', 'spelling': ['A'], 'file': ['x.h']}, 3]]
+    assert shape_result_chunks(chunks) == '\n'.join([
+        "Table 1:",
+        "id | spelling | file",
+        "a | A | x.h (x2)",
+        "b | B | x.h",
+        "Table 2:",
+        "value",
+        "3",
+        "(1 duplicate rows merged, (xN) is the number of occurrences)"])
+    assert shape_result_chunks([]) == "The query returned no results."
+
+def test_graphson_vertex():
+    vertex = {'type': 'vertex', 'id': 'v1', 'label': 'CLASS_DECL',
+              'properties': {'spelling': [{'id': 'p1', 'value': 'Widget'}], 'line': [{'id': 'p2', 'value': 3}]}}
+    assert flatten_result(vertex) == {'id': 'v1', 'label': 'CLASS_DECL', 'spelling': 'Widget', 'line': 3}
+
+def test_budget_summarizes_the_rest_by_group():
+    rows = [{'id': i, 'label': 'CLASS_DECL' if i % 3 else 'FIELD_DECL'} for i in range(200)]
+    text = shape_result_chunks([rows], token_budget=40)
+    assert len(text) < 400
+    assert text.endswith("Result truncated to fit 40 tokens: 7 of 200 rows are listed. "
+                         "Omitted rows (193) by group: CLASS_DECL: 129, FIELD_DECL: 64.")
+
+def test_reading_stops_at_the_scan_limit():
+    read = []
+
+    def chunks():
+        for chunk in ([1, 2], [3, 4], [5, 6], [7]):
+            read.append(chunk)
+            yield chunk
+
+    text = shape_result_chunks(chunks(), scan_limit=3)
+    assert text.endswith("3 of 3 read rows are listed, reading stopped after 3 rows (the query returns more).")
+    assert len(read) == 2
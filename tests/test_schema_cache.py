@@ -0,0 +1,121 @@
+#############################################
+# The schema is read once per graph version: the
+# version stamp and catalog published by the
+# ingester, and the schema caches of the service
+# and of the example chatbot keyed by it.
+#############################################
+
+import asyncio
+import importlib
+
+from graph_catalog import GraphCatalog
+from graph_metadata import publish_graph_metadata, get_graph_metadata, get_graph_version, GRAPH_METADATA_LABEL
+from memory_graph import MemoryGraph
+from query_cache import QueryCache
+
+# Memory graph which records the submitted queries
+class CountingGraph(MemoryGraph):
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def execute(self, query, bindings=None):
+        self.queries.append(query)
+        return super().execute(query, bindings)
+
+def create_graph():
+    graph = CountingGraph()
+    graph.add_vertex("CLASS_DECL", {"id": "base", "spelling": "Base"})
+    graph.add_vertex("FIELD_DECL", {"id": "count", "spelling": "count"})
+    graph.add_edge("base", "contains_field", "count")
+    return graph
+
+def create_catalog():
+    catalog = GraphCatalog()
+    catalog.record_vertex("CLASS_DECL", ["id", "spelling"])
+    catalog.record_vertex("FIELD_DECL", ["id", "spelling"])
+    catalog.record_edge("CLASS_DECL", "contains_field")
+    return catalog
+
+def test_published_version_and_catalog_are_read_back():
+    graph = create_graph()
+    assert get_graph_version(graph) is None
+    assert get_graph_metadata(graph) == {"version": None, "catalog": None}
+
+    version = publish_graph_metadata(graph, create_catalog())
+    metadata = get_graph_metadata(graph)
+    assert get_graph_version(graph) == metadata["version"] == version
+    assert metadata["catalog"].get_relationship_map() == create_catalog().get_relationship_map()
+
+    # Publishing again updates the one metadata vertex
+    assert publish_graph_metadata(graph) != version
+    assert graph.submit(f"g.V().hasLabel('{GRAPH_METADATA_LABEL}').count()").all().result() == [1]
+
+def test_service_reads_the_schema_once_per_version():
+    import qa_service
+
+    async def run():
+        graph = create_graph()
+        publish_graph_metadata(graph, create_catalog())
+        query_cache = QueryCache(None)
+        service = qa_service.QAService(graph, None, query_cache)
+
+        await service.refresh_schema()
+        assert service.schema_loaded and "contains_field" in service.system_message
+        query_cache.put_query("which classes", "g.V()")
+
+        # Same version: one point lookup of the stamp, the cached queries stay
+        graph.queries.clear()
+        system_message = service.system_message
+        await service.refresh_schema()
+        assert len(graph.queries) == 1
+        assert service.system_message is system_message
+        assert query_cache.get_query("which classes") == "g.V()"
+
+        # A new version rebuilds the schema and drops the cached queries
+        catalog = create_catalog()
+        catalog.record_edge("CLASS_DECL", "inherits_from")
+        version = publish_graph_metadata(graph, catalog)
+        await service.refresh_schema()
+        assert service.graph_version == version
+        assert "inherits_from" in service.system_message
+        assert query_cache.get_query("which classes") is None
+
+    asyncio.run(run())
+
+def test_service_scans_labels_of_a_graph_without_catalog():
+    import qa_service
+
+    async def run():
+        graph = create_graph()
+        service = qa_service.QAService(graph, None, QueryCache(None))
+        await service.refresh_schema()
+        assert "contains_field" in service.system_message
+        assert any("label().dedup()" in query for query in graph.queries)
+
+        # A graph without version stamp is never cached
+        graph.queries.clear()
+        await service.refresh_schema()
+        assert any("label().dedup()" in query for query in graph.queries)
+
+    asyncio.run(run())
+
+def test_chatbot_caches_the_system_message_on_disk(monkeypatch, tmp_path):
+    monkeypatch.setenv("GRAPH_BACKEND", "memory")
+    chatbot = importlib.import_module("test_the_idea")
+    graph = create_graph()
+    monkeypatch.setattr(chatbot, "gremlin_client", graph)
+    monkeypatch.setattr(chatbot, "schema_cache_path", str(tmp_path / "schema.json"))
+    monkeypatch.setattr(chatbot, "cached_system_message", None)
+    monkeypatch.setattr(chatbot, "cached_graph_version", None)
+
+    version = publish_graph_metadata(graph, create_catalog())
+    system_message, metadata = chatbot.get_gremlin_query_system_message()
+    assert metadata["version"] == version
+    assert chatbot.load_cached_system_message(version) == system_message
+    assert chatbot.load_cached_system_message("other version") is None
+
+    # A new process finds the system message of the version on disk
+    monkeypatch.setattr(chatbot, "cached_system_message", None)
+    monkeypatch.setattr(chatbot, "build_gremlin_query_system_message", None)
+    assert chatbot.get_gremlin_query_system_message()[0] == system_message
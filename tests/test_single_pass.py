@@ -0,0 +1,80 @@
+#############################################
+# Single-pass extraction: edges wait in the pending
+# table for their endpoint vertices, cursor keys
+# with and without the private ctypes fields, and
+# the extraction state is reset for every unit.
+#############################################
+
+from graph_records import GraphRecordCollector, PendingEdgeTable
+from test_header_ownership import ingest
+
+def test_pending_edges_wait_for_their_endpoints():
+    collector = GraphRecordCollector()
+    known_ids = set()
+    table = PendingEdgeTable(collector, known_ids)
+
+    known_ids.add(1)
+    table.add_vertex("CLASS_DECL", {"id": 1})
+    table.add_edge(1, "inherits_from", 2, {})
+    table.add_edge(3, "contains_field", 1, {})
+    assert collector.edges == []
+
+    known_ids.add(2)
+    table.add_vertex("CLASS_DECL", {"id": 2})
+    assert collector.edges == [(1, "inherits_from", 2, {})]
+
+    # The rest is sent when the unit is done
+    table.close()
+    assert collector.edges == [(1, "inherits_from", 2, {}), (3, "contains_field", 1, {})]
+    assert table.pending_edges == {}
+
+def get_class_cursors(tmp_path):
+    import clang.cindex
+    (tmp_path / "main.cpp").write_text("class A {};\nA a;\nA b;\n")
+    tu = clang.cindex.Index.create().parse(str(tmp_path / "main.cpp"), args=['-x', 'c++'])
+    class_a = next(tu.cursor.get_children())
+    references = [cursor.referenced for cursor in tu.cursor.walk_preorder() if cursor.kind == clang.cindex.CursorKind.TYPE_REF]
+    variables = [cursor for cursor in tu.cursor.get_children() if cursor.kind == clang.cindex.CursorKind.VAR_DECL]
+    return tu, class_a, references, variables
+
+def test_cursor_keys_match_cursor_equality(ingester, tmp_path, monkeypatch):
+    import cursor_identity
+    from cursor_identity import get_cursor_key, CursorKey
+    tu, class_a, references, variables = get_class_cursors(tmp_path)
+    assert len(references) == 2 and len(variables) == 2
+
+    for has_cursor_fields in (True, False):
+        monkeypatch.setattr(cursor_identity, "has_cursor_fields", has_cursor_fields)
+        assert isinstance(get_cursor_key(class_a), CursorKey) != has_cursor_fields
+        keys = {get_cursor_key(class_a): "A"}
+        assert [keys.get(get_cursor_key(cursor)) for cursor in references] == ["A", "A"]
+        assert get_cursor_key(variables[0]) != get_cursor_key(variables[1])
+        assert get_cursor_key(variables[0]) not in keys
+
+# Cursor of bindings without the private ctypes fields
+class PublicCursor:
+    def __init__(self, hash):
+        self.hash = hash
+
+    def __eq__(self, other):
+        return self.hash == other.hash
+
+def test_bindings_without_cursor_fields_fall_back_to_cursor_key(monkeypatch):
+    import cursor_identity
+    from cursor_identity import get_cursor_key, CursorKey
+    monkeypatch.setattr(cursor_identity, "has_cursor_fields", None)
+    key = get_cursor_key(PublicCursor(7))
+    assert isinstance(key, CursorKey)
+    assert cursor_identity.has_cursor_fields is False
+    assert key == get_cursor_key(PublicCursor(7))
+    assert key != get_cursor_key(PublicCursor(8))
+
+def test_extraction_state_is_reset_for_every_unit(ingester, translation_units):
+    vertices, edges = ingest(ingester, translation_units)
+
+    # Only the ids of the last unit are left
+    assert len(ingester.processed_cursors_ids) <= len(ingester.id_table.strings) < len(vertices)
+
+    # Parallel workers forked now start from an empty state as well
+    assert ingest(ingester, translation_units, 2) == (vertices, edges)
+    assert ingest(ingester, translation_units) == (vertices, edges)
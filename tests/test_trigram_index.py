@@ -0,0 +1,56 @@
+#############################################
+# Trigram index: substring, prefix and suffix
+# lookups against a brute force scan, incremental
+# rebuilds and the graph version check.
+#############################################
+
+import itertools
+
+from trigram_index import TrigramIndexBuilder, load_trigram_index, matches
+
+SPELLINGS = ["Widget", "WidgetFactory", "make_widget", "Gadget", "get", "id", "Ωmega"]
+
+def build(tmp_path, documents, graph_version="v1"):
+    builder = TrigramIndexBuilder()
+    for id, spelling, file in documents:
+        builder.add_vertex({"id": id, "spelling": spelling, "file": file})
+    path = str(tmp_path / "trigram.idx")
+    builder.save(path, graph_version)
+    return builder, path
+
+def test_find_matches_a_scan(tmp_path):
+    documents = [(f"v{i}", spelling, f"f{i % 2}") for i, spelling in enumerate(SPELLINGS)]
+    builder, path = build(tmp_path, documents)
+    index = load_trigram_index(path, "v1")
+    try:
+        for predicate, text in itertools.product(('containing', 'startingWith', 'endingWith'),
+                                                 ("idget", "Wid", "get", "Ωm", "xyz")):
+            expected = sorted(id for id, spelling, file in documents if matches(predicate, spelling, text))
+            assert index.find('spelling', predicate, text) == expected, (predicate, text)
+        # Framed by the start or end of the value two characters have a trigram
+        assert index.find('spelling', 'endingWith', "et") == ["v0", "v2", "v3", "v4"]
+        assert index.find('spelling', 'startingWith', "id") == ["v5"]
+        # Too short for a trigram, or not an indexed property
+        assert index.find('spelling', 'containing', "et") is None
+        assert index.find('kind', 'containing', "Widget") is None
+        assert dict(index.iterate_documents())["v6"] == ("Ωmega", "", "f0")
+    finally:
+        index.close()
+
+def test_rebuild_without_dropped_files_and_version_check(tmp_path):
+    builder, path = build(tmp_path, [("a", "Alpha", "f1"), ("b", "Alphabet", "f2")])
+    assert load_trigram_index(path, "v2") is None
+
+    index = load_trigram_index(path, "v1")
+    builder = TrigramIndexBuilder()
+    builder.load_index(index)
+    index.close()
+    builder.remove_files({"f2"})
+    builder.add_vertex({"id": "c", "spelling": "Alphanumeric", "file": "f2"})
+    builder.save(path, "v2")
+
+    index = load_trigram_index(path, "v2")
+    try:
+        assert index.find('spelling', 'startingWith', "Alpha") == ["a", "c"]
+    finally:
+        index.close()
@@ -0,0 +1,100 @@
+#############################################
+# Cache of parsed translation units: hits while
+# the unit and its headers are unchanged, misses
+# after an edit or with other arguments, eviction
+# by age and size, and the ingested graph.
+#############################################
+
+import os
+import time
+
+from test_header_ownership import ingest
+
+ARGS = ['-x', 'c++', '-std=c++11']
+
+def write_file(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def create_unit(tmp_path):
+    write_file(tmp_path / "a.hpp", "#pragma once\nclass A { int x; };\n")
+    write_file(tmp_path / "main.cpp", '#include "a.hpp"\nint main() { A a; return 0; }\n')
+    return str(tmp_path / "main.cpp")
+
+def get_spellings(translation_unit):
+    return [cursor.spelling for cursor in translation_unit.cursor.walk_preorder() if cursor.spelling]
+
+def test_unchanged_unit_is_read_from_the_cache(ingester, tmp_path):
+    import clang.cindex
+    from tu_cache import TranslationUnitCache
+    index = clang.cindex.Index.create()
+    file_path = create_unit(tmp_path)
+    cache = TranslationUnitCache(str(tmp_path / "cache"))
+
+    assert cache.load(index, file_path, ARGS) is None
+    parsed = index.parse(file_path, args=ARGS)
+    cache.store(parsed, file_path, ARGS)
+
+    loaded = cache.load(index, file_path, ARGS)
+    assert loaded is not None
+    assert get_spellings(loaded) == get_spellings(parsed)
+
+    # Other arguments or parse options are other entries
+    assert cache.load(index, file_path, ARGS + ['-DX=1']) is None
+    assert cache.load(index, file_path, ARGS, clang.cindex.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES) is None
+
+    # libclang does not read a unit back once a file got a newer modification time,
+    # the entry is dropped and the unit is parsed (and stored) again
+    os.utime(tmp_path / "a.hpp", (time.time() + 10, time.time() + 10))
+    assert cache.load(index, file_path, ARGS) is None
+    cache.store(index.parse(file_path, args=ARGS), file_path, ARGS)
+    assert get_spellings(cache.load(index, file_path, ARGS)) == get_spellings(parsed)
+
+def test_edited_header_invalidates_the_entry(ingester, tmp_path):
+    import clang.cindex
+    from tu_cache import TranslationUnitCache
+    index = clang.cindex.Index.create()
+    file_path = create_unit(tmp_path)
+    cache = TranslationUnitCache(str(tmp_path / "cache"))
+    cache.store(index.parse(file_path, args=ARGS), file_path, ARGS)
+
+    write_file(tmp_path / "a.hpp", "#pragma once\nclass A { int x; int y; };\n")
+    assert cache.load(index, file_path, ARGS) is None
+    assert os.listdir(tmp_path / "cache") == []
+
+def test_eviction_by_age_and_size(ingester, tmp_path):
+    import clang.cindex
+    from tu_cache import TranslationUnitCache
+    index = clang.cindex.Index.create()
+    file_path = create_unit(tmp_path)
+    directory = str(tmp_path / "cache")
+    cache = TranslationUnitCache(directory, max_age=3600)
+    for define in ('-DA', '-DB', '-DC'):
+        cache.store(index.parse(file_path, args=ARGS + [define]), file_path, ARGS + [define])
+    assert cache.evict() == 0
+
+    # Entry A was not used for two hours, B is older than C
+    ast_path, _ = cache.get_paths(cache.get_key(file_path, ARGS + ['-DA'], 0))
+    os.utime(ast_path, (time.time() - 7200, time.time() - 7200))
+    ast_path, _ = cache.get_paths(cache.get_key(file_path, ARGS + ['-DB'], 0))
+    os.utime(ast_path, (time.time() - 60, time.time() - 60))
+    assert cache.evict() == 1
+    assert cache.load(index, file_path, ARGS + ['-DA']) is None
+
+    # Above the size limit the least recently used entries go first
+    cache.max_size = os.path.getsize(ast_path) + 1
+    assert cache.evict() == 1
+    assert cache.load(index, file_path, ARGS + ['-DB']) is None
+    assert cache.load(index, file_path, ARGS + ['-DC']) is not None
+
+def test_ingestion_from_the_cache_gives_the_same_graph(ingester, translation_units, tmp_path):
+    from metrics import metrics
+    tu_cache_path = str(tmp_path / "cache")
+    metrics.reset()
+    graph = ingest(ingester, translation_units, tu_cache_path=tu_cache_path)
+    assert metrics.get_counter("tu_cache_lookups", result="miss") == len(translation_units)
+
+    metrics.reset()
+    assert ingest(ingester, translation_units, tu_cache_path=tu_cache_path) == graph
+    assert metrics.get_counter("tu_cache_lookups", result="hit") == len(translation_units)
+    assert ingest(ingester, translation_units) == graph
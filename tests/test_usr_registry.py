@@ -0,0 +1,33 @@
+#############################################
+# Shared vertex id registry: every id is claimed
+# by exactly one of the worker processes.
+#############################################
+
+from concurrent.futures import ProcessPoolExecutor
+
+from usr_registry import UsrRegistry, start_usr_registry
+
+def test_claim_returns_only_new_ids():
+    registry = UsrRegistry()
+    assert registry.claim(["a", "b"]) == ["a", "b"]
+    assert registry.claim(["b", "c", "a"]) == ["c"]
+    assert registry.size() == 3
+
+def claim_all(registry, worker, ids):
+    return worker, registry.claim(ids)
+
+def test_worker_processes_claim_every_id_once():
+    manager, registry = start_usr_registry()
+    try:
+        # Every worker claims overlapping ranges, in a different order
+        ranges = [[f"c:@S@C{i}" for i in range(start, start + 400)][::1 if start % 200 else -1]
+                  for start in range(0, 800, 100)]
+        with ProcessPoolExecutor(4) as executor:
+            results = list(executor.map(claim_all, [registry] * len(ranges), range(len(ranges)), ranges))
+
+        claimed = [id for _, ids in results for id in ids]
+        assert len(claimed) == len(set(claimed))
+        assert set(claimed) == {id for ids in ranges for id in ids}
+        assert registry.size() == len(claimed)
+    finally:
+        manager.shutdown()
@@ -0,0 +1,60 @@
+#############################################
+# Vector index: block-wise top k against a full
+# sort, retrieval of the relevant declaration and
+# the graph version check.
+#############################################
+
+import numpy as np
+
+import vector_index
+from vector_index import VectorIndexBuilder, load_vector_index, clean_comment
+
+DECLARATIONS = [
+    ("serialize", "void Archive::serialize(Writer &writer)", "/// Writes the archive into the writer"),
+    ("parse_json", "Value parse_json(const std::string &text)", "// Parses a JSON document"),
+    ("Socket::connect", "bool Socket::connect(const Address &address)", "/** Opens a TCP connection */"),
+    ("Matrix::inverse", "Matrix Matrix::inverse() const", ""),
+    ("deserialize", "Archive deserialize(Reader &reader)", "/// Reads an archive back"),
+]
+
+def build(tmp_path, graph_version="v1"):
+    builder = VectorIndexBuilder()
+    for i, (name, signature, comment) in enumerate(DECLARATIONS):
+        builder.add_vertex({"id": f"v{i}", "qualified_name": name, "signature": signature,
+                            "raw_comment": comment, "file": f"f{i % 2}"})
+    # Neither signature nor doc comment, nothing to index
+    builder.add_vertex({"id": "ns", "spelling": "net", "file": "f0"})
+    path = str(tmp_path / "vector.idx")
+    builder.save(path, graph_version)
+    return path
+
+def test_clean_comment():
+    assert clean_comment("/**\n * Opens a\n * connection.\n */") == "Opens a connection."
+    assert clean_comment("///< Count of items") == "Count of items"
+
+def test_search_finds_the_declaration(tmp_path):
+    path = build(tmp_path)
+    assert load_vector_index(path, "v2") is None
+    index = load_vector_index(path, "v1")
+    try:
+        assert index.document_count == len(DECLARATIONS)
+        results = index.search(["how is a TCP connection opened", "which function parses json"], k=2)
+        assert results[0][0]["id"] == "v2"
+        assert results[1][0]["name"] == "parse_json"
+    finally:
+        index.close()
+
+def test_block_wise_top_k_matches_a_full_sort(tmp_path, monkeypatch):
+    path = build(tmp_path)
+    index = load_vector_index(path, "v1")
+    try:
+        monkeypatch.setattr(vector_index, "SEARCH_BLOCK_SIZE", 2)
+        query_vectors = index.embedder.embed(["serialize archive writer", "matrix inverse", "socket"])
+        scores = query_vectors @ np.asarray(index.vectors).T
+        for k in (1, 3, 5):
+            for row, matches in enumerate(index.search_vectors(query_vectors, k)):
+                expected = np.sort(scores[row])[::-1][:k]
+                assert np.allclose([score for document, score in matches], expected)
+                assert all(np.isclose(scores[row, document], score) for document, score in matches)
+    finally:
+        index.close()
@@ -0,0 +1,13 @@
+#############################################
+# Pruning of the AST walk: expressions are skipped
+# by default, the local declarations of function
+# bodies still become vertices.
+#############################################
+
+from test_header_ownership import ingest
+
+def test_pruned_walk_keeps_local_declarations(ingester, translation_units):
+    vertices, edges = ingest(ingester, translation_units, extract_references=False)
+    assert any(label == "VAR_DECL" and properties["id"].startswith("c:") and "@F@" in properties["id"]
+               for label, properties in vertices.values())
+    assert (vertices, edges) == ingest(ingester, translation_units, extract_references=True)
@@ -0,0 +1,127 @@
+#############################################
+# Local trigram inverted index over the spelling,
+# usr and file properties of the vertices, built
+# by the ingester and memory-mapped by the chatbot.
+# Substring, prefix and suffix predicates
+# (TextP.containing/startingWith/endingWith) are
+# resolved into vertex ids through it, so the graph
+# only fetches those vertices by id instead of
+# scanning all of them.
+#
+# Values are indexed as bytes framed by \x02 and
+# \x03, so prefixes and suffixes have their own
+# trigrams. Candidates from the postings are checked
+# against the stored values, the ids are exact.
+# The file format and the graph version check are
+# the ones of document_index.py.
+#############################################
+
+from document_index import DocumentIndexBuilder, DocumentIndex, load_document_index
+from graph_metadata import GRAPH_METADATA_LABEL
+from gremlin_writer import submit_with_retries
+from bisect import bisect_left
+import array
+
+INDEX_MAGIC = b"CPPRAGTI"
+INDEX_VERSION = 1
+
+INDEXED_FIELDS = ('spelling', 'usr', 'file')
+
+# Predicates the index answers, with the framing of the searched text
+INDEXED_PREDICATES = {
+    'containing': (b"", b""),
+    'startingWith': (b"\x02", b""),
+    'endingWith': (b"", b"\x03"),
+}
+
+def get_trigrams(data):
+    return {data[i:i + 3] for i in range(len(data) - 2)}
+
+# Postings key of a trigram of a field: the field number and the three bytes in one uint32
+def get_key(field, trigram):
+    return (field << 24) | (trigram[0] << 16) | (trigram[1] << 8) | trigram[2]
+
+def matches(predicate, value, text):
+    if predicate == 'containing':
+        return text in value
+    if predicate == 'startingWith':
+        return value.startswith(text)
+    return value.endswith(text)
+
+class TrigramIndexBuilder(DocumentIndexBuilder):
+    fields = INDEXED_FIELDS
+    file_field = 'file'
+
+    def add_vertex(self, properties):
+        self.documents[properties["id"]] = tuple(str(properties.get(field) or "") for field in INDEXED_FIELDS)
+
+    # All vertices of the graph, when there is no index of its current version to start from
+    def load_graph(self, gremlin_client, max_retries=10):
+        query = ("g.V().not(hasLabel(metadata_label)).project('id', 'spelling', 'usr', 'file').by(id)"
+                 ".by(coalesce(values('spelling'), constant(''))).by(coalesce(values('usr'), constant('')))"
+                 ".by(coalesce(values('file'), constant('')))")
+        for row in submit_with_retries(gremlin_client, query, {"metadata_label": GRAPH_METADATA_LABEL}, max_retries):
+            self.add_vertex(row)
+
+    # Sections after the documents: sorted postings keys (uint32), postings offsets (uint64),
+    # postings (uint32 document numbers)
+    def save(self, path, graph_version):
+        ids = sorted(self.documents)
+        postings = {}
+        for number, id in enumerate(ids):
+            for field, value in enumerate(self.documents[id]):
+                for trigram in get_trigrams(b"\x02" + value.encode('utf-8') + b"\x03"):
+                    postings.setdefault(get_key(field, trigram), []).append(number)
+
+        keys = array.array('I', sorted(postings))
+        posting_offsets = array.array('Q', [0])
+        posting_numbers = array.array('I')
+        for key in keys:
+            posting_numbers.extend(postings[key])
+            posting_offsets.append(len(posting_numbers))
+
+        sections = [(name, len(data), [data]) for name, data in (
+            ("keys", keys.tobytes()), ("posting_offsets", posting_offsets.tobytes()), ("postings", posting_numbers.tobytes()))]
+        self.write(path, INDEX_MAGIC, INDEX_VERSION, ids, {"graph_version": graph_version}, sections)
+
+class TrigramIndex(DocumentIndex):
+    magic = INDEX_MAGIC
+    version = INDEX_VERSION
+    kind = "trigram index"
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.keys = self.section("keys", 'I')
+        self.posting_offsets = self.section("posting_offsets", 'Q')
+        self.postings = self.section("postings", 'I')
+
+    def get_postings(self, key):
+        index = bisect_left(self.keys, key)
+        if index == len(self.keys) or self.keys[index] != key:
+            return ()
+        return self.postings[self.posting_offsets[index]:self.posting_offsets[index + 1]]
+
+    # Ids of the vertices whose property matches TextP.<predicate>(text), None when the index can not
+    # answer it (other property or predicate, or text too short to have a trigram)
+    def find(self, key, predicate, text):
+        if key not in self.fields or predicate not in INDEXED_PREDICATES:
+            return None
+        prefix, suffix = INDEXED_PREDICATES[predicate]
+        trigrams = get_trigrams(prefix + text.encode('utf-8') + suffix)
+        if not trigrams:
+            return None
+
+        field = self.fields.index(key)
+        postings = sorted((self.get_postings(get_key(field, trigram)) for trigram in trigrams), key=len)
+        candidates = set(postings[0])
+        for numbers in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(numbers)
+
+        return [self.get_document_string(document, 0) for document in sorted(candidates)
+                if matches(predicate, self.get_document_string(document, 1 + field), text)]
+
+# Index of the graph version, None if there is none (or it was written for another version)
+def load_trigram_index(path, graph_version):
+    return load_document_index(TrigramIndex, path, graph_version)
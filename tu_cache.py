@@ -0,0 +1,136 @@
+#############################################
+# Persistent cache of parsed translation units.
+# Parsed units are saved with libclang's AST
+# serialization (TranslationUnit.save) and read
+# back with Index.read instead of parsing again,
+# as long as the file, the compile flags and the
+# content of every included file are unchanged.
+# Entries are evicted by age and total size.
+#############################################
+
+from ingest_manifest import hash_file_content
+from metrics import metrics
+import clang.cindex
+import hashlib
+import json
+import os
+import time
+
+class TranslationUnitCache:
+    def __init__(self, directory, max_size=4 << 30, max_age=7 * 24 * 3600):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, file_path, clang_args, options):
+        key = json.dumps([os.path.abspath(file_path), clang_args, options])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get_paths(self, key):
+        return os.path.join(self.directory, key + ".ast"), os.path.join(self.directory, key + ".json")
+
+    # True if every file stored with the entry still has the same content.
+    # Files are only hashed again when their size or modification time changed.
+    # libclang itself refuses to read a unit whose files have another modification time,
+    # so a touched file still costs a parse (load() drops the entry when Index.read fails).
+    def is_entry_valid(self, entry):
+        for file_path, stored in entry["files"].items():
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return False
+            if stored["size"] == stat.st_size and stored["mtime"] == stat.st_mtime:
+                continue
+            if stored["size"] != stat.st_size or stored["hash"] != hash_file_content(file_path):
+                return False
+        return True
+
+    # Parsed translation unit from the cache, None if there is no valid entry
+    def load(self, index, file_path, clang_args, options=0):
+        key = self.get_key(file_path, clang_args, options)
+        ast_path, entry_path = self.get_paths(key)
+
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry["file"] != os.path.abspath(file_path) or entry["args"] != clang_args or not self.is_entry_valid(entry):
+            self.remove(key)
+            return None
+
+        try:
+            translation_unit = index.read(ast_path)
+        except clang.cindex.TranslationUnitLoadError:
+            # Written by another libclang version or damaged
+            self.remove(key)
+            return None
+
+        # Age of an entry is counted from its last use
+        os.utime(ast_path)
+        return translation_unit
+
+    def store(self, translation_unit, file_path, clang_args, options=0):
+        key = self.get_key(file_path, clang_args, options)
+        ast_path, entry_path = self.get_paths(key)
+
+        file_paths = {translation_unit.spelling}
+        for inclusion in translation_unit.get_includes():
+            file_paths.add(inclusion.include.name)
+
+        files = {}
+        for path in file_paths:
+            try:
+                stat = os.stat(path)
+                files[path] = {"hash": hash_file_content(path), "size": stat.st_size, "mtime": stat.st_mtime}
+            except OSError:
+                # A file which can not be read can not be checked later
+                return
+
+        # Written under temporary names first, other processes may read the cache at the same time
+        suffix = f".{os.getpid()}.tmp"
+        try:
+            translation_unit.save(ast_path + suffix)
+            with open(entry_path + suffix, 'w', encoding='utf-8') as f:
+                json.dump({"file": os.path.abspath(file_path), "args": clang_args, "options": options, "files": files}, f)
+            os.replace(ast_path + suffix, ast_path)
+            os.replace(entry_path + suffix, entry_path)
+        except (OSError, clang.cindex.TranslationUnitSaveError) as e:
+            metrics.count_error("tu_cache")
+            print(f"ERROR saving parsed translation unit {file_path} to the cache: {e}")
+            for path in (ast_path + suffix, entry_path + suffix):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def remove(self, key):
+        for path in self.get_paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # Removes entries not used for max_age seconds, then the least recently used ones above max_size
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".ast"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name[:-len(".ast")]))
+
+        entries.sort()
+        now = time.time()
+        total_size = sum(size for _, size, _ in entries)
+        removed = 0
+        for last_used, size, key in entries:
+            if now - last_used <= self.max_age and total_size <= self.max_size:
+                break
+            self.remove(key)
+            total_size -= size
+            removed += 1
+        return removed
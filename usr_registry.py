@@ -0,0 +1,36 @@
+#############################################
+# Registry of vertex ids (USR based) shared by
+# the ingestion worker processes, so that every
+# vertex is emitted by exactly one worker. The
+# header ownership claims (header_ownership.py)
+# go through a registry of their own.
+#############################################
+
+from multiprocessing.managers import BaseManager
+import threading
+
+class UsrRegistry:
+    def __init__(self):
+        self.ids = set()
+        self.lock = threading.Lock()
+
+    # Claims the ids for the caller, returns only those no other caller has claimed before
+    def claim(self, ids):
+        with self.lock:
+            claimed = [id for id in ids if id not in self.ids]
+            self.ids.update(claimed)
+        return claimed
+
+    def size(self):
+        return len(self.ids)
+
+class UsrRegistryManager(BaseManager):
+    pass
+
+UsrRegistryManager.register('UsrRegistry', UsrRegistry)
+
+# Starts the manager process, the returned registry proxy can be passed to worker processes
+def start_usr_registry():
+    manager = UsrRegistryManager()
+    manager.start()
+    return manager, manager.UsrRegistry()
@@ -0,0 +1,246 @@
+#############################################
+# Vector index over the declaration signatures and
+# doc comments of the vertices, built by the
+# ingester and memory-mapped by the chatbot. The
+# question is embedded the same way and the vertices
+# with the most similar documents become candidates
+# the generated Gremlin query can start from
+# (hybrid retrieval: similarity search first, then
+# the graph lookup by id).
+#
+# Embedders are pluggable (register_embedder), the
+# index stores the name and configuration of the one
+# it was built with. The default "hashing" embedder is
+# deterministic and works offline: hashed identifier
+# tokens, their stems and bigrams weighted by TF-IDF.
+# The file format and the graph version check are
+# the ones of document_index.py.
+#############################################
+
+from document_index import DocumentIndexBuilder, DocumentIndex, load_document_index
+from graph_metadata import GRAPH_METADATA_LABEL
+from gremlin_writer import submit_with_retries
+import hashlib
+import math
+import re
+import numpy as np
+
+INDEX_MAGIC = b"CPPRAGVI"
+INDEX_VERSION = 1
+
+# Per document: the id, then these fields
+DOCUMENT_FIELDS = ('file', 'name', 'signature', 'text')
+
+DEFAULT_DIMENSIONS = 1024
+# Rows of the index multiplied with the queries at once
+SEARCH_BLOCK_SIZE = 65536
+# Documents embedded at once while the index is written
+EMBED_BATCH_SIZE = 10000
+
+#############################################
+# Documents
+#############################################
+
+comment_marker_pattern = re.compile(r"^\s*(/\*+!?|\*+/|\*+(?!/)|//+[!<]?)|\*+/\s*$")
+
+# Doc comment without the comment markers (the ingester cut it to max_comment_length already)
+def clean_comment(comment):
+    lines = (comment_marker_pattern.sub("", line).strip() for line in comment.splitlines())
+    return " ".join(line for line in lines if line)
+
+# (name, signature, text) of a vertex, None for vertices without signature and doc comment
+def get_document(properties):
+    signature = properties.get("signature") or ""
+    comment = properties.get("raw_comment") or ""
+    if not signature and not comment:
+        return None
+    name = properties.get("qualified_name") or properties.get("spelling") or ""
+    text = " ".join(part for part in (name, signature, clean_comment(comment)) if part)
+    return name, signature, text
+
+#############################################
+# Embedders
+#############################################
+
+identifier_pattern = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+STOP_WORDS = {'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does', 'for', 'from', 'how', 'i',
+              'if', 'in', 'is', 'it', 'of', 'on', 'or', 'the', 'this', 'to', 'what', 'when', 'which', 'with'}
+STEM_LENGTH = 5
+
+# Lower case words of the text, identifiers are split at '_', '::' and camel case humps
+def tokenize(text):
+    tokens = []
+    for word in identifier_pattern.findall(text):
+        word = word.lower()
+        if len(word) > 1 and word not in STOP_WORDS:
+            tokens.append(word)
+    return tokens
+
+# Words, their stems (serialize, serializer and serialization share one) and adjacent word pairs
+def get_features(text):
+    tokens = tokenize(text)
+    features = list(tokens)
+    features += [token[:STEM_LENGTH] + "~" for token in tokens if len(token) > STEM_LENGTH]
+    features += [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    return features
+
+# Bucket and sign of a feature, stable across processes (unlike hash())
+def hash_feature(feature, dimensions):
+    value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+    return value % dimensions, 1.0 if value >> 63 else -1.0
+
+class HashingEmbedder:
+    name = "hashing"
+
+    def __init__(self, dimensions=DEFAULT_DIMENSIONS, idf=None):
+        self.dimensions = dimensions
+        self.idf = np.asarray(idf, dtype=np.float32) if idf is not None else np.ones(dimensions, dtype=np.float32)
+        self.feature_buckets = {}
+
+    @staticmethod
+    def from_config(config):
+        return HashingEmbedder(config["dimensions"], config.get("idf"))
+
+    def get_config(self):
+        return {"name": self.name, "dimensions": self.dimensions, "idf": [round(float(value), 5) for value in self.idf]}
+
+    def get_bucket(self, feature):
+        bucket = self.feature_buckets.get(feature)
+        if bucket is None:
+            bucket = hash_feature(feature, self.dimensions)
+            if len(self.feature_buckets) < 1 << 20:
+                self.feature_buckets[feature] = bucket
+        return bucket
+
+    # Inverse document frequencies of the buckets over the indexed documents
+    def fit(self, texts):
+        document_frequencies = np.zeros(self.dimensions, dtype=np.float64)
+        for text in texts:
+            for bucket in {self.get_bucket(feature)[0] for feature in get_features(text)}:
+                document_frequencies[bucket] += 1
+        self.idf = (np.log((1 + len(texts)) / (1 + document_frequencies)) + 1).astype(np.float32)
+
+    # L2 normalized float32 rows, sublinear term frequencies weighted by the idf
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = {}
+            for feature in get_features(text):
+                bucket = self.get_bucket(feature)
+                counts[bucket] = counts.get(bucket, 0) + 1
+            for (bucket, sign), count in counts.items():
+                vectors[row, bucket] += sign * (1 + math.log(count))
+        vectors *= self.idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+# name -> class with from_config(config), get_config(), fit(texts) and embed(texts)
+EMBEDDERS = {HashingEmbedder.name: HashingEmbedder}
+
+def register_embedder(embedder_class):
+    EMBEDDERS[embedder_class.name] = embedder_class
+
+def create_embedder(config):
+    embedder_class = EMBEDDERS.get(config["name"])
+    if embedder_class is None:
+        raise ValueError(f"unknown embedder {config['name']}")
+    return embedder_class.from_config(config)
+
+#############################################
+# Index
+#############################################
+
+class VectorIndexBuilder(DocumentIndexBuilder):
+    fields = DOCUMENT_FIELDS
+    file_field = 'file'
+
+    def __init__(self, embedder=None):
+        super().__init__()
+        self.embedder = embedder or HashingEmbedder()
+
+    def add_vertex(self, properties):
+        document = get_document(properties)
+        if document is not None:
+            self.documents[properties["id"]] = (str(properties.get("file") or ""),) + document
+
+    # All documented vertices of the graph, when there is no index of its current version to start from
+    def load_graph(self, gremlin_client, max_retries=10):
+        query = ("g.V().not(hasLabel(metadata_label)).or(has('signature'), has('raw_comment'))"
+                 ".project('id', 'file', 'qualified_name', 'spelling', 'signature', 'raw_comment').by(id)"
+                 ".by(coalesce(values('file'), constant(''))).by(coalesce(values('qualified_name'), constant('')))"
+                 ".by(coalesce(values('spelling'), constant(''))).by(coalesce(values('signature'), constant('')))"
+                 ".by(coalesce(values('raw_comment'), constant('')))")
+        for row in submit_with_retries(gremlin_client, query, {"metadata_label": GRAPH_METADATA_LABEL}, max_retries):
+            self.add_vertex(row)
+
+    # Section after the documents: vectors (float32, one row per document), the header
+    # holds the embedder configuration
+    def save(self, path, graph_version):
+        ids = sorted(self.documents)
+        texts = [self.documents[id][-1] for id in ids]
+        self.embedder.fit(texts)
+
+        config = self.embedder.get_config()
+        vectors = (self.embedder.embed(texts[start:start + EMBED_BATCH_SIZE]).tobytes()
+                   for start in range(0, len(texts), EMBED_BATCH_SIZE))
+        sections = [("vectors", len(ids) * config["dimensions"] * 4, vectors)]
+        self.write(path, INDEX_MAGIC, INDEX_VERSION, ids, {"graph_version": graph_version, "embedder": config}, sections)
+
+class VectorIndex(DocumentIndex):
+    magic = INDEX_MAGIC
+    version = INDEX_VERSION
+    kind = "vector index"
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.embedder = create_embedder(self.header["embedder"])
+        offset, _ = self.header["sections"]["vectors"]
+        self.vectors = np.frombuffer(self.data, dtype=np.float32, count=self.document_count * self.embedder.dimensions,
+                                     offset=offset).reshape(self.document_count, self.embedder.dimensions)
+
+    def close(self):
+        # The array holds the map too
+        self.__dict__.pop('vectors', None)
+        super().close()
+
+    # Best k documents of every query as [(document number, score)], the index is multiplied
+    # with all queries at once block by block, only the k best of each block are kept
+    def search_vectors(self, query_vectors, k):
+        best_documents = np.zeros((len(query_vectors), 0), dtype=np.int64)
+        best_scores = np.zeros((len(query_vectors), 0), dtype=np.float32)
+        for start in range(0, self.document_count, SEARCH_BLOCK_SIZE):
+            scores = query_vectors @ self.vectors[start:start + SEARCH_BLOCK_SIZE].T
+            documents = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            scores = np.concatenate((best_scores, scores), axis=1)
+            documents = np.concatenate((best_documents, documents), axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                documents = np.take_along_axis(documents, top, axis=1)
+            best_scores, best_documents = scores, documents
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_documents = np.take_along_axis(best_documents, order, axis=1)
+        return [list(zip(documents.tolist(), scores.tolist())) for documents, scores in zip(best_documents, best_scores)]
+
+    # Candidates of every query text as [{"id", "name", "signature", "score"}], at most k with at least min_score
+    def search(self, texts, k=10, min_score=0.0):
+        if not texts or not self.document_count or k <= 0:
+            return [[] for _ in texts]
+        name_field = 1 + self.fields.index('name')
+        signature_field = 1 + self.fields.index('signature')
+        results = []
+        for matches in self.search_vectors(self.embedder.embed(texts), k):
+            results.append([{
+                "id": self.get_document_string(document, 0),
+                "name": self.get_document_string(document, name_field),
+                "signature": self.get_document_string(document, signature_field),
+                "score": round(score, 4)
+            } for document, score in matches if score >= min_score and score > 0])
+        return results
+
+# Index of the graph version, None if there is none (or it was written for another version)
+def load_vector_index(path, graph_version):
+    return load_document_index(VectorIndex, path, graph_version)